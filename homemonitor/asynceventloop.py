@@ -0,0 +1,143 @@
+"""Main event loop, using asyncio."""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from homemonitor.eventloop import EventLoop
+
+
+class AsyncEventLoop(EventLoop):
+    """Main event loop, using asyncio.
+
+    Works the same as :class:`homemonitor.eventloop.EventLoop`, except polling the
+    sensors and sending email run as coroutines.  The sensor drivers and smtplib block,
+    so they are run on threads.  Email is sent in the background, so a slow
+    SMTP server or Internet check does not hold up polling the sensors.
+
+    Example::
+
+        eventloop = AsyncEventLoop.from_config(cfg, mailqueue, sensors)
+        eventloop.run()
+
+    """
+    def __init__(self, *args, **kwargs):
+        """Constructor.  Takes the same parameters as
+        :class:`homemonitor.eventloop.EventLoop`.
+
+        If max_workers is 0, one thread per sensor is used.
+        """
+        super().__init__(*args, **kwargs)
+        self._mail_executor = None
+        self._delivery = None
+        self._delivery_requested = False
+
+    def run(self):
+        """Runs the main loop of the program."""
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        """Runs the main loop of the program.
+
+        * Sleep until the next sensor is due.
+        * Refresh status of the sensors that are due, at the same time.
+        * If the status changed, add email to the queue.
+        * Start sending email in the background, unless it is still sending
+          from a previous loop.
+        """
+        self.logger.info('Entering the main event loop...')
+
+        if self._scheduler is None:
+            self._scheduler = self._create_scheduler()
+
+        while True:
+            await self._wait()
+            due = self._pop_due()
+            statuses = await self._poll_sensors_async(self._due_sensors(due))
+            self._queue_emails(statuses + await self._poll_banks_async(due))
+            self._reschedule_all(due)
+            self._log_metrics_periodically()
+
+            self._start_delivery()
+
+            if not self.loop_forever:
+                await self._delivery
+                break
+
+    async def _wait(self):
+        """Sleeps until the next sensor is due, or the poll interval if there are none."""
+        next_due = self._scheduler.next_due()
+        if next_due is None:
+            await asyncio.sleep(self.poll_interval_in_seconds)
+            return
+        delay = next_due - self._scheduler.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _poll_sensors_async(self, sensors):
+        """Refreshes the status of the sensors, at the same time.
+
+        Each sensor is given its own deadline, the same as
+        :meth:`homemonitor.eventloop.EventLoop._poll_sensors_concurrently`.
+
+        :param list[homemonitor.sensor.Sensor] sensors: Sensors to poll.
+        :return: New status of the sensors that responded, in the same order as they were given.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        self._submit_polls(sensors, self.max_workers or max(1, len(self.sensors)))
+        statuses = await asyncio.gather(*[self._wait_for_poll(sensor) for sensor in sensors])
+        return [status for status in statuses if status is not None]
+
+    async def _poll_banks_async(self, due):
+        """Polls the banks that are due, at the same time, on threads.
+
+        :param list[tuple[int, float]] due: Index and due time of each sensor and bank.
+        :return: Status of each sensor in the banks whose status changed, in bank order.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(None, bank.poll)
+                                         for bank in self._due_banks(due)])
+        return [status for statuses in results for status in statuses]
+
+    async def _wait_for_poll(self, sensor):
+        """Waits for a sensor's poll to finish, up to its deadline.
+
+        :param homemonitor.sensor.Sensor sensor: Sensor to wait for.
+        :return: New status of the sensor, or None if it did not respond in time.
+        :rtype: homemonitor.sensor.SensorStatus
+        """
+        future, deadline = self._pending_polls[sensor]
+        try:
+            # Shield the poll, so timing out does not cancel it.
+            status = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                            max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._poll_timed_out(sensor)
+            return None
+        del self._pending_polls[sensor]
+        return status
+
+    def _start_delivery(self):
+        """Starts sending email in the background.
+
+        Only one delivery runs at a time.  If the previous one is still running,
+        it sends again as soon as it finishes, so the new messages do not wait
+        for the next loop.
+        """
+        self._delivery_requested = True
+        if self._delivery is not None:
+            if not self._delivery.done():
+                return
+            # Raise any unexpected error, the same as EventLoop.
+            self._delivery.result()
+
+        if self._mail_executor is None:
+            self._mail_executor = ThreadPoolExecutor(max_workers=1)
+        self._delivery = asyncio.ensure_future(self._deliver())
+
+    async def _deliver(self):
+        """Sends email on the mail thread, until no more was queued while sending."""
+        loop = asyncio.get_running_loop()
+        while self._delivery_requested:
+            self._delivery_requested = False
+            await loop.run_in_executor(self._mail_executor, self.mailqueue.send)
@@ -1,7 +1,13 @@
 """Command Line Interface (cli)"""
 import sys
+import csv
+import datetime
 import getopt
+import json
+import math
 import os
+import signal
+import time
 from configparser import ConfigParser
 import configparser
 import logging
@@ -11,10 +17,17 @@ import homemonitor.version
 from homemonitor.mail import Mail
 from homemonitor.internetconnection import CheckInternetConnection
 from homemonitor.mailqueue import MailQueue, Message
+from homemonitor.mailstore import MailStore
 from homemonitor.eventloop import EventLoop
+from homemonitor.asynceventloop import AsyncEventLoop
 from homemonitor.temperaturesensor import TemperatureSensor
+from homemonitor.timeseries import TimeSeriesStore
+from homemonitor.replay import ThresholdReplay
+from homemonitor.zone import Zone
 
 DEFAULT_CONFIG_FILE = os.path.join(os.sep, 'home', 'pi', 'homemonitor', '.homemonitor.ini')
+# On exit, most seconds to wait for the mail queue to send.
+MAIL_STOP_TIMEOUT_IN_SECONDS = 30
 
 
 def _print_version():
@@ -26,8 +39,18 @@ def _print_help():
     print('    -h|--help: Print help.')
     print('    -v|--version: Version')
     print('    -t|--test: Send a test email and test all sensors.')
+    print('    -a|--async: Run the asyncio event loop, which sends email in the background.')
     print('    -c=|--config=: Give location of configuration file.')
     print('        Defaults to {}'.format(DEFAULT_CONFIG_FILE))
+    print('    --history=: Print the stored history of a sensor.  Ex: TemperatureSensor/Basement')
+    print('        --since=, --until=: Time range, as seconds since the epoch or ISO 8601 local')
+    print('            time.  Ex: 2018-05-15T21:00')
+    print('        --resolution=: raw, minute, hour, or day.  Defaults to raw.')
+    print('        --format=: csv or json.  Defaults to csv.')
+    print('    --replay=: Print how many emails each temperature threshold would have sent,')
+    print('        using the stored history of every temperature sensor.  Needs numpy.')
+    print('        Ex: 40,45,50 or 40:60 or 40:60:0.5 (start:stop:step, stop included)')
+    print('        Takes --since=, --until=, and --format= too.')
 
 
 def _send_test_mail(mailqueue):
@@ -44,7 +67,7 @@ def _send_test_mail(mailqueue):
                       'HomeMonitor')
     mailqueue.add(message)
     print('Sending test email to {}...'.format(mailqueue.mail.receivers))
-    mailqueue.send()
+    mailqueue.flush()
     print('Done.  Check your inbox.')
 
 
@@ -62,6 +85,157 @@ def _test_sensors(sensors):
 
     for sensor in sensors:
         sensor.status()
+        while sensor.retry_in_seconds is not None:
+            time.sleep(sensor.retry_in_seconds)
+            sensor.status()
+
+
+def _stop_mailqueue(mailqueue):
+    """Stops the mail queue, waiting at most MAIL_STOP_TIMEOUT_IN_SECONDS for it to send.
+
+    :param homemonitor.mailqueue.MailQueue mailqueue: Queue to stop.
+    """
+    if not mailqueue.stop(MAIL_STOP_TIMEOUT_IN_SECONDS):
+        logging.getLogger(__name__).warning('Exiting with %d unsent email(s).',
+                                            len(mailqueue.queue))
+
+
+def _exit_on_sigterm():
+    """Makes SIGTERM exit the same as Ctrl-C, so the history and mail queue are closed.
+
+    systemd stops the service with SIGTERM, which otherwise ends the program at once.
+    """
+    def handler(signum, _):
+        # A second SIGTERM does not interrupt closing everything.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+def _parse_time(text):
+    """Parses a time given on the command line.
+
+    :param str text: Seconds since the epoch, or ISO 8601 local time.  Ex: 2018-05-15T21:00
+    :return: Seconds since the epoch, or None if text is None.
+    :rtype: float
+    :raises ValueError: If text is not a time.
+    """
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def _format_time(timestamp):
+    """Returns a time as ISO 8601 local time."""
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+def _parse_thresholds(text):
+    """Parses the thresholds given on the command line.
+
+    :param str text: Comma separated numbers or start:stop:step ranges.  Ex: 40,45:50
+        A range includes stop if it is a whole number of steps from start, and never
+        goes past it.
+    :return: Thresholds.
+    :rtype: list[float]
+    :raises ValueError: If text is not valid, or a range is empty or reversed.
+    """
+    thresholds = []
+    for item in text.split(','):
+        if ':' not in item:
+            thresholds.append(float(item))
+            continue
+        parts = [float(part) for part in item.split(':')]
+        if len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] <= 0) or \
+                parts[1] < parts[0]:
+            raise ValueError('Threshold range {} is not valid!  Ex: 40:60:0.5'.format(item))
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) == 3 else 1.0
+        # Allow for rounding, so 40:60:0.1 still includes 60.
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        thresholds.extend(min(round(start + index * step, 9), stop) for index in range(count))
+    return thresholds
+
+
+def _writer(fields, output_format, file):
+    """Returns a function that prints one row of values.
+
+    :param tuple[str] fields: Names of the values.
+    :param str output_format: csv prints a header and comma separated values.
+        json prints one JSON object per line.
+    :param file: Where to print.
+    :raises ValueError: If the format is invalid.
+    """
+    _check_format(output_format)
+    if output_format == 'csv':
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(fields)
+        return writer.writerow
+
+    def write(values):
+        """Writes one JSON object per line."""
+        print(json.dumps(dict(zip(fields, values))), file=file)
+    return write
+
+
+def _check_format(output_format):
+    """Raises ValueError if the output format is not csv or json."""
+    if output_format not in ('csv', 'json'):
+        raise ValueError('Format {} is not valid!  Valid formats are: csv, json'.format(
+            output_format))
+
+
+def _print_replay(store, sensor_names, thresholds, since, until, output_format, file=None):
+    """Prints how many emails each threshold would have sent for each sensor.
+
+    :param homemonitor.timeseries.TimeSeriesStore store: Where the history is stored.
+    :param list[str] sensor_names: Names of the sensors.
+    :param list[float] thresholds: Alarm thresholds.
+    :param float since: Start of the range, or None.
+    :param float until: End of the range, or None.
+    :param str output_format: csv or json.
+    :param file: Where to print.  Defaults to stdout.
+    :raises ValueError: If the format is invalid or there is no history for a sensor.
+    :raises ImportError: If numpy is not installed.
+    """
+    results = ThresholdReplay(store).run(sensor_names, thresholds, since, until)
+    write = _writer(results[0]._fields if results else (), output_format, file or sys.stdout)
+    for result in results:
+        write(result)
+
+
+def _print_history(store, sensor_name, resolution, since, until, output_format, file=None):
+    """Prints a sensor's stored readings or rollups, one line at a time.
+
+    :param homemonitor.timeseries.TimeSeriesStore store: Where the history is stored.
+    :param str sensor_name: Name of the sensor.
+    :param str resolution: raw, minute, hour, or day.
+    :param float since: Start of the range, or None.
+    :param float until: End of the range, or None.
+    :param str output_format: csv or json.
+    :param file: Where to print.  Defaults to stdout.
+    :raises ValueError: If the resolution or format is invalid, or there is no history.
+    """
+    if resolution == store.RAW:
+        fields = ('time', 'value')
+    else:
+        fields = ('time', 'count', 'minimum', 'maximum', 'mean', 'standard_deviation')
+
+    # Check the format before the history is opened.
+    _check_format(output_format)
+    records = store.query(sensor_name, resolution, since, until)
+    write = _writer(fields, output_format, file or sys.stdout)
+    for record in records:
+        if resolution == store.RAW:
+            timestamp, value = record
+            write((_format_time(timestamp), value))
+        else:
+            write((_format_time(record.start), record.count, record.minimum, record.maximum,
+                   record.mean, record.standard_deviation))
 
 
 def main(argv):
@@ -75,10 +249,16 @@ def main(argv):
     * Loop forever.
     """
     test_mode = False
+    eventloop_class = EventLoop
     config_file = DEFAULT_CONFIG_FILE
+    history_sensor = None
+    replay_thresholds = None
+    history_options = {'since': None, 'until': None, 'resolution': 'raw', 'format': 'csv'}
 
     # Handle command line options.
-    options, _ = getopt.getopt(argv, 'vhtc:', ['version', 'help', 'test', 'config='])
+    options, _ = getopt.getopt(argv, 'vhtac:', ['version', 'help', 'test', 'async', 'config=',
+                                                'history=', 'since=', 'until=', 'resolution=',
+                                                'format=', 'replay='])
     for option, opt_value in options:
         if option in ('-v', '--version'):
             _print_version()
@@ -88,8 +268,16 @@ def main(argv):
             return 1
         elif option in ('-t', '--test'):
             test_mode = True
+        elif option in ('-a', '--async'):
+            eventloop_class = AsyncEventLoop
         elif option in ('-c', '--config'):
             config_file = opt_value
+        elif option == '--history':
+            history_sensor = opt_value
+        elif option == '--replay':
+            replay_thresholds = opt_value
+        elif option in ('--since', '--until', '--resolution', '--format'):
+            history_options[option[2:]] = opt_value
 
     # Read in config file.
     config_file = os.path.expandvars(config_file)
@@ -97,6 +285,34 @@ def main(argv):
     with open(config_file, 'r') as file:
         cfg.read_file(file)
 
+    # History.  Logging is not set up, so only the history is printed.
+    if history_sensor is not None or replay_thresholds is not None:
+        try:
+            store = TimeSeriesStore.from_config(cfg)
+            if store is None:
+                raise ValueError('There is no [{}] section in the config file.'.format(
+                    TimeSeriesStore.SECTION))
+            since = _parse_time(history_options['since'])
+            until = _parse_time(history_options['until'])
+            if history_sensor is not None:
+                _print_history(store,
+                               history_sensor,
+                               history_options['resolution'],
+                               since,
+                               until,
+                               history_options['format'])
+            else:
+                _print_replay(store,
+                              [sensor.name for sensor in TemperatureSensor.from_config(cfg)],
+                              _parse_thresholds(replay_thresholds),
+                              since,
+                              until,
+                              history_options['format'])
+        except (configparser.Error, ValueError, ImportError) as error:
+            print('\nError: {}\n'.format(error), file=sys.stderr)
+            return 1
+        return 0
+
     # Set up logging.
     logging.config.fileConfig(config_file)
 
@@ -104,11 +320,14 @@ def main(argv):
     try:
         mail = Mail.from_config(cfg)
         check_internet_connection = CheckInternetConnection.from_config(cfg)
-        mailqueue = MailQueue(mail, check_internet_connection)
+        mailstore = MailStore.from_config(cfg)
+        mailqueue = MailQueue.from_config(cfg, mail, check_internet_connection, mailstore)
         sensors = list()
         sensors.extend(TemperatureSensor.from_config(cfg))
-        eventloop = EventLoop.from_config(cfg, mailqueue, sensors)
-    except configparser.Error as error:
+        zones = Zone.from_config(cfg, sensors)
+        store = TimeSeriesStore.from_config(cfg)
+        eventloop = eventloop_class.from_config(cfg, mailqueue, sensors, zones)
+    except (configparser.Error, ValueError) as error:
         print('\nError: Failed to read config file "{0}" : {1}\n'.format(config_file, str(error)),
               file=sys.stderr)
         return 1
@@ -117,10 +336,24 @@ def main(argv):
     if test_mode:
         _send_test_mail(mailqueue)
         _test_sensors(sensors)
+        if mailstore is not None:
+            mailstore.close()
         return 0
 
     # Main event loop.
-    eventloop.run()
+    _exit_on_sigterm()
+    if store is not None:
+        store.attach(sensors)
+    if mailqueue.background:
+        mailqueue.start()
+    try:
+        eventloop.run()
+    finally:
+        _stop_mailqueue(mailqueue)
+        if mailstore is not None:
+            mailstore.close()
+        if store is not None:
+            store.close()
     return 0
 
 
@@ -1,47 +1,158 @@
 """Main event loop."""
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 from homemonitor.mailqueue import Message
+from homemonitor.scheduler import Scheduler
+
+
+class LoopMetrics(object):
+    """Statistics on how well the event loop keeps to its schedule.
+
+    :Attributes:
+        * ticks: Number of times a sensor was due.
+        * overruns: Number of times a loop ran so long a sensor missed its next tick.
+        * skipped_ticks: Number of ticks dropped because missed ticks were coalesced.
+        * last_lateness: Seconds the last tick started after it was due.
+        * max_lateness: Most seconds any tick started after it was due.
+        * total_lateness: Sum of how late every tick started, in seconds.
+        * backoffs: Number of times a sensor in hardware error was polled less often.
+        * reclaimed_seconds: Estimated seconds not spent polling sensors in hardware error,
+            because of backing off.
+    """
+    def __init__(self):
+        """Constructor"""
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.backoffs = 0
+        self.reclaimed_seconds = 0.0
+
+    @property
+    def mean_lateness(self):
+        """Returns the average seconds a tick started after it was due."""
+        if self.ticks == 0:
+            return 0.0
+        return self.total_lateness / self.ticks
+
+    def record_tick(self, lateness):
+        """Records a tick.
+
+        :param float lateness: Seconds the tick started after it was due.
+        """
+        self.ticks += 1
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+
+    def record_overrun(self, missed_ticks):
+        """Records a loop that ran past the next tick.
+
+        :param int missed_ticks: Number of ticks missed.  They are coalesced into one.
+        """
+        self.overruns += 1
+        self.skipped_ticks += missed_ticks - 1
+
+    def record_backoff(self, polls_avoided, poll_seconds):
+        """Records a sensor in hardware error being polled less often.
+
+        :param float polls_avoided: Number of normal polls that will not happen.
+        :param float poll_seconds: How long a poll of the sensor takes.
+        """
+        self.backoffs += 1
+        self.reclaimed_seconds += polls_avoided * poll_seconds
+
+    def __str__(self):
+        return 'ticks={} overruns={} skipped_ticks={} mean_lateness={:.3f}s ' \
+               'max_lateness={:.3f}s backoffs={} reclaimed={:.1f}s'.format(
+                   self.ticks,
+                   self.overruns,
+                   self.skipped_ticks,
+                   self.mean_lateness,
+                   self.max_lateness,
+                   self.backoffs,
+                   self.reclaimed_seconds)
 
 
 class EventLoop(object):
     """Main event loop."""
     DEFAULT_POLL_INTERVAL = 900  # 15 minutes
+    DEFAULT_MAX_WORKERS = 0  # Poll sensors one after another.
+    DEFAULT_POLL_DEADLINE = 60
+    DEFAULT_METRICS_LOG_TICKS = 96  # A day of ticks, at the default poll interval.
 
     # Config file defines.
     SECTION = 'eventloop'
     POLL_INTERVAL = 'poll_interval_in_seconds'
+    MAX_WORKERS = 'max_workers'
+    POLL_DEADLINE = 'poll_deadline_in_seconds'
+    METRICS_LOG_TICKS = 'metrics_log_ticks'
 
     """Main event loop."""
     def __init__(self,
                  mailqueue,
                  sensors,
                  poll_interval_in_seconds=DEFAULT_POLL_INTERVAL,
-                 loop_forever=True):
+                 loop_forever=True,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 poll_deadline_in_seconds=DEFAULT_POLL_DEADLINE,
+                 zones=None,
+                 banks=None,
+                 metrics_log_ticks=DEFAULT_METRICS_LOG_TICKS):
         """Constructor.
 
         :param homemonitor.mailqueue.MailQueue mailqueue: Used to send email.
         :param list[homemonitor.sensor.Sensor] sensors: List of sensors to check.
         :param int poll_interval_in_seconds: Seconds to sleep between polling sensors.
+            Used for sensors that do not have their own poll interval.
         :param bool loop_forever: If True, loop forever.  If False, only loop once
             (used for unit testing.)
+        :param int max_workers: Number of threads used to poll the sensors at the same time.
+            If 0, the sensors are polled one after another.
+        :param float poll_deadline_in_seconds: When polling concurrently, how long to wait
+            for each sensor before moving on without it.
+        :param list[homemonitor.zone.Zone] zones: Groups of sensors with one alarm.
+            When a sensor changes its zone's alarm, the zone sends the email instead.
+        :param list[homemonitor.sensorbank.SensorBank] banks: Many sensors checked together.
+            Each bank is polled at its own interval, after the sensors due at the same time.
+        :param int metrics_log_ticks: The loop metrics are logged every this many ticks,
+            and after every overrun.  If 0, they are only logged after an overrun.
         """
         self.mailqueue = mailqueue
         self.sensors = sensors
+        self.banks = banks or []
+        self.zones = zones or []
+        self._zones_by_sensor = {}
+        for zone in self.zones:
+            for member in zone.members:
+                self._zones_by_sensor.setdefault(member, []).append(zone)
         self.poll_interval_in_seconds = poll_interval_in_seconds
         self.loop_forever = loop_forever
+        self.max_workers = max_workers
+        self.poll_deadline_in_seconds = poll_deadline_in_seconds
+        self._executor = None
+        self._pending_polls = {}
+        self._scheduler = None
+        self._retry_due_times = {}
+        self.metrics = LoopMetrics()
+        self.metrics_log_ticks = metrics_log_ticks
+        self._metrics_logged_ticks = 0
 
         self.logger = logging.getLogger(__name__)
         self.logger.addHandler(logging.NullHandler())
 
     @classmethod
-    def from_config(cls, cfg, mailqueue, sensors):
+    def from_config(cls, cfg, mailqueue, sensors, zones=None):
         """Constructor.  Creates a EventLoop object from a config file.
 
         :param configparser.ConfigParser cfg: The configuration file, in memory.
         :param homemonitor.mailqueue.MailQueue mailqueue: Used to send email.
         :param list[homemonitor.sensor.Sensor] sensors: List of sensors to check.
+        :param list[homemonitor.zone.Zone] zones: Groups of sensors with one alarm.
         :return: EventLoop object.
         :rtype: homemonitor.eventloop.EventLoop
         :raises configparser.Error: If any options are missing or other options files issues.
@@ -50,12 +161,30 @@ class EventLoop(object):
 
             [eventloop]
             poll_interval_in_seconds=900
+            max_workers=4
+            poll_deadline_in_seconds=60
+            metrics_log_ticks=96
 
         """
         poll_interval = cfg.getint(cls.SECTION,
                                    cls.POLL_INTERVAL,
                                    fallback=cls.DEFAULT_POLL_INTERVAL)
-        return cls(mailqueue, sensors, poll_interval)
+        max_workers = cfg.getint(cls.SECTION,
+                                 cls.MAX_WORKERS,
+                                 fallback=cls.DEFAULT_MAX_WORKERS)
+        poll_deadline = cfg.getfloat(cls.SECTION,
+                                     cls.POLL_DEADLINE,
+                                     fallback=cls.DEFAULT_POLL_DEADLINE)
+        metrics_log_ticks = cfg.getint(cls.SECTION,
+                                       cls.METRICS_LOG_TICKS,
+                                       fallback=cls.DEFAULT_METRICS_LOG_TICKS)
+        return cls(mailqueue,
+                   sensors,
+                   poll_interval,
+                   max_workers=max_workers,
+                   poll_deadline_in_seconds=poll_deadline,
+                   zones=zones,
+                   metrics_log_ticks=metrics_log_ticks)
 
     @staticmethod
     def _bool_to_string(value):
@@ -68,37 +197,271 @@ class EventLoop(object):
         else:
             return 'off'
 
-    def _hw_failure_email(self, sensor):
-        if sensor.hw_error_changed:
-            if sensor.hw_error_on:
-                content = '{} has detected a hardware failure.'.format(sensor.name)
+    def _hw_failure_email(self, status):
+        if status.hw_error_changed:
+            if status.hw_error_on:
+                content = '{} has detected a hardware failure.'.format(status.name)
             else:
-                content = '{} hardware is OK.'.format(sensor.name)
+                content = '{} hardware is OK.'.format(status.name)
             self.mailqueue.add(Message(content, content))
 
-    def _alarm_email(self, sensor):
-        if sensor.alarm_changed:
-            content = '{} is {}.'.format(sensor.name,
-                                         self._bool_to_string(sensor.alarm_on))
+    def _alarm_email(self, status):
+        if status.alarm_changed:
+            content = '{} is {}.'.format(status.name,
+                                         self._bool_to_string(status.alarm_on))
             self.mailqueue.add(Message(content, content))
 
+    def _zone_email(self, zone):
+        subject = '{} is {}.'.format(zone.name, self._bool_to_string(zone.alarm_on))
+        members = zone.members_in_alarm
+        if members:
+            content = '{}\n\nSensors in alarm: {}'.format(subject, ', '.join(members))
+        else:
+            content = subject
+        self.mailqueue.add(Message(subject, content))
+
+    def _poll_interval(self, sensor):
+        """Returns how often a sensor is polled, in seconds."""
+        if sensor.poll_interval_in_seconds is None:
+            return self.poll_interval_in_seconds
+        return sensor.poll_interval_in_seconds
+
+    def _create_scheduler(self):
+        """Schedules the first poll of every sensor and bank.
+
+        :return: Scheduler keyed by the index of the sensor in :attr:`sensors`.  The banks
+            come after the sensors, so bank i is keyed by len(sensors) + i.
+        :rtype: homemonitor.scheduler.Scheduler
+        """
+        scheduler = Scheduler()
+        now = scheduler.clock()
+        for index, sensor in enumerate(self.sensors + self.banks):
+            scheduler.add(index, now + self._poll_interval(sensor))
+        return scheduler
+
+    def _pop_due(self):
+        """Removes the sensors that are due from the schedule and records how late they are.
+
+        :return: Index and due time of each sensor that is due, in the order of :attr:`sensors`.
+        :rtype: list[tuple[int, float]]
+        """
+        due = sorted(self._scheduler.pop_due())
+        now = self._scheduler.clock()
+        for _, due_time in due:
+            self.metrics.record_tick(now - due_time)
+        return due
+
+    def _due_sensors(self, due):
+        """Returns the sensors that are due, leaving out the banks.
+
+        :param list[tuple[int, float]] due: Index and due time of each sensor and bank.
+        :rtype: list[homemonitor.sensor.Sensor]
+        """
+        return [self.sensors[index] for index, _ in due if index < len(self.sensors)]
+
+    def _due_banks(self, due):
+        """Returns the banks that are due.
+
+        :param list[tuple[int, float]] due: Index and due time of each sensor and bank.
+        :rtype: list[homemonitor.sensorbank.SensorBank]
+        """
+        return [self.banks[index - len(self.sensors)]
+                for index, _ in due if index >= len(self.sensors)]
+
+    def _poll_banks(self, due):
+        """Polls the banks that are due.
+
+        :param list[tuple[int, float]] due: Index and due time of each sensor and bank.
+        :return: Status of each sensor in the banks whose status changed.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        statuses = []
+        for bank in self._due_banks(due):
+            statuses.extend(bank.poll())
+        return statuses
+
+    def _queue_emails(self, statuses):
+        """Adds an email to the queue for each sensor whose status changed.
+
+        Each zone whose alarm changed sends one email, after all the sensors are checked,
+        so several sensors going into alarm at once send one email.  A sensor in a zone whose
+        alarm changed this loop leaves its alarm email to the zone.  Otherwise, it sends its
+        own alarm email, the same as a sensor in no zone.
+
+        :param list[homemonitor.sensor.SensorStatus] statuses: New status of the sensors.
+        """
+        # Alarm of each zone touched this loop, before any of its sensors were checked.
+        zones_before = {}
+        for status in statuses:
+            for zone in self._zones_by_sensor.get(status.name, []):
+                zones_before.setdefault(zone, zone.alarm_on)
+                zone.update(status)
+        changed_zones = [zone for zone in self.zones
+                         if zone in zones_before and zone.alarm_on != zones_before[zone]]
+
+        for status in statuses:
+            zones = self._zones_by_sensor.get(status.name, [])
+            if not any(zone in changed_zones for zone in zones):
+                # Note: This code is similar to the Sensor logging.  Should it be in Sensor instead?
+                self._alarm_email(status)
+            self._hw_failure_email(status)
+
+        for zone in changed_zones:
+            self._zone_email(zone)
+
+    def _reschedule_all(self, due):
+        """Schedules the next poll of the sensors that were due.
+
+        :param list[tuple[int, float]] due: Index and due time of each sensor.
+        """
+        for index, due_time in due:
+            self._reschedule(index, due_time)
+
+    def _reschedule(self, index, due_time):
+        """Schedules the next poll of a sensor.
+
+        If the sensor's read failed and should be tried again, it is scheduled
+        for the retry instead.
+
+        :param int index: Index of the sensor in :attr:`sensors`, or of the bank after them.
+        :param float due_time: When the last poll was due.
+        """
+        if index >= len(self.sensors):
+            bank = self.banks[index - len(self.sensors)]
+            self._schedule_next(index, bank.name, due_time, self._poll_interval(bank))
+            return
+        sensor = self.sensors[index]
+        if sensor.retry_in_seconds is not None:
+            # Try the read again soon.  Remember when the poll was first due, so
+            # the retries do not shift the sensor's schedule.
+            self._retry_due_times.setdefault(index, due_time)
+            self._scheduler.add(index, self._scheduler.clock() + sensor.retry_in_seconds)
+            return
+        due_time = self._retry_due_times.pop(index, due_time)
+
+        normal_interval = self._poll_interval(sensor)
+        interval = sensor.next_poll_interval(normal_interval)
+        if interval > normal_interval:
+            self.metrics.record_backoff(interval / normal_interval - 1, sensor.last_poll_seconds)
+            self.logger.debug('%s is in hardware error.  Polling again in %s seconds.',
+                              sensor.name,
+                              interval)
+        self._schedule_next(index, sensor.name, due_time, interval)
+
+    def _schedule_next(self, index, name, due_time, interval):
+        """Schedules the next poll an interval after the last one was due.
+
+        :param int index: Scheduler key of the sensor or bank.
+        :param str name: Name of the sensor or bank, for the log.
+        :param float due_time: When the last poll was due.
+        :param float interval: Seconds until the next poll.
+        """
+        missed_ticks = self._scheduler.reschedule(index, due_time, interval)
+        if missed_ticks:
+            self.metrics.record_overrun(missed_ticks)
+            self.logger.warning('Loop overran the poll interval of %s.  '
+                                'Missed %d poll(s), polling once now.',
+                                name,
+                                missed_ticks)
+            self._log_metrics()
+
+    def _log_metrics(self):
+        """Logs the loop metrics."""
+        self._metrics_logged_ticks = self.metrics.ticks
+        self.logger.info('Loop metrics: %s', self.metrics)
+
+    def _log_metrics_periodically(self):
+        """Logs the loop metrics once every :attr:`metrics_log_ticks` ticks."""
+        if (self.metrics_log_ticks > 0 and
+                self.metrics.ticks - self._metrics_logged_ticks >= self.metrics_log_ticks):
+            self._log_metrics()
+
+    def _poll_sensors(self, sensors):
+        """Refreshes the status of the sensors.
+
+        :param list[homemonitor.sensor.Sensor] sensors: Sensors to poll.
+        :return: New status of the sensors, in the same order as they were given.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        if self.max_workers > 0:
+            return self._poll_sensors_concurrently(sensors)
+
+        return [sensor.status() for sensor in sensors]
+
+    def _submit_polls(self, sensors, max_workers):
+        """Starts polling the sensors on a pool of threads.
+
+        A sensor whose previous poll is still running is not polled again.
+        The futures and deadlines are kept in :attr:`_pending_polls`.
+
+        :param list[homemonitor.sensor.Sensor] sensors: Sensors to poll.
+        :param int max_workers: Size of the pool, if it needs to be created.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        for sensor in sensors:
+            if sensor not in self._pending_polls:
+                deadline = time.monotonic() + self.poll_deadline_in_seconds
+                self._pending_polls[sensor] = (self._executor.submit(sensor.status), deadline)
+
+    def _poll_timed_out(self, sensor):
+        """Logs that a sensor did not respond by its deadline."""
+        self.logger.warning('%s did not respond within %s seconds.  '
+                            'Will check it again next loop.',
+                            sensor.name,
+                            self.poll_deadline_in_seconds)
+
+    def _poll_sensors_concurrently(self, sensors):
+        """Refreshes the status of the sensors using a pool of threads.
+
+        Each sensor is given its own deadline.  If a sensor does not respond by then,
+        it is skipped so it does not hold up the other sensors.  The poll keeps running
+        in the background and its result is picked up on a later loop.  A sensor is never
+        polled again while a previous poll is still running.
+
+        :param list[homemonitor.sensor.Sensor] sensors: Sensors to poll.
+        :return: New status of the sensors that responded, in the same order as they were given.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        self._submit_polls(sensors, self.max_workers)
+
+        # Collect the results in the order of the sensors, so emails always go out
+        # in the same order, no matter which sensor finishes first.
+        statuses = []
+        for sensor in sensors:
+            future, deadline = self._pending_polls[sensor]
+            try:
+                status = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                self._poll_timed_out(sensor)
+                continue
+            del self._pending_polls[sensor]
+            statuses.append(status)
+
+        return statuses
+
     def run(self):
         """Runs the main loop of the program.
 
-        * Sleep
-        * Refresh status of all the sensors.
+        * Sleep until the next sensor is due.
+        * Refresh status of the sensors that are due.
         * If the status changed, add email to the queue.
         * Allow the queue a chance to send email.
         """
         self.logger.info('Entering the main event loop...')
 
+        if self._scheduler is None:
+            self._scheduler = self._create_scheduler()
+
         while True:
-            time.sleep(self.poll_interval_in_seconds)
-            for sensor in self.sensors:
-                sensor.status()
-                # Note: This code is similar to the Sensor logging.  Should it be in Sensor instead?
-                self._alarm_email(sensor)
-                self._hw_failure_email(sensor)
+            # With no sensors, sleep the poll interval instead of spinning.
+            self._scheduler.wait(self.poll_interval_in_seconds)
+            due = self._pop_due()
+            statuses = self._poll_sensors(self._due_sensors(due))
+            self._queue_emails(statuses + self._poll_banks(due))
+            self._reschedule_all(due)
+            self._log_metrics_periodically()
 
             self.mailqueue.send()
 
@@ -0,0 +1,111 @@
+"""Keeps recent readings of a sensor in memory."""
+from array import array
+import collections
+
+WindowStats = collections.namedtuple('WindowStats', ['count', 'minimum', 'maximum', 'mean'])
+WindowStats.__doc__ = """Statistics of the values in a window of history."""
+
+
+class RingBuffer(object):
+    """Fixed size history of timestamp, value pairs.
+
+    Once full, each new value replaces the oldest one, so memory use never grows.
+    Values are kept in arrays of doubles (16 bytes per pair), instead of Python objects.
+    Timestamps are expected to only go up.
+
+    Example::
+
+        history = RingBuffer(2880)
+        history.append(time.time(), 68.5)
+        stats = history.stats(since=time.time() - 3600)
+        print('Coldest in the last hour: {}'.format(stats.minimum))
+
+    """
+    def __init__(self, capacity):
+        """Constructor.
+
+        :param int capacity: Most pairs kept.
+        :raises ValueError: If capacity is less than 1.
+        """
+        if capacity < 1:
+            raise ValueError('History capacity must be at least 1, not {}.'.format(capacity))
+        self.capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Returns the pairs, oldest first."""
+        for index in range(self._count):
+            position = self._position(index)
+            yield self._timestamps[position], self._values[position]
+
+    def _position(self, index):
+        """Returns where the index'th oldest pair is stored."""
+        return (self._start + index) % self.capacity
+
+    def append(self, timestamp, value):
+        """Adds a pair, replacing the oldest one if full.
+
+        :param float timestamp: When the value was read, in seconds since the epoch.
+        :param float value: The value.
+        """
+        if self._count < self.capacity:
+            position = self._position(self._count)
+            self._count += 1
+        else:
+            position = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._timestamps[position] = timestamp
+        self._values[position] = value
+
+    def latest(self):
+        """Returns the newest pair.
+
+        :return: Timestamp and value, or None if empty.
+        :rtype: tuple[float, float]
+        """
+        if self._count == 0:
+            return None
+        position = self._position(self._count - 1)
+        return self._timestamps[position], self._values[position]
+
+    def _first_index_since(self, since):
+        """Returns the index of the oldest pair at or after a time, using a binary search."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._position(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, since=None):
+        """Returns the values at or after a time.
+
+        :param float since: Seconds since the epoch.  If None, returns every value.
+        :return: Values, oldest first.
+        :rtype: list[float]
+        """
+        first = 0 if since is None else self._first_index_since(since)
+        return [self._values[self._position(index)] for index in range(first, self._count)]
+
+    def stats(self, since=None):
+        """Returns the count, min, max, and mean of the values at or after a time.
+
+        Finding the start of the window is a binary search, so only the values
+        in the window are looked at.
+
+        :param float since: Seconds since the epoch.  If None, uses every value.
+        :return: Statistics.  min, max, and mean are None if there are no values.
+        :rtype: WindowStats
+        """
+        values = self.window(since)
+        if not values:
+            return WindowStats(0, None, None, None)
+        return WindowStats(len(values), min(values), max(values), sum(values) / len(values))
@@ -0,0 +1,16 @@
+"""Imports optional packages the first time they are needed."""
+
+
+def numpy():
+    """Imports numpy.
+
+    numpy is only needed for sensor banks and replays, so it is not imported when
+    homemonitor starts.
+
+    :return: The numpy module.
+    :raises ImportError: If numpy is not installed.
+    """
+    # noinspection PyUnresolvedReferences
+    # pylint: disable=import-error,redefined-outer-name
+    import numpy
+    return numpy
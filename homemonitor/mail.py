@@ -1,6 +1,7 @@
 """Sends email."""
 import smtplib
 import logging
+import time
 
 
 class Mail(object):
@@ -12,8 +13,10 @@ class Mail(object):
     RECEIVERS = 'receivers'
     SERVER = 'server'
     PORT = 'port'
+    IDLE_TIMEOUT = 'session_idle_timeout_in_seconds'
     DEFAULT_SERVER = 'smtp.gmail.com'
     DEFAULT_PORT = 587
+    DEFAULT_IDLE_TIMEOUT = 0  # Disconnect at the end of each session.
 
     """Send email.
 
@@ -27,9 +30,25 @@ class Mail(object):
         except MailException as error:
             print('Error: {}'.format(error))
 
+    To send several emails over one connection, send them in a session.  The connection
+    and login are done by the first email, and kept until the session is closed::
+
+        the_mail.open_session()
+        try:
+            the_mail.send('hi', 'First email.')
+            the_mail.send('hi', 'Second email.')
+        finally:
+            the_mail.close_session()
+
     """
 
-    def __init__(self, user, password, receivers, server=DEFAULT_SERVER, port=DEFAULT_PORT):
+    def __init__(self,
+                 user,
+                 password,
+                 receivers,
+                 server=DEFAULT_SERVER,
+                 port=DEFAULT_PORT,
+                 session_idle_timeout_in_seconds=DEFAULT_IDLE_TIMEOUT):
         """Constructor.
 
         :param str user: User name of the account used to send email.
@@ -37,6 +56,9 @@ class Mail(object):
         :param list receivers: List of users that will receive emails.
         :param str server: SMTP server to connect.  Defaults to :attr:`DEFAULT_SERVER`.
         :param int port: Port of the SMTP server.  Defaults to :attr:`DEFAULT_PORT`.
+        :param float session_idle_timeout_in_seconds: After a session is closed, keep the
+            connection this long, so the next session can use it.  If 0, disconnect when
+            the session is closed.
         :raises ValueError: If "to" is not a list.  If a string is passed in, the join in send()
             doesn't work correctly.
         """
@@ -46,6 +68,10 @@ class Mail(object):
         self.receivers = receivers
         self.server = server
         self.port = port
+        self.session_idle_timeout_in_seconds = session_idle_timeout_in_seconds
+        self._in_session = False
+        self._smtp = None
+        self._last_used = None
         self.logger = logging.getLogger(__name__)
         self.logger.addHandler(logging.NullHandler())
 
@@ -69,6 +95,7 @@ class Mail(object):
             receivers=receiver1@mail.com, receiver2@mail.com
             server=mailserver.com
             port=123
+            session_idle_timeout_in_seconds=300
 
         """
         user = cfg.get(cls.SECTION, cls.USER)
@@ -77,18 +104,50 @@ class Mail(object):
         receivers = [current.strip() for current in to_string.split(',')]
         server = cfg.get(cls.SECTION, cls.SERVER, fallback=cls.DEFAULT_SERVER)
         port = cfg.getint(cls.SECTION, cls.PORT, fallback=cls.DEFAULT_PORT)
-        return cls(user, password, receivers, server, port)
+        idle_timeout = cfg.getfloat(cls.SECTION,
+                                    cls.IDLE_TIMEOUT,
+                                    fallback=cls.DEFAULT_IDLE_TIMEOUT)
+        return cls(user, password, receivers, server, port, idle_timeout)
+
+    def open_session(self):
+        """Starts sending emails over one connection.
+
+        Nothing is sent until the first email.  It connects and logs in, unless a
+        connection kept from the last session is still open.
+        """
+        if self._smtp is not None and self._idle():
+            self._disconnect()
+        self._in_session = True
+
+    def close_session(self):
+        """Stops sending emails over one connection.
+
+        The connection is kept for :attr:`session_idle_timeout_in_seconds`, for the next
+        session.  After that, it is closed by the next call to open or close a session.
+        """
+        self._in_session = False
+        if self._smtp is not None and self._idle():
+            self._disconnect()
 
     def send(self, subject, body):
         """Sends email.
 
+        In a session, the email is sent over the session's connection.  If the server
+        closed the connection, it connects again and sends the email once more.
+
         :param str subject: subject
         :param str body: body
         :raises MailException: If failed to send email.
         """
         message = self._message(body, subject)
-        smtp = self._connect()
-        self._login_and_send(message, smtp)
+        if self._in_session:
+            self._send_in_session(message)
+        else:
+            smtp = self._connect()
+            try:
+                self._login_and_send(message, smtp)
+            finally:
+                smtp.quit()
         self.logger.info('Sent email to %s with subject "%s".',
                          self.receivers,
                          subject)
@@ -105,6 +164,49 @@ class Mail(object):
         message = headers_string + '\r\n\r\n' + body
         return message
 
+    def _idle(self):
+        """Returns True if the connection has not been used for the idle timeout."""
+        return time.monotonic() - self._last_used >= self.session_idle_timeout_in_seconds
+
+    def _send_in_session(self, message):
+        """Sends a message over the session's connection, connecting if needed."""
+        if self._smtp is None:
+            self._smtp = self._connect_and_login()
+        try:
+            try:
+                self._smtp.sendmail(self.user, self.user, message)
+            except smtplib.SMTPServerDisconnected:
+                self.logger.info('Mail server %s closed the connection.  Connecting again.',
+                                 self.server)
+                self._disconnect()
+                self._smtp = self._connect_and_login()
+                self._smtp.sendmail(self.user, self.user, message)
+        except smtplib.SMTPException as error:
+            self._disconnect()
+            raise self._send_error(error) from error
+        self._last_used = time.monotonic()
+
+    def _connect_and_login(self):
+        """Returns a new connection that is logged in."""
+        smtp = self._connect()
+        try:
+            self._login_and_send(None, smtp)
+        except MailException:
+            smtp.close()
+            raise
+        self._last_used = time.monotonic()
+        return smtp
+
+    def _disconnect(self):
+        """Closes the session's connection.  The server may have closed it already."""
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
     def _connect(self):
         try:
             smtp = smtplib.SMTP()
@@ -121,16 +223,25 @@ class Mail(object):
         return smtp
 
     def _login_and_send(self, message, smtp):
+        """Logs in, then sends the message.
+
+        :param str message: The message.  If None, only logs in.
+        :param smtplib.SMTP smtp: The connection.
+        :raises MailException: If failed to log in or send.
+        """
         try:
             smtp.login(self.user, self.password)
-            smtp.sendmail(self.user, self.user, message)
+            if message is not None:
+                smtp.sendmail(self.user, self.user, message)
         except smtplib.SMTPException as error:
-            message = 'Failed to send email.  ' \
-                'Check user({0})/password is correct - {1}'.format(self.user, str(error))
-            self.logger.error(message)
-            raise MailException(message) from error
-        finally:
-            smtp.quit()
+            raise self._send_error(error) from error
+
+    def _send_error(self, error):
+        """Logs an error from smtplib and returns it as a MailException."""
+        message = 'Failed to send email.  ' \
+            'Check user({0})/password is correct - {1}'.format(self.user, str(error))
+        self.logger.error(message)
+        return MailException(message)
 
 
 class MailException(Exception):
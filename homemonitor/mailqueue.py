@@ -1,15 +1,32 @@
 """Sends email with error handling."""
+import datetime
 import logging
+import random
+import sqlite3
+import threading
+import time
 
 from homemonitor.mail import MailException
 
 
 class Message(object):
     """Represents a message in the queue."""
-    def __init__(self, subject, body):
+    def __init__(self, subject, body, timestamp=None):
+        """Constructor.
+
+        :param str subject: Subject of the email.
+        :param str body: Body of the email.
+        :param float timestamp: When the message was created, in seconds since the epoch.
+            If None, now.
+        """
         self.subject = subject
         self.body = body
+        self.timestamp = time.time() if timestamp is None else timestamp
         self.retry_count = 0
+        # When to try to send it, in seconds since the epoch.  Set when it is queued.
+        self.next_attempt = None
+        # Id in the MailStore, once it is saved.
+        self.store_id = None
 
     def __eq__(self, other):
         return self.subject == other.subject and self.body == other.body
@@ -23,9 +40,22 @@ class MailQueue(object):
 
     Place messages into the queue and this class will attempt to send them.
 
-    * If an error, retry a few times.
+    * If an error, retry a few times, waiting longer after each failure.
     * If there is no internet connection, keep checking until connection is restored.
 
+    * If many messages are waiting, optionally send them as one digest email.
+
+    Messages may be added from one thread while another thread is sending.
+
+    Each message has a time of its next attempt, and the queue is kept in that order.
+    A message that fails waits :attr:`retry_delay_in_seconds`, doubling after each failure
+    up to :attr:`max_retry_delay_in_seconds`.  The wait is randomized, so messages that
+    fail together do not retry together.  Only messages that are due are sent.
+
+    Optionally, a background thread sends the email, so a slow Internet check or SMTP
+    server does not hold up the caller.  :meth:`send` then only wakes the thread.
+    The thread also wakes when the next message is due.
+
     Example::
 
         mail = GMail('hello@gmail.com', 'password')
@@ -33,54 +63,382 @@ class MailQueue(object):
         mailqueue.add(Message('hi', 'how are you?'))
         mailqueue.send()
 
+    With the background thread::
+
+        mailqueue.start()
+        mailqueue.add(Message('hi', 'how are you?'))
+        mailqueue.send()
+        ...
+        mailqueue.stop()
+
     """
-    def __init__(self, mail, check_internet_connection, retries=3):
+    DEFAULT_RETRIES = 8
+    DEFAULT_DIGEST_MIN_MESSAGES = 0  # Never send a digest.
+    DEFAULT_BACKGROUND = False
+    DEFAULT_RETRY_DELAY = 60
+    DEFAULT_MAX_RETRY_DELAY = 3600  # 1 hour
+
+    # Config file defines.
+    SECTION = 'mailqueue'
+    RETRIES = 'retries'
+    DIGEST_MIN_MESSAGES = 'digest_min_messages'
+    BACKGROUND = 'background'
+    RETRY_DELAY = 'retry_delay_in_seconds'
+    MAX_RETRY_DELAY = 'max_retry_delay_in_seconds'
+
+    def __init__(self,
+                 mail,
+                 check_internet_connection,
+                 retries=DEFAULT_RETRIES,
+                 digest_min_messages=DEFAULT_DIGEST_MIN_MESSAGES,
+                 background=DEFAULT_BACKGROUND,
+                 retry_delay_in_seconds=DEFAULT_RETRY_DELAY,
+                 max_retry_delay_in_seconds=DEFAULT_MAX_RETRY_DELAY,
+                 store=None,
+                 clock=time.time):
         """Constructor
 
         :param homemonitor.mail.Mail mail: Object used to send the email message.
         :param homemonitor.internetconnection.CheckInternetConnection check_internet_connection:
             CheckInternetConnection
         :param int retries: Number of times to retry sending a message.
+        :param int digest_min_messages: If at least this many messages are waiting,
+            send them as one digest email.  If 1, always send a digest.
+            If 0, never send a digest.
+        :param bool background: If True, the caller should :meth:`start` the background
+            thread.
+        :param float retry_delay_in_seconds: How long to wait after a message first fails.
+            Doubles after each failure.  With the background thread, it is also how long to
+            wait before checking the Internet again.
+        :param float max_retry_delay_in_seconds: Longest wait between attempts.
+        :param homemonitor.mailstore.MailStore store: If given, the queue is loaded from it,
+            and saved to it each time the queue is sent.
+        :param clock: Function returning the current time in seconds since the epoch.
         """
         self.mail = mail
         self.check_internet_connection = check_internet_connection
         self.retries = retries
-        self.queue = []
+        self.digest_min_messages = digest_min_messages
+        self.background = background
+        self.retry_delay_in_seconds = retry_delay_in_seconds
+        self.max_retry_delay_in_seconds = max_retry_delay_in_seconds
+        self.clock = clock
+        self.store = store
+        self.queue = [] if store is None else sorted(store.load(),
+                                                     key=lambda message: message.next_attempt)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._worker = None
+        self._woken = False
+        self._sending = False
+        self._stopping = False
         self.logger = logging.getLogger(__name__)
         self.logger.addHandler(logging.NullHandler())
 
+    @classmethod
+    def from_config(cls, cfg, mail, check_internet_connection, store=None):
+        """Constructor.  Creates a MailQueue object from a config file.
+
+        :param configparser.ConfigParser cfg: The configuration file, in memory.
+        :param homemonitor.mail.Mail mail: Object used to send the email message.
+        :param homemonitor.internetconnection.CheckInternetConnection check_internet_connection:
+            CheckInternetConnection
+        :param homemonitor.mailstore.MailStore store: Where the queue is saved, if anywhere.
+        :return: MailQueue object.
+        :rtype: homemonitor.mailqueue.MailQueue
+        :raises configparser.Error: If any options are missing or other options files issues.
+
+        Example::
+
+            [mailqueue]
+            retries=3
+            digest_min_messages=3
+            background=true
+            retry_delay_in_seconds=60
+            max_retry_delay_in_seconds=3600
+
+        """
+        retries = cfg.getint(cls.SECTION, cls.RETRIES, fallback=cls.DEFAULT_RETRIES)
+        digest_min_messages = cfg.getint(cls.SECTION,
+                                         cls.DIGEST_MIN_MESSAGES,
+                                         fallback=cls.DEFAULT_DIGEST_MIN_MESSAGES)
+        background = cfg.getboolean(cls.SECTION, cls.BACKGROUND, fallback=cls.DEFAULT_BACKGROUND)
+        retry_delay = cfg.getfloat(cls.SECTION,
+                                   cls.RETRY_DELAY,
+                                   fallback=cls.DEFAULT_RETRY_DELAY)
+        max_retry_delay = cfg.getfloat(cls.SECTION,
+                                       cls.MAX_RETRY_DELAY,
+                                       fallback=cls.DEFAULT_MAX_RETRY_DELAY)
+        return cls(mail,
+                   check_internet_connection,
+                   retries,
+                   digest_min_messages,
+                   background,
+                   retry_delay,
+                   max_retry_delay,
+                   store)
+
+    def start(self):
+        """Starts the background thread that sends the email."""
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name='MailQueue', daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout=None):
+        """Stops the background thread, after it tries once more to send the queue.
+
+        :param float timeout: Seconds to wait for the thread.  If None, waits until it stops.
+        :return: True if the queue is empty.
+        :rtype: bool
+        """
+        with self._lock:
+            worker = self._worker
+            if worker is None:
+                return not self.queue
+            self._stopping = True
+            self._wake.notify_all()
+        worker.join(timeout)
+        with self._lock:
+            if not worker.is_alive():
+                self._worker = None
+            return not self.queue
+
+    def flush(self, timeout=None):
+        """Tries once to send the messages that are due, and waits until it is done.
+
+        Used before shutting down and in test mode.  Works with or without the
+        background thread.
+
+        :param float timeout: Seconds to wait for the background thread.
+            If None, waits until it is done.
+        :return: True if the queue is empty.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._worker is None:
+                background = False
+            else:
+                background = True
+                self._woken = True
+                self._wake.notify_all()
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while self._woken or self._sending:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._wake.wait(remaining)
+        if not background:
+            self._send_pending()
+        with self._lock:
+            return not self.queue
+
     def add(self, message):
         """Adds a message to the queue.
 
         :param Message message: Message to be sent.
         """
-        self.queue.append(message)
+        with self._lock:
+            if message.next_attempt is None:
+                message.next_attempt = self.clock()
+            self._insert(message)
+
+    def _insert(self, message):
+        """Inserts a message in the queue, in order of its next attempt.
+
+        Messages due at the same time stay in the order they were added.
+        """
+        low, high = 0, len(self.queue)
+        while low < high:
+            middle = (low + high) // 2
+            if self.queue[middle].next_attempt <= message.next_attempt:
+                low = middle + 1
+            else:
+                high = middle
+        self.queue.insert(low, message)
+
+    def _due_count(self, now):
+        """Returns how many messages at the front of the queue are due."""
+        count = 0
+        for message in self.queue:
+            if message.next_attempt > now:
+                break
+            count += 1
+        return count
 
     def send(self):
-        """Attempts to send the messages in the queue.
+        """Attempts to send the messages in the queue that are due.
 
-        If there is no Internet connection, do not even attempt to send email out.
+        If the background thread is running, wakes it to send them and returns.
+
+        If no message is due, or there is no Internet connection, do not even attempt
+        to send email out.
 
         If it fails to send email, increment the retry count
-        and add it back to the queue if less than the threshold.
+        and add it back to the queue, to be tried after a delay,
+        if less than the threshold.
 
         If failed to send self.retries times (i.e. 3), then stop trying
         to send the message and log an error.
+
+        The messages are sent in one mail session, so they share one connection and login.
+        If at least :attr:`digest_min_messages` are waiting, they are sent as one digest.
+        If the digest fails, each of its messages counts as failing once.
+        """
+        with self._lock:
+            if self._worker is not None:
+                self._woken = True
+                self._wake.notify_all()
+                return
+        self._send_pending()
+
+    def _run(self):
+        """Sends email whenever woken, until stopped.
+
+        Wakes when :meth:`send` or :meth:`flush` is called, or when the next message
+        in the queue is due.
+        """
+        while True:
+            with self._lock:
+                while not self._woken and not self._stopping:
+                    if not self._wake.wait(self._next_wait()):
+                        # Time to retry.
+                        break
+                self._woken = False
+                self._sending = True
+                stopping = self._stopping
+            try:
+                self._send_pending()
+            except Exception:  # pylint: disable=broad-except
+                # Keep the thread alive, or no more email would be sent.
+                self.logger.exception('Unexpected error while sending email.')
+            finally:
+                with self._lock:
+                    self._sending = False
+                    self._wake.notify_all()
+            if stopping:
+                return
+
+    def _next_wait(self):
+        """Returns seconds until the next message is due, or None if the queue is empty.
+
+        Called by the background thread, right after it tried to send the queue.  A message
+        that is still due could not be sent, for example the Internet is down, so the
+        thread waits :attr:`retry_delay_in_seconds` before trying again.
+        """
+        if not self.queue:
+            return None
+        wait = self.queue[0].next_attempt - self.clock()
+        return wait if wait > 0 else self.retry_delay_in_seconds
+
+    def _retry_later(self, message, now):
+        """Sets when to try a message that failed again.
+
+        The delay doubles with each failure, up to :attr:`max_retry_delay_in_seconds`.
+        It is randomized, so messages that fail together do not retry together.
         """
+        delay = min(self.retry_delay_in_seconds * 2 ** (message.retry_count - 1),
+                    self.max_retry_delay_in_seconds)
+        message.next_attempt = now + random.uniform(delay / 2, delay)
+
+    def _send_pending(self):
+        """Sends the messages in the queue that are due.  See :meth:`send`."""
+        now = self.clock()
+        with self._lock:
+            due = self._due_count(now)
+        if not due:
+            return
+
         if not self.check_internet_connection.connected():
+            self._save()
             return
 
+        with self._lock:
+            # Include messages added while checking the Internet.
+            due = self._due_count(self.clock())
+            pending_queue, self.queue = self.queue[:due], self.queue[due:]
+
+        if self.digest_min_messages and len(pending_queue) >= self.digest_min_messages:
+            emails = [(self._digest(pending_queue), pending_queue)]
+        else:
+            emails = [(message, [message]) for message in pending_queue]
+
         failed_queue = []
-        for message in self.queue:
-            try:
-                self.mail.send(message.subject, message.body)
-            except MailException:
-                message.retry_count += 1
-                if message.retry_count < self.retries:
-                    failed_queue.append(message)
-                else:
-                    self.logger.error('Failed to send message with subject "%s" %d times.  '
-                                      'Giving up.',
-                                      message.subject,
-                                      self.retries)
-        self.queue = failed_queue
+        # The emails not tried yet.  They go back in the queue if sending stops early,
+        # for example on an unexpected error opening the session, or on exit.
+        unsent = list(reversed(emails))
+        try:
+            self.mail.open_session()
+            while unsent:
+                email, messages = unsent[-1]
+                try:
+                    self.mail.send(email.subject, email.body)
+                except MailException:
+                    for message in messages:
+                        self._failed(message, failed_queue, now)
+                except Exception:  # pylint: disable=broad-except
+                    # Ex: UnicodeEncodeError.  Retried like any failure, so it does not
+                    # hold up the other messages, and is given up on after the retries.
+                    self.logger.exception('Unexpected error while sending "%s".',
+                                          email.subject)
+                    for message in messages:
+                        self._failed(message, failed_queue, now)
+                unsent.pop()
+        finally:
+            self.mail.close_session()
+            with self._lock:
+                for message in failed_queue:
+                    self._insert(message)
+                for _, messages in reversed(unsent):
+                    for message in messages:
+                        self._insert(message)
+            self._save()
+
+    def _save(self):
+        """Saves the queue to :attr:`store`, if there is one."""
+        if self.store is None:
+            return
+        with self._lock:
+            messages = list(self.queue)
+        try:
+            self.store.sync(messages)
+        except sqlite3.Error as error:
+            self.logger.error('Failed to save the mail queue to %s - %s', self.store.path, error)
+
+    def _failed(self, message, failed_queue, now):
+        """Adds a message that failed to send to the failed queue, unless it has run out
+        of retries."""
+        message.retry_count += 1
+        if message.retry_count < self.retries:
+            self._retry_later(message, now)
+            failed_queue.append(message)
+        else:
+            self.logger.error('Failed to send message with subject "%s" %d times.  '
+                              'Giving up.',
+                              message.subject,
+                              self.retries)
+
+    @staticmethod
+    def _digest(messages):
+        """Merges messages into one, oldest first.
+
+        Each line starts with the time of the message and its subject.  Anything else in
+        the body is indented under it.
+
+        :param list[Message] messages: Messages to merge.
+        :return: The digest.
+        :rtype: Message
+        """
+        lines = []
+        for message in sorted(messages, key=lambda current: current.timestamp):
+            time_string = datetime.datetime.fromtimestamp(message.timestamp).strftime(
+                '%Y-%m-%d %H:%M:%S')
+            lines.append('{}  {}'.format(time_string, message.subject))
+            body = message.body
+            if body.startswith(message.subject):
+                body = body[len(message.subject):]
+            lines.extend('    ' + line for line in body.splitlines() if line.strip())
+        subject = 'Home Monitor: {} messages'.format(len(messages))
+        return Message(subject, '\n'.join(lines))
@@ -0,0 +1,156 @@
+"""Keeps the mail queue on disk, so it survives a restart."""
+import logging
+import os
+import sqlite3
+import threading
+
+from homemonitor.mailqueue import Message
+
+
+class MailStore(object):
+    """SQLite database of the messages waiting in a :class:`homemonitor.mailqueue.MailQueue`.
+
+    Only messages still waiting are kept.  A message is deleted once it is sent or given
+    up on, so loading the queue at startup takes time proportional to the messages
+    waiting, not to every message ever sent.
+
+    The database is in WAL mode with synchronous=NORMAL.  The changes of a whole
+    :meth:`sync` are one transaction, appended to the write-ahead log, and the SD card is
+    only fsynced when the log is checkpointed.  If the power goes out, the last changes
+    may be lost, but the database is never corrupted.
+
+    Example::
+
+        store = MailStore('/home/pi/homemonitor/mailqueue.db')
+        queue = store.load()
+        queue.append(Message('hi', 'how are you?'))
+        store.sync(queue)
+        store.close()
+
+    """
+    # Config file defines.
+    SECTION = 'mailqueue'
+    DATABASE = 'database'
+
+    def __init__(self, path):
+        """Constructor.  Creates the database if it does not exist.
+
+        :param str path: File name.
+        :raises sqlite3.Error: If the file is not a database.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Synced from the mail queue's sending thread, which may not be the one creating it.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS messages ('
+                                     'id INTEGER PRIMARY KEY, '
+                                     'subject TEXT NOT NULL, '
+                                     'body TEXT NOT NULL, '
+                                     'timestamp REAL NOT NULL, '
+                                     'retry_count INTEGER NOT NULL, '
+                                     'next_attempt REAL NOT NULL)')
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(messages)')]
+            if 'next_attempt' not in columns:
+                # Saved before messages had a next attempt.  They are due now.
+                self._connection.execute('ALTER TABLE messages '
+                                         'ADD COLUMN next_attempt REAL NOT NULL DEFAULT 0')
+        # Retry count and next attempt of each message in the database, by id.
+        self._stored = {}
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(__name__)
+        self.logger.addHandler(logging.NullHandler())
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Constructor.  Creates a MailStore object from a config file.
+
+        :param configparser.ConfigParser cfg: The configuration file, in memory.
+        :return: MailStore object, or None if there is no database option.
+        :rtype: homemonitor.mailstore.MailStore
+        :raises configparser.Error: If any options are missing or other options files issues.
+
+        Example::
+
+            [mailqueue]
+            database=/home/pi/homemonitor/mailqueue.db
+
+        """
+        path = cfg.get(cls.SECTION, cls.DATABASE, fallback=None)
+        if not path:
+            return None
+        return cls(os.path.expandvars(path))
+
+    def load(self):
+        """Reads the messages that were waiting, oldest first.
+
+        :return: The messages.
+        :rtype: list[homemonitor.mailqueue.Message]
+        """
+        messages = []
+        with self._lock:
+            self._stored = {}
+            rows = self._connection.execute('SELECT id, subject, body, timestamp, retry_count, '
+                                            'next_attempt FROM messages ORDER BY id')
+            for store_id, subject, body, timestamp, retry_count, next_attempt in rows:
+                message = Message(subject, body, timestamp)
+                message.retry_count = retry_count
+                message.next_attempt = next_attempt
+                message.store_id = store_id
+                self._stored[store_id] = (retry_count, next_attempt)
+                messages.append(message)
+        if messages:
+            self.logger.info('Loaded %d unsent email(s) from %s.', len(messages), self.path)
+        return messages
+
+    def sync(self, messages):
+        """Makes the database match the queue, in one transaction.
+
+        New messages are inserted, messages no longer in the queue are deleted, and
+        retry counts and next attempts that changed are updated.  Takes time proportional
+        to the queue.
+
+        :param list[homemonitor.mailqueue.Message] messages: Every message in the queue.
+        :raises sqlite3.Error: If the database could not be written.  Nothing is changed.
+        """
+        with self._lock:
+            stored = {}
+            inserted = []
+            with self._connection:
+                for message in messages:
+                    # A message that was never queued is due now.
+                    state = (message.retry_count, message.next_attempt or 0.0)
+                    if message.store_id is None:
+                        cursor = self._connection.execute(
+                            'INSERT INTO messages '
+                            '(subject, body, timestamp, retry_count, next_attempt) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (message.subject, message.body, message.timestamp) + state)
+                        inserted.append((message, cursor.lastrowid))
+                        stored[cursor.lastrowid] = state
+                        continue
+                    if self._stored.get(message.store_id) != state:
+                        self._connection.execute(
+                            'UPDATE messages SET retry_count = ?, next_attempt = ? WHERE id = ?',
+                            state + (message.store_id,))
+                    stored[message.store_id] = state
+
+                self._connection.executemany(
+                    'DELETE FROM messages WHERE id = ?',
+                    [(store_id,) for store_id in self._stored if store_id not in stored])
+
+            # Committed.
+            for message, store_id in inserted:
+                message.store_id = store_id
+            self._stored = stored
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self._connection.close()
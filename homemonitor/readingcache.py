@@ -0,0 +1,105 @@
+"""Shares readings of the same hardware between everything that reads it."""
+import collections
+import threading
+import time
+
+CachedReading = collections.namedtuple('CachedReading', ['value', 'timestamp'])
+CachedReading.__doc__ = """A reading and the time it was read, in seconds since the epoch."""
+
+
+class ReadingCache(object):
+    """Keeps the latest reading of each piece of hardware.
+
+    Some hardware, like DHT sensors, can only be read every few seconds.
+    The cache lets the event loop, test mode, and anything else that needs a reading
+    share one read of the hardware.
+
+    If several threads ask for the same hardware at the same time, only one of them
+    reads it.  The others wait and get the same reading.
+
+    Example::
+
+        cache = ReadingCache()
+        reading = cache.get(('DHT22', 4), 2, read_the_sensor)
+        print('{} read at {}'.format(reading.value, reading.timestamp))
+
+    """
+    def __init__(self, clock=time.time):
+        """Constructor.
+
+        :param clock: Function returning the current time in seconds since the epoch.
+        """
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._readings = {}
+        self._in_flight = {}
+
+    def clear(self):
+        """Forgets every reading."""
+        with self._lock:
+            self._readings.clear()
+
+    def get(self, key, max_age_in_seconds, read):
+        """Returns a reading, reading the hardware only if needed.
+
+        :param key: Identifies the hardware.  Ex: (model, gpio)
+        :param float max_age_in_seconds: A cached reading older than this is read again.
+        :param read: Function that reads the hardware and returns the value.  If it raises
+            an exception, nothing is cached and the exception is raised to every caller
+            waiting on that read.
+        :return: The reading.
+        :rtype: CachedReading
+        """
+        with self._lock:
+            cached = self._readings.get(key)
+            if cached is not None:
+                # If the clock went backwards, the age is negative.  Read it again.
+                age = self.clock() - cached.timestamp
+                if 0 <= age <= max_age_in_seconds:
+                    return cached
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                is_reader = False
+            else:
+                is_reader = True
+                in_flight = _InFlightRead()
+                self._in_flight[key] = in_flight
+
+        if not is_reader:
+            return in_flight.wait()
+
+        try:
+            reading = CachedReading(read(), self.clock())
+        except Exception as error:
+            in_flight.error = error
+            raise
+        else:
+            in_flight.reading = reading
+            with self._lock:
+                self._readings[key] = reading
+            return reading
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+
+class _InFlightRead(object):
+    """A read of the hardware that other threads are waiting on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.reading = None
+        self.error = None
+
+    def wait(self):
+        """Waits for the read to finish.
+
+        :return: The reading.
+        :rtype: CachedReading
+        :raises Exception: The exception raised by the read, if it failed.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.reading
@@ -0,0 +1,129 @@
+"""Replays stored history against other alarm thresholds, to help pick them."""
+import collections
+
+from homemonitor import lazyimport
+from homemonitor.timeseries import TimeSeriesLog
+
+ReplayResult = collections.namedtuple('ReplayResult', ['sensor_name',
+                                                       'threshold',
+                                                       'readings',
+                                                       'alarms',
+                                                       'emails',
+                                                       'percent_in_alarm'])
+ReplayResult.__doc__ = """What one threshold would have done for one sensor.
+
+Alarms is how many times the alarm would have gone on.  Emails is how many alarm on and
+off emails would have been sent.  Percent in alarm is the percent of readings below
+the threshold.
+"""
+
+
+class ThresholdReplay(object):
+    """Finds what each of several alarm thresholds would have done with the stored readings.
+
+    A temperature alarm is on while the temperature is below the threshold, and an email
+    is sent each time it goes on or off.  Every threshold is evaluated at once, with
+    numpy.  Counting the emails is two sorts of the readings and a binary search per
+    threshold, so years of readings take seconds, even on a Raspberry Pi.
+
+    numpy is only needed to replay, so it is imported the first time it is used.
+
+    Example::
+
+        replay = ThresholdReplay(TimeSeriesStore('/home/pi/homemonitor/history'))
+        for result in replay.run(['TemperatureSensor/Basement'], [45, 50, 55]):
+            print('{} degrees would have sent {} emails.'.format(result.threshold,
+                                                                 result.emails))
+
+    """
+    def __init__(self, store):
+        """Constructor.
+
+        :param homemonitor.timeseries.TimeSeriesStore store: Where the readings are stored.
+        """
+        self.store = store
+
+    def load(self, sensor_name, since=None, until=None):
+        """Reads a sensor's stored readings into an array, through a memory map.
+
+        :param str sensor_name: Name of the sensor.
+        :param float since: Start of the range, in seconds since the epoch.
+            If None, starts at the oldest reading.
+        :param float until: End of the range, not included.
+            If None, ends at the newest reading.
+        :return: Values, oldest first.
+        :rtype: numpy.ndarray
+        :raises ValueError: If there is no history for the sensor.
+        """
+        numpy = lazyimport.numpy()
+        path = self.store.path(sensor_name)
+        # Checks the file and gets the number of whole readings.
+        log = self.store.open_for_reading(sensor_name)
+        count = len(log)
+        log.close()
+        if count == 0:
+            return numpy.empty(0)
+
+        records = numpy.memmap(path,
+                               dtype=numpy.dtype([('timestamp', '<f8'), ('value', '<f8')]),
+                               mode='r',
+                               offset=len(TimeSeriesLog.MAGIC),
+                               shape=(count,))
+        timestamps = records['timestamp']
+        first = 0 if since is None else numpy.searchsorted(timestamps, since, side='left')
+        last = count if until is None else numpy.searchsorted(timestamps, until, side='left')
+        values = numpy.array(records['value'][first:last])
+        # Close the memory map.
+        del records
+        return values
+
+    def evaluate(self, values, thresholds):
+        """Counts the emails and readings in alarm for each threshold.
+
+        The alarm changes between two readings, a and b, if the threshold is above
+        min(a, b) and at or below max(a, b).  Counting the pairs like that for every
+        threshold is a binary search in the sorted mins and maxes.  The alarm starts off,
+        like a sensor that was just created.
+
+        :param numpy.ndarray values: Readings, oldest first.
+        :param list[float] thresholds: Alarm thresholds.
+        :return: Number of emails and number of readings in alarm, for each threshold.
+        :rtype: tuple[numpy.ndarray, numpy.ndarray]
+        """
+        numpy = lazyimport.numpy()
+        values = numpy.asarray(values, dtype=float)
+        thresholds = numpy.asarray(thresholds, dtype=float)
+
+        # Before the first reading, the alarm is off, the same as an infinite temperature.
+        previous = numpy.concatenate(([numpy.inf], values[:-1]))
+        lows = numpy.sort(numpy.minimum(previous, values))
+        highs = numpy.sort(numpy.maximum(previous, values))
+        emails = (numpy.searchsorted(lows, thresholds, side='left') -
+                  numpy.searchsorted(highs, thresholds, side='left'))
+        in_alarm = numpy.searchsorted(numpy.sort(values), thresholds, side='left')
+        return emails, in_alarm
+
+    def run(self, sensor_names, thresholds, since=None, until=None):
+        """Replays each sensor's readings against each threshold.
+
+        :param list[str] sensor_names: Names of the sensors.
+        :param list[float] thresholds: Alarm thresholds.
+        :param float since: Start of the range.  If None, starts at the oldest reading.
+        :param float until: End of the range, not included.  If None, ends at the newest.
+        :return: A result for each sensor and threshold, in that order.
+        :rtype: list[ReplayResult]
+        :raises ValueError: If there is no history for a sensor.
+        """
+        results = []
+        for sensor_name in sensor_names:
+            values = self.load(sensor_name, since, until)
+            emails, in_alarm = self.evaluate(values, thresholds)
+            for threshold, sensor_emails, sensor_in_alarm in zip(thresholds, emails, in_alarm):
+                percent = 100.0 * sensor_in_alarm / len(values) if len(values) else 0.0
+                results.append(ReplayResult(sensor_name,
+                                            threshold,
+                                            len(values),
+                                            (int(sensor_emails) + 1) // 2,
+                                            int(sensor_emails),
+                                            percent))
+        return results
@@ -0,0 +1,171 @@
+"""Aggregates of a sensor's readings over minutes, hours and days."""
+import collections
+import logging
+import math
+
+_RollupRowBase = collections.namedtuple('RollupRow', ['start',
+                                                      'count',
+                                                      'minimum',
+                                                      'maximum',
+                                                      'total',
+                                                      'total_of_squares'])
+
+
+class RollupRow(_RollupRowBase):
+    """Count, min, max, sum, and sum of squares of the values in one period.
+
+    Start is when the period starts, in seconds since the epoch.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def first(cls, start, value):
+        """Returns a row with one value.
+
+        :param float start: When the period starts.
+        :param float value: The value.
+        :rtype: RollupRow
+        """
+        return cls(start, 1, value, value, value, value * value)
+
+    def add(self, value):
+        """Returns the row with one more value.
+
+        :param float value: The value.
+        :rtype: RollupRow
+        """
+        return self._replace(count=self.count + 1,
+                             minimum=min(self.minimum, value),
+                             maximum=max(self.maximum, value),
+                             total=self.total + value,
+                             total_of_squares=self.total_of_squares + value * value)
+
+    def merge(self, other):
+        """Returns a row with the values of both rows.
+
+        :param RollupRow other: Row for the same period.
+        :rtype: RollupRow
+        """
+        return self._replace(count=self.count + other.count,
+                             minimum=min(self.minimum, other.minimum),
+                             maximum=max(self.maximum, other.maximum),
+                             total=self.total + other.total,
+                             total_of_squares=self.total_of_squares + other.total_of_squares)
+
+    @property
+    def mean(self):
+        """Mean of the values."""
+        return self.total / self.count
+
+    @property
+    def standard_deviation(self):
+        """Population standard deviation of the values."""
+        variance = self.total_of_squares / self.count - self.mean ** 2
+        # Rounding can make a variance of 0 slightly negative.
+        return math.sqrt(max(0.0, variance))
+
+
+class Rollup(object):
+    """Keeps a :class:`RollupRow` for each period of a sensor's readings.
+
+    Each reading updates the row of the current period.  Once a reading for a later
+    period comes in, the row is finished and added to :attr:`log`, if there is one.
+    Adding a reading is O(1), and reading a month of hourly rows reads 720 rows instead
+    of every reading.
+
+    Periods start on multiples of the resolution since the epoch, so days are UTC days.
+
+    Example::
+
+        rollup = Rollup(Rollup.RESOLUTIONS['hour'])
+        rollup.append(time.time(), 68.5)
+        print('Coldest this hour: {}'.format(rollup.current.minimum))
+
+    """
+    RESOLUTIONS = collections.OrderedDict([('minute', 60),
+                                           ('hour', 60 * 60),
+                                           ('day', 24 * 60 * 60)])
+
+    def __init__(self, resolution_in_seconds):
+        """Constructor.
+
+        :param int resolution_in_seconds: Length of each period.
+        """
+        self.resolution_in_seconds = resolution_in_seconds
+        self.current = None
+        self.log = None
+        self.logger = logging.getLogger(__name__)
+        self.logger.addHandler(logging.NullHandler())
+
+    def open_log(self, log):
+        """Stores finished rows in a log.
+
+        The newest row in the log is the period that was in progress when the log was
+        closed.  It is taken back out of the log and becomes :attr:`current` again.
+
+        :param homemonitor.timeseries.RollupLog log: Log to store rows in.
+        """
+        stored = log.pop()
+        if stored is not None:
+            if self.current is None:
+                self.current = stored
+            elif stored.start == self.current.start:
+                self.current = self.current.merge(stored)
+            elif stored.start < self.current.start:
+                log.append(*stored)
+        self.log = log
+
+    def period_start(self, timestamp):
+        """Returns when the period containing a time starts.
+
+        :param float timestamp: Seconds since the epoch.
+        :rtype: float
+        """
+        return timestamp - timestamp % self.resolution_in_seconds
+
+    def append(self, timestamp, value):
+        """Adds a reading to its period's row.
+
+        :param float timestamp: When the value was read, in seconds since the epoch.
+        :param float value: The value.
+        """
+        start = self.period_start(timestamp)
+        if self.current is not None:
+            if start == self.current.start:
+                self.current = self.current.add(value)
+                return
+            if start < self.current.start:
+                self.logger.debug('Dropping reading at %s.  Its period has already finished.',
+                                  timestamp)
+                return
+            finished = self.current
+            self.current = RollupRow.first(start, value)
+            if self.log is not None:
+                self.log.append(*finished)
+            return
+        self.current = RollupRow.first(start, value)
+
+    def rows(self, since=None, until=None):
+        """Returns the rows of the periods starting in a time range, oldest first.
+
+        :param float since: Start of the range, in seconds since the epoch.
+            If None, starts at the oldest row.
+        :param float until: End of the range, not included.  If None, ends at :attr:`current`.
+        :return: Generator of rows.
+        :rtype: collections.Iterable[RollupRow]
+        """
+        if self.log is not None:
+            yield from self.log.query(since, until)
+        current = self.current
+        if (current is not None and
+                (since is None or current.start >= since) and
+                (until is None or current.start < until)):
+            yield current
+
+    def close(self):
+        """Stores the row in progress, so it is picked up again by :meth:`open_log`."""
+        if self.log is not None:
+            if self.current is not None:
+                self.log.append(*self.current)
+            self.log.close()
+            self.log = None
@@ -0,0 +1,80 @@
+"""Alarm rules written in the configuration file."""
+import ast
+import sys
+
+# Before Python 3.8, numbers are parsed as ast.Num.
+_NUMBER_NODES = (ast.Constant,) if sys.version_info >= (3, 8) else (ast.Constant, ast.Num)
+
+
+class Rule(object):
+    """An alarm rule, like ``temp_f < 50 or humidity > 85``.
+
+    The rule is parsed and checked once, when it is created, then compiled.
+    Evaluating it is a single call to the compiled code, with no parsing.
+
+    Only numbers, the given variable names, comparisons, ``and``, ``or``, ``not``,
+    ``+``, ``-``, ``*``, ``/`` and parentheses are allowed, so a rule cannot call
+    functions, look up attributes, or do anything else to the program.
+
+    Example::
+
+        rule = Rule('temp_f < 50 or humidity > 85', ['temp_f', 'temp_c', 'humidity'])
+        if rule.evaluate({'temp_f': 48.2, 'temp_c': 9.0, 'humidity': 40.0}):
+            print('Alarm!')
+
+    """
+    ALLOWED_NODES = (ast.Expression,
+                     ast.BoolOp, ast.And, ast.Or,
+                     ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+                     ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+                     ast.Compare, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+                     ast.Name, ast.Load) + _NUMBER_NODES
+
+    def __init__(self, expression, variables):
+        """Constructor.  Parses, checks and compiles the rule.
+
+        :param str expression: The rule.  Ex: temp_f < 50 or humidity > 85
+        :param list[str] variables: Names the rule may use.
+        :raises ValueError: If the rule is not valid.
+        """
+        self.expression = expression
+        self.variables = frozenset(variables)
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as error:
+            raise ValueError('Rule "{}" is not valid: {}'.format(expression, error.msg))
+        self._check(tree)
+        self._code = compile(tree, '<rule>', 'eval')
+
+    def __str__(self):
+        return self.expression
+
+    def _check(self, tree):
+        """Raises ValueError if the rule uses anything that is not allowed."""
+        for node in ast.walk(tree):
+            if not isinstance(node, self.ALLOWED_NODES):
+                raise ValueError('Rule "{}" is not valid: {} is not allowed.'.format(
+                    self.expression, type(node).__name__))
+            if isinstance(node, _NUMBER_NODES):
+                value = node.value if isinstance(node, ast.Constant) else node.n
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise ValueError('Rule "{}" is not valid: {!r} is not a number.'.format(
+                        self.expression, value))
+            if isinstance(node, ast.Name) and node.id not in self.variables:
+                raise ValueError('Rule "{}" is not valid: {} is not a variable.  '
+                                 'Valid variables are: {}'.format(self.expression,
+                                                                  node.id,
+                                                                  sorted(self.variables)))
+
+    def evaluate(self, values):
+        """Evaluates the rule.
+
+        :param dict values: Value of each variable.
+        :return: True if the alarm is on.
+        :rtype: bool
+        :raises ArithmeticError: If the rule divides by zero.
+        :raises TypeError: If a value the rule uses is None.
+        """
+        # The rule was checked, so it can only use the values.
+        # pylint: disable=eval-used
+        return bool(eval(self._code, {'__builtins__': {}}, values))
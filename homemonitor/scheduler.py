@@ -0,0 +1,101 @@
+"""Schedules when each sensor is polled next."""
+import heapq
+import math
+import time
+
+
+class Scheduler(object):
+    """Keeps track of when things are due, using a min-heap of due times.
+
+    Times come from a monotonic clock, so changing the system clock does not
+    affect the schedule.
+
+    Example::
+
+        scheduler = Scheduler()
+        scheduler.add(0, scheduler.clock() + 60)
+        scheduler.add(1, scheduler.clock() + 900)
+        scheduler.wait()
+        for key, due in scheduler.pop_due():
+            print('{} is due.'.format(key))
+
+    """
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        """Constructor.
+
+        :param clock: Function returning the current time in seconds.
+        :param sleep: Function used to sleep for a number of seconds.
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, key, due):
+        """Schedules key to be due at a given time.
+
+        :param int key: What is due.  Keys due at the same time come out smallest first.
+        :param float due: When it is due, in the same units as :attr:`clock`.
+        """
+        heapq.heappush(self._heap, (due, key))
+
+    def next_due(self):
+        """Returns when the next key is due.
+
+        :return: Time the next key is due, or None if nothing is scheduled.
+        :rtype: float
+        """
+        if not self._heap:
+            return None
+        return self._heap[0][0]
+
+    def wait(self, idle_seconds=0):
+        """Sleeps until the next key is due.
+
+        :param float idle_seconds: Seconds to sleep if nothing is scheduled.
+        """
+        next_due = self.next_due()
+        if next_due is None:
+            if idle_seconds > 0:
+                self.sleep(idle_seconds)
+            return
+        delay = next_due - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+    def pop_due(self):
+        """Removes and returns everything that is due.
+
+        :return: List of key, due pairs, earliest first.
+        :rtype: list[tuple[int, float]]
+        """
+        now = self.clock()
+        due_keys = []
+        while self._heap and self._heap[0][0] <= now:
+            due, key = heapq.heappop(self._heap)
+            due_keys.append((key, due))
+        return due_keys
+
+    def reschedule(self, key, due, interval):
+        """Schedules the next tick of something that repeats every interval.
+
+        The next tick is based on when the last tick was due, not on when it ran, so the
+        schedule does not drift.  If the last tick ran so long that one or more ticks were
+        missed, they are coalesced into a single tick that is due right away, instead of
+        running back to back.
+
+        :param int key: What is due.
+        :param float due: When the last tick was due.
+        :param float interval: Seconds between ticks.
+        :return: Number of ticks that were missed.  0 if the last tick finished in time.
+        :rtype: int
+        """
+        missed = int(math.floor((self.clock() - due) / interval))
+        if missed < 1:
+            self.add(key, due + interval)
+            return 0
+        # Keep the latest missed tick, on the original schedule, and drop the others.
+        self.add(key, due + missed * interval)
+        return missed
@@ -1,6 +1,32 @@
 """Base class for hardware sensors is defined here."""
 from abc import ABC, abstractmethod
+import collections
+import itertools
 import logging
+import random
+import threading
+import time
+
+from homemonitor.history import RingBuffer
+from homemonitor.rollup import Rollup
+from homemonitor.streaming import TrendAlarm
+
+SensorStatus = collections.namedtuple('SensorStatus',
+                                      ['name',
+                                       'alarm_on',
+                                       'alarm_changed',
+                                       'hw_error_on',
+                                       'hw_error_changed',
+                                       'reading',
+                                       'timestamp',
+                                       'value'])
+SensorStatus.__doc__ = """Status of a sensor, returned by :meth:`Sensor.status`.
+
+It cannot be changed, so it is safe to hand to another thread.
+The timestamp is when the reading was read, in seconds since the epoch.  If the sensor
+does not have a reading, it is when the status was taken.  The value is the number kept
+in the history for the reading, or None.
+"""
 
 
 class Sensor(ABC):
@@ -8,25 +34,125 @@ class Sensor(ABC):
 
     :Attributes:
         * name: The name of the alarm.  This will be emailed out.
+        * poll_interval_in_seconds: How often the sensor is polled.  If None, the event
+            loop's poll interval is used.
+        * poll_timeout_in_seconds: If a poll takes longer, it is a hardware error.
+            If None, there is no timeout.
+        * timeout_count: Number of polls that timed out.
+        * failures_in_a_row: Number of polls in a row that were hardware errors.
+        * max_backoff_in_seconds: While in hardware error, the time between polls doubles
+            after each failure, up to this many seconds.
+        * last_poll_seconds: How long the last poll took.
+        * read_attempts: Number of times a failed read is tried before it is a hardware error.
+        * retry_delay_in_seconds: Seconds before the first retry.  Doubles for each retry.
+        * retry_in_seconds: If not None, the last read failed and should be tried again in
+            this many seconds.  Until then, the status has not changed.
+        * reading: The last reading, for sensors that measure something.  Otherwise, None.
+        * reading_timestamp: When :attr:`reading` was read, in seconds since the epoch.
+        * history: The most recent readings' values, in a :class:`homemonitor.history.RingBuffer`.
+        * rollups: :class:`homemonitor.rollup.Rollup` of the values added to :attr:`history`,
+          by resolution.  Ex: rollups['hour'].current.minimum
+        * trend: :class:`homemonitor.streaming.TrendAlarm` that also sets off the alarm,
+          or None.
+        * recorders: Objects with an ``append(timestamp, value)`` method, given every value
+          added to :attr:`history`.  Ex: :class:`homemonitor.timeseries.TimeSeriesLog`
         * alarm_changed: True if the alarm changed since last call to :meth:`status`.
         * alarm_on: True if the alarm is currently on.
         * hw_error_changed: True if there was a hardware error change since last
             call to :meth:`status`.
         * hw_error_on: True if the hardware is in error state.
 
-    The main loop calls class method :meth:`status`.  If the alarm status
-    has changed since the last call, the main loop can send out communication.
-
-    Note: In the future, it might be better to have :meth:`status` return an immutable
-    object containing alarm_changed, alarm_on, hw_error_changed, and hw_error_on.
+    The main loop calls class method :meth:`status`, which returns a :class:`SensorStatus`.
+    If the alarm status has changed since the last call, the main loop can send out
+    communication.  The properties return the same values as the last :class:`SensorStatus`.
     """
-    def __init__(self, name):
-        """Constructor"""
+    # Config file defines, common to all sensors.
+    POLL_INTERVAL = 'poll_interval_in_seconds'
+    POLL_TIMEOUT = 'poll_timeout_in_seconds'
+    MAX_BACKOFF = 'max_backoff_in_seconds'
+    READ_ATTEMPTS = 'read_attempts'
+    RETRY_DELAY = 'retry_delay_in_seconds'
+    HISTORY_SIZE = 'history_size'
+    DEBOUNCE_READINGS = 'debounce_readings'
+    MAX_DROP = 'max_drop_per_hour'
+    MIN_AVERAGE = 'min_average'
+    TREND_HALF_LIFE = 'trend_half_life_in_seconds'
+
+    DEFAULT_POLL_TIMEOUT = None
+    DEFAULT_MAX_BACKOFF = 4 * 60 * 60  # 4 hours
+    DEFAULT_READ_ATTEMPTS = 1
+    DEFAULT_RETRY_DELAY = 2
+    MAX_RETRY_DELAY = 30
+    DEFAULT_HISTORY_SIZE = 2880  # 30 days of readings every 15 minutes.
+    DEFAULT_DEBOUNCE_READINGS = 1
+    DEFAULT_TREND_HALF_LIFE = 3600  # 1 hour
+
+    # After this many timeouts in a row, stop polling the sensor for a while.
+    QUARANTINE_AFTER = 3
+    QUARANTINE_IN_SECONDS = 3600
+
+    def __init__(self,
+                 name,
+                 poll_interval_in_seconds=None,
+                 poll_timeout_in_seconds=None,
+                 max_backoff_in_seconds=DEFAULT_MAX_BACKOFF,
+                 read_attempts=None,
+                 retry_delay_in_seconds=DEFAULT_RETRY_DELAY,
+                 history_size=DEFAULT_HISTORY_SIZE,
+                 debounce_readings=DEFAULT_DEBOUNCE_READINGS,
+                 max_drop_per_hour=None,
+                 min_average=None,
+                 trend_half_life_in_seconds=DEFAULT_TREND_HALF_LIFE):
+        """Constructor
+
+        :param str name: Name of the sensor.
+        :param int poll_interval_in_seconds: How often the sensor is polled.  If None, the
+            event loop's poll interval is used.
+        :param float poll_timeout_in_seconds: If a poll takes longer, it is a hardware error.
+            If None, there is no timeout.
+        :param int max_backoff_in_seconds: Most seconds between polls while in hardware error.
+        :param int read_attempts: Number of times a failed read is tried before it is a
+            hardware error.  If None, uses :attr:`DEFAULT_READ_ATTEMPTS`.
+        :param float retry_delay_in_seconds: Seconds before the first retry.
+        :param int history_size: Number of readings kept in :attr:`history`.
+        :param int debounce_readings: The alarm only changes after this many polls in a row
+            say it should.  1 changes it right away.
+        :param float max_drop_per_hour: Also set off the alarm if the readings fall faster
+            than this.  If None, not checked.
+        :param float min_average: Also set off the alarm if the moving average of the readings
+            is below this.  If None, not checked.
+        :param float trend_half_life_in_seconds: How quickly older readings stop counting
+            towards max_drop_per_hour and min_average.
+        """
         self._name = name
-        self._alarm_on = False
-        self._alarm_on_previous = False
-        self._hw_error_on = False
-        self._hw_error_on_previous = False
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        self.poll_timeout_in_seconds = poll_timeout_in_seconds
+        self.max_backoff_in_seconds = max_backoff_in_seconds
+        self.failures_in_a_row = 0
+        self.last_poll_seconds = 0.0
+        if read_attempts is None:
+            read_attempts = self.DEFAULT_READ_ATTEMPTS
+        self.read_attempts = read_attempts
+        self.retry_delay_in_seconds = retry_delay_in_seconds
+        self.retry_in_seconds = None
+        self._attempt = 1
+        self.reading = None
+        self.reading_timestamp = None
+        self.history = RingBuffer(history_size)
+        self.rollups = {resolution: Rollup(seconds)
+                        for resolution, seconds in Rollup.RESOLUTIONS.items()}
+        self.recorders = []
+        self.timeout_count = 0
+        self._timeouts_in_a_row = 0
+        self._quarantine_until = None
+        self._hung_poll = None
+        self.debounce_readings = debounce_readings
+        if max_drop_per_hour is None and min_average is None:
+            self.trend = None
+        else:
+            self.trend = TrendAlarm(max_drop_per_hour, min_average, trend_half_life_in_seconds)
+        self._debounce_count = 0
+        self._status = SensorStatus(name, False, False, False, False, None, None, None)
         self.logger = logging.getLogger(__name__)
         self.logger.addHandler(logging.NullHandler())
 
@@ -38,22 +164,27 @@ class Sensor(ABC):
     @property
     def alarm_changed(self):
         """Returns if the alarm changed since the last time :meth:`status` was called."""
-        return self.alarm_on != self._alarm_on_previous
+        return self._status.alarm_changed
 
     @property
     def alarm_on(self):
         """Returns if the alarm is currently on."""
-        return self._alarm_on
+        return self._status.alarm_on
 
     @property
     def hw_error_changed(self):
         """Returns if the hardware error changed."""
-        return self.hw_error_on != self._hw_error_on_previous
+        return self._status.hw_error_changed
 
     @property
     def hw_error_on(self):
         """Returns if the hardware error is currently on."""
-        return self._hw_error_on
+        return self._status.hw_error_on
+
+    @property
+    def last_status(self):
+        """Returns what the last call to :meth:`status` returned."""
+        return self._status
 
     def status(self):
         """Updates the status of the sensor.
@@ -61,29 +192,244 @@ class Sensor(ABC):
         If the alarm status has changed, logs a message.
         If the _poll method fails (HW error), logs an error.
         If the error is cleared, logs a message.
+        If the _poll method asks to be tried again, nothing changes and
+        :attr:`retry_in_seconds` says when to call this method again.
 
-        After calling this method, call the properties (attributes) to get the status.
+        :return: The new status.
+        :rtype: SensorStatus
         """
-        self._alarm_on_previous = self.alarm_on
-        self._hw_error_on_previous = self.hw_error_on
+        previous = self._status
+        alarm_on = previous.alarm_on
+        hw_error_on = previous.hw_error_on
+        error = None
+        self.retry_in_seconds = None
+        start = time.monotonic()
         try:
-            self._alarm_on = self._poll()
-            self._hw_error_on = False
-        except SensorError as error:
-            self._hw_error_on = True
-            if self.hw_error_changed:
-                # Ex: ERROR:homemonitor.sensor:MockSensor - Failed to connect to hardware!
-                self.logger.error('%s - %s', self.name, str(error))
+            polled_alarm_on = self._watchdog_poll()
+            trend_alarm_on = self._trend_alarm_on(previous.alarm_on)
+            alarm_on = self._debounce(previous.alarm_on, polled_alarm_on or trend_alarm_on)
+            hw_error_on = False
+        except SensorRetry as retry_error:
+            if self._attempt < self.read_attempts:
+                self._retry_later(retry_error)
+            else:
+                hw_error_on, error = True, retry_error
+        except SensorError as sensor_error:
+            hw_error_on, error = True, sensor_error
+        finally:
+            self.last_poll_seconds = time.monotonic() - start
+
+        if self.retry_in_seconds is None:
+            self._attempt = 1
+            if hw_error_on:
+                self.failures_in_a_row += 1
+            else:
+                self.failures_in_a_row = 0
+
+        if self.reading is not None:
+            timestamp, value = self.reading_timestamp, self._value(self.reading)
+        else:
+            timestamp, value = time.time(), None
+        status = SensorStatus(self.name,
+                              alarm_on,
+                              alarm_on != previous.alarm_on,
+                              hw_error_on,
+                              hw_error_on != previous.hw_error_on,
+                              self.reading,
+                              timestamp,
+                              value)
+        self._status = status
+        self._log_status(status, error)
+        if not hw_error_on and self.retry_in_seconds is None:
+            self._record(status)
+        return status
+
+    def _trend_alarm_on(self, alarm_on):
+        """Updates :attr:`trend` with the reading from the poll.
+
+        :param bool alarm_on: The alarm before the poll.
+        :return: True if the trend sets off the alarm.
+        :rtype: bool
+        """
+        if self.trend is None or self.reading is None:
+            return False
+        value = self._value(self.reading)
+        if value is None:
+            return False
+        trend_alarm_on = self.trend.update(self.reading_timestamp, value)
+        if trend_alarm_on and not alarm_on:
+            self.logger.warning('%s is %s.', self.name, self.trend.reason())
+        return trend_alarm_on
+
+    def _debounce(self, alarm_on, polled_alarm_on):
+        """Only changes the alarm after :attr:`debounce_readings` polls in a row.
+
+        A sensor sitting right at its threshold would otherwise turn the alarm on and off
+        every poll, and send an email each time.
+
+        :param bool alarm_on: The alarm now.
+        :param bool polled_alarm_on: What the poll says the alarm should be.
+        :return: The new alarm.
+        :rtype: bool
+        """
+        if polled_alarm_on == alarm_on:
+            self._debounce_count = 0
+            return alarm_on
+        self._debounce_count += 1
+        if self._debounce_count < self.debounce_readings:
+            self.logger.debug('%s - Alarm change %d of %d.',
+                              self.name,
+                              self._debounce_count,
+                              self.debounce_readings)
+            return alarm_on
+        self._debounce_count = 0
+        return polled_alarm_on
+
+    def _record(self, status):
+        """Adds the reading to the history.
+
+        A reading shared from the reading cache is only added once.
+
+        :param SensorStatus status: Status with a new reading.
+        """
+        if status.value is None:
             return
+        latest = self.history.latest()
+        if latest is not None and latest[0] == status.timestamp:
+            return
+        self.history.append(status.timestamp, status.value)
+        for recorder in itertools.chain(self.rollups.values(), self.recorders):
+            try:
+                recorder.append(status.timestamp, status.value)
+            except OSError as error:
+                # Losing a reading is better than stopping the monitor.
+                self.logger.error('%s - Failed to record reading: %s', self.name, error)
+
+    def _value(self, reading):
+        """Returns the number kept in the history for a reading.
 
-        if self.hw_error_changed:
-            self.logger.info('%s - OK.', self.name)
+        Sensors with readings override this method.  Ex: Return the temperature.
+
+        :param reading: The reading.
+        :return: The number, or None to not keep the reading.
+        :rtype: float
+        """
+        return None
 
-        if self.alarm_changed:
+    def _log_status(self, status, error):
+        """Logs changes in the status.
+
+        :param SensorStatus status: The new status.
+        :param SensorError error: The error, if the hardware is in error.
+        """
+        if status.hw_error_changed:
+            if status.hw_error_on:
+                # Ex: ERROR:homemonitor.sensor:MockSensor - Failed to connect to hardware!
+                self.logger.error('%s - %s', status.name, str(error))
+            else:
+                self.logger.info('%s - OK.', status.name)
+
+        if status.alarm_changed:
             # Ex: INFO:homemonitor.sensor:MockSensor is on.
             self.logger.info('%s is %s.',
-                             self.name,
-                             self._bool_to_string(self.alarm_on))
+                             status.name,
+                             self._bool_to_string(status.alarm_on))
+
+    def _retry_later(self, error):
+        """Sets :attr:`retry_in_seconds`, so the caller tries the read again later.
+
+        The delay doubles with each attempt, up to :attr:`MAX_RETRY_DELAY`.
+        It is randomized, so sensors that fail together do not retry together.
+        """
+        delay = min(self.retry_delay_in_seconds * 2 ** (self._attempt - 1), self.MAX_RETRY_DELAY)
+        self.retry_in_seconds = random.uniform(delay / 2, delay)
+        self.logger.debug('%s - %s  Attempt %d of %d, trying again in %.1f seconds.',
+                          self.name,
+                          str(error),
+                          self._attempt,
+                          self.read_attempts,
+                          self.retry_in_seconds)
+        self._attempt += 1
+
+    def next_poll_interval(self, interval):
+        """Returns how long to wait before polling the sensor again.
+
+        While the sensor is in hardware error, the wait doubles after each failure,
+        up to :attr:`max_backoff_in_seconds`.  Polling a broken sensor is slow and
+        almost always fails again.  Once a poll succeeds, the normal interval is used.
+
+        :param float interval: Normal seconds between polls.
+        :return: Seconds until the next poll.
+        :rtype: float
+        """
+        if not self.hw_error_on or self.failures_in_a_row < 2:
+            return interval
+        # Limit the exponent, so the number does not grow without bound.
+        doublings = min(self.failures_in_a_row - 1, 32)
+        return max(interval, min(interval * 2 ** doublings, self.max_backoff_in_seconds))
+
+    @property
+    def quarantined(self):
+        """Returns if the sensor is not being polled because it keeps hanging."""
+        return self._quarantine_until is not None and time.monotonic() < self._quarantine_until
+
+    def _watchdog_poll(self):
+        """Calls :meth:`_poll`, giving up if it takes longer than the poll timeout.
+
+        The poll runs on its own thread, so a driver that never returns cannot hang the
+        caller.  A thread cannot be stopped, so while a timed out poll is still running,
+        the sensor is not polled again.  After :attr:`QUARANTINE_AFTER` timeouts in a row,
+        the sensor is not polled for :attr:`QUARANTINE_IN_SECONDS`.
+
+        :return: True if the alarm is on.  False if the alarm is off.
+        :rtype: bool
+        :raises SensorError: If the poll fails or times out.
+        """
+        if self.poll_timeout_in_seconds is None:
+            return self._poll()
+
+        if self.quarantined:
+            raise SensorError('Not responding.  Not polled until quarantine is over.')
+        if self._hung_poll is not None and self._hung_poll.is_alive():
+            raise SensorError('Not responding.  Still waiting on the last poll.')
+        self._hung_poll = None
+
+        result = {}
+        thread = threading.Thread(target=self._run_poll,
+                                  args=(result,),
+                                  name='poll-{}'.format(self.name),
+                                  daemon=True)
+        thread.start()
+        thread.join(self.poll_timeout_in_seconds)
+        if thread.is_alive():
+            self._poll_timed_out(thread)
+            raise SensorError('Poll timed out after {} seconds.'.format(
+                self.poll_timeout_in_seconds))
+
+        self._timeouts_in_a_row = 0
+        if 'error' in result:
+            raise result['error']
+        return result['alarm_on']
+
+    def _run_poll(self, result):
+        """Calls :meth:`_poll` and stores the result.  Runs on the watchdog thread."""
+        try:
+            result['alarm_on'] = self._poll()
+        except Exception as error:  # pylint: disable=broad-except
+            result['error'] = error
+
+    def _poll_timed_out(self, thread):
+        """Counts a timeout and quarantines the sensor if it keeps timing out."""
+        self._hung_poll = thread
+        self.timeout_count += 1
+        self._timeouts_in_a_row += 1
+        if self._timeouts_in_a_row >= self.QUARANTINE_AFTER:
+            self._quarantine_until = time.monotonic() + self.QUARANTINE_IN_SECONDS
+            self.logger.warning('%s - Timed out %d times in a row.  Not polling it for %d '
+                                'seconds.',
+                                self.name,
+                                self._timeouts_in_a_row,
+                                self.QUARANTINE_IN_SECONDS)
 
     @staticmethod
     def _bool_to_string(value):
@@ -93,6 +439,43 @@ class Sensor(ABC):
         else:
             return 'off'
 
+    @classmethod
+    def _sensor_options(cls, cfg, section):
+        """Reads the options common to all sensors from a config section.
+
+        :param configparser.ConfigParser cfg: Config object.
+        :param str section: Section of the sensor.
+        :return: Keyword arguments for the :class:`Sensor` constructor.
+        :rtype: dict
+        :raises configparser.Error: If any options are invalid.
+        """
+        return {
+            'poll_interval_in_seconds': cfg.getint(section, cls.POLL_INTERVAL, fallback=None),
+            'poll_timeout_in_seconds': cfg.getfloat(section,
+                                                    cls.POLL_TIMEOUT,
+                                                    fallback=cls.DEFAULT_POLL_TIMEOUT),
+            'max_backoff_in_seconds': cfg.getint(section,
+                                                 cls.MAX_BACKOFF,
+                                                 fallback=cls.DEFAULT_MAX_BACKOFF),
+            'read_attempts': cfg.getint(section,
+                                        cls.READ_ATTEMPTS,
+                                        fallback=cls.DEFAULT_READ_ATTEMPTS),
+            'retry_delay_in_seconds': cfg.getfloat(section,
+                                                   cls.RETRY_DELAY,
+                                                   fallback=cls.DEFAULT_RETRY_DELAY),
+            'history_size': cfg.getint(section,
+                                       cls.HISTORY_SIZE,
+                                       fallback=cls.DEFAULT_HISTORY_SIZE),
+            'debounce_readings': cfg.getint(section,
+                                            cls.DEBOUNCE_READINGS,
+                                            fallback=cls.DEFAULT_DEBOUNCE_READINGS),
+            'max_drop_per_hour': cfg.getfloat(section, cls.MAX_DROP, fallback=None),
+            'min_average': cfg.getfloat(section, cls.MIN_AVERAGE, fallback=None),
+            'trend_half_life_in_seconds': cfg.getfloat(section,
+                                                       cls.TREND_HALF_LIFE,
+                                                       fallback=cls.DEFAULT_TREND_HALF_LIFE),
+        }
+
     @staticmethod
     def _find_sections_and_names(basename, cfg):
         """Finds all the sections for a given sensor basename.
@@ -117,6 +500,7 @@ class Sensor(ABC):
         :return: True if the alarm is on.  False if the alarm is off.
         :rtype: bool
         :raises SensorError: If something goes wrong with the sensor.
+        :raises SensorRetry: If the read failed, but may work if tried again.
 
         The class overrides this method to check the actual hardware.
         Only the base class should call this method.
@@ -127,3 +511,8 @@ class Sensor(ABC):
 class SensorError(Exception):
     """Raised is a hardware error with a sensor."""
     pass
+
+
+class SensorRetry(SensorError):
+    """Raised if a read failed, but may work if tried again."""
+    pass
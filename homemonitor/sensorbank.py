@@ -0,0 +1,160 @@
+"""Many sensors' alarms, checked together with numpy."""
+import logging
+import time
+
+from homemonitor import lazyimport
+from homemonitor.sensor import SensorStatus
+
+
+class SensorBank(object):
+    """Checks the alarms of many sensors at once.
+
+    The thresholds, latest values, and alarm and hardware error states of every sensor are
+    kept in numpy arrays, one element per sensor.  Each tick, the new values are compared
+    with the thresholds in one pass, with no Python loop over the sensors.  Only the
+    sensors whose status changed are returned, so only they are logged and emailed.
+
+    The alarm works the same as :class:`homemonitor.temperaturesensor.TemperatureSensor`:
+    it goes on below the threshold, and goes off again at the hysteresis above it.
+    A value of NaN is a sensor that could not be read.  It turns on the sensor's
+    hardware error, and its alarm stays as it was.
+
+    numpy is only needed for a bank, so it is imported when a bank is created.
+
+    A bank given to :class:`homemonitor.eventloop.EventLoop` is polled on its own schedule,
+    the same as a sensor, and the statuses from :meth:`poll` are emailed the same as
+    any sensor's.
+
+    Example::
+
+        bank = SensorBank(['Simulated/1', 'Simulated/2'], [50, 45])
+        changed = bank.update([48.5, float('nan')])
+        for status in bank.statuses(changed):
+            print(status)
+
+    """
+    def __init__(self, names, thresholds, hysteresis_in_degrees=0, read_values=None,
+                 poll_interval_in_seconds=None, name='SensorBank'):
+        """Constructor.
+
+        :param list[str] names: Name of each sensor.
+        :param list[float] thresholds: Alarm threshold of each sensor.
+        :param hysteresis_in_degrees: Degrees above the threshold the value must reach to
+            turn the alarm off.  One for every sensor, or one per sensor.
+        :type hysteresis_in_degrees: float or list[float]
+        :param read_values: Function returning the new value of each sensor, NaN if it could
+            not be read.  Needed by :meth:`poll`.
+        :param int poll_interval_in_seconds: How often the event loop polls the bank.
+            If None, the event loop's poll interval.
+        :param str name: Name of the bank, used in the event loop's logs.
+        :raises ValueError: If there is not one threshold per sensor.
+        """
+        numpy = lazyimport.numpy()
+        self.name = name
+        self.read_values = read_values
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        self.names = list(names)
+        self.thresholds = numpy.array(thresholds, dtype=float)
+        if self.thresholds.shape != (len(self.names),):
+            raise ValueError('SensorBank has {} sensors, but {} thresholds!'.format(
+                len(self.names), self.thresholds.size))
+        self.hysteresis_in_degrees = numpy.broadcast_to(
+            numpy.asarray(hysteresis_in_degrees, dtype=float), self.thresholds.shape)
+
+        self.values = numpy.full(len(self.names), numpy.nan)
+        self.timestamp = None
+        self.alarm_on = numpy.zeros(len(self.names), dtype=bool)
+        self.hw_error_on = numpy.zeros(len(self.names), dtype=bool)
+        self.alarm_changed = numpy.zeros(len(self.names), dtype=bool)
+        self.hw_error_changed = numpy.zeros(len(self.names), dtype=bool)
+
+        self.logger = logging.getLogger(__name__)
+        self.logger.addHandler(logging.NullHandler())
+
+    def __len__(self):
+        return len(self.names)
+
+    def update(self, values, timestamp=None):
+        """Checks every sensor's new value against its threshold.
+
+        :param values: New value of each sensor.  NaN if the sensor could not be read.
+        :type values: list[float] or numpy.ndarray
+        :param float timestamp: When the values were read, in seconds since the epoch.
+            If None, now.
+        :return: Indexes of the sensors whose alarm or hardware error changed.
+        :rtype: numpy.ndarray
+        :raises ValueError: If there is not one value per sensor.
+        """
+        numpy = lazyimport.numpy()
+        values = numpy.asarray(values, dtype=float)
+        if values.shape != self.values.shape:
+            raise ValueError('SensorBank has {} sensors, but {} values!'.format(
+                len(self.names), values.size))
+
+        hw_error_on = numpy.isnan(values)
+        thresholds = numpy.where(self.alarm_on,
+                                 self.thresholds + self.hysteresis_in_degrees,
+                                 self.thresholds)
+        # Comparing NaN is always False, so pick the old alarm for sensors in error.
+        with numpy.errstate(invalid='ignore'):
+            alarm_on = numpy.where(hw_error_on, self.alarm_on, values < thresholds)
+
+        numpy.not_equal(alarm_on, self.alarm_on, out=self.alarm_changed)
+        numpy.not_equal(hw_error_on, self.hw_error_on, out=self.hw_error_changed)
+        self.alarm_on = alarm_on
+        self.hw_error_on = hw_error_on
+        self.values = values
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+        changed = numpy.flatnonzero(self.alarm_changed | self.hw_error_changed)
+        self._log_changes(changed)
+        return changed
+
+    def poll(self):
+        """Reads every sensor and checks the new values.
+
+        If :attr:`read_values` raises an error or does not return one value per sensor,
+        it is logged and every sensor gets a hardware error, so the event loop keeps going.
+
+        :return: Status of each sensor whose alarm or hardware error changed.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        try:
+            return self.statuses(self.update(self.read_values()))
+        except Exception as error:  # pylint: disable=broad-except
+            self.logger.error('%s - Failed to read sensors: %s', self.name, error)
+            numpy = lazyimport.numpy()
+            return self.statuses(self.update(numpy.full(len(self), numpy.nan)))
+
+    def _log_changes(self, changed):
+        """Logs the sensors whose status changed, the same as a sensor does."""
+        for index in changed:
+            name = self.names[index]
+            if self.hw_error_changed[index]:
+                if self.hw_error_on[index]:
+                    self.logger.error('%s - Failed to read sensor!', name)
+                else:
+                    self.logger.info('%s - OK.', name)
+            if self.alarm_changed[index]:
+                self.logger.info('%s is %s.', name, 'on' if self.alarm_on[index] else 'off')
+
+    def statuses(self, indexes):
+        """Returns the status of some sensors, from the last update.
+
+        :param indexes: Indexes of the sensors, usually from :meth:`update`.
+        :type indexes: list[int] or numpy.ndarray
+        :return: Status of each sensor, which can be emailed the same as any sensor's.
+        :rtype: list[homemonitor.sensor.SensorStatus]
+        """
+        statuses = []
+        for index in indexes:
+            value = None if self.hw_error_on[index] else float(self.values[index])
+            statuses.append(SensorStatus(self.names[index],
+                                         bool(self.alarm_on[index]),
+                                         bool(self.alarm_changed[index]),
+                                         bool(self.hw_error_on[index]),
+                                         bool(self.hw_error_changed[index]),
+                                         value,
+                                         self.timestamp,
+                                         value))
+        return statuses
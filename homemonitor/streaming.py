@@ -0,0 +1,159 @@
+"""Statistics of a sensor's readings, updated one reading at a time."""
+
+
+class Ewma(object):
+    """Exponentially weighted moving average of readings taken at any interval.
+
+    The weight of a reading halves every :attr:`half_life_in_seconds`, so readings taken
+    close together count for less than readings taken far apart.  Only the average and
+    the time of the last reading are kept.
+
+    Example::
+
+        average = Ewma(3600)
+        average.update(time.time(), 68.5)
+        print(average.value)
+
+    """
+    def __init__(self, half_life_in_seconds):
+        """Constructor.
+
+        :param float half_life_in_seconds: Seconds for the weight of a reading to halve.
+        """
+        self.half_life_in_seconds = half_life_in_seconds
+        self.value = None
+        self.timestamp = None
+
+    def update(self, timestamp, value):
+        """Adds a reading.  A reading not newer than the last one is ignored.
+
+        :param float timestamp: When the value was read, in seconds since the epoch.
+        :param float value: The value.
+        :return: The new average.
+        :rtype: float
+        """
+        if self.value is None:
+            self.value = value
+        elif timestamp > self.timestamp:
+            weight = 1 - 2 ** (-(timestamp - self.timestamp) / self.half_life_in_seconds)
+            self.value += weight * (value - self.value)
+        else:
+            return self.value
+        self.timestamp = timestamp
+        return self.value
+
+
+class RateOfChange(object):
+    """How fast readings are changing, per hour, smoothed with an :class:`Ewma`.
+
+    The rate starts at 0 at the first reading, so it takes about a half-life of
+    readings to reach the actual rate.
+
+    Example::
+
+        rate = RateOfChange(3600)
+        rate.update(time.time(), 68.5)
+        ...
+        if rate.update(time.time(), 64.0) < -5:
+            print('Falling more than 5 degrees per hour!')
+
+    """
+    def __init__(self, half_life_in_seconds):
+        """Constructor.
+
+        :param float half_life_in_seconds: Seconds for the weight of a reading to halve.
+        """
+        self._rate = Ewma(half_life_in_seconds)
+        self._last = None
+
+    @property
+    def per_hour(self):
+        """Smoothed change per hour, or None until there is a reading."""
+        return self._rate.value
+
+    def update(self, timestamp, value):
+        """Adds a reading.  A reading not newer than the last one is ignored.
+
+        :param float timestamp: When the value was read, in seconds since the epoch.
+        :param float value: The value.
+        :return: The new change per hour.
+        :rtype: float
+        """
+        if self._last is None:
+            # Start at no change, so the first difference, which may only be sensor
+            # noise, is smoothed the same as any other.
+            self._rate.update(timestamp, 0.0)
+        else:
+            last_timestamp, last_value = self._last
+            if timestamp <= last_timestamp:
+                return self.per_hour
+            self._rate.update(timestamp,
+                              (value - last_value) * 3600 / (timestamp - last_timestamp))
+        self._last = (timestamp, value)
+        return self.per_hour
+
+
+class TrendAlarm(object):
+    """Alarm on a falling trend, before a reading drops below the sensor's threshold.
+
+    The alarm is on while the readings fall faster than :attr:`max_drop_per_hour`,
+    or while their moving average is below :attr:`min_average`.
+    For example, a furnace failure is caught while the house is still warm.
+
+    Example::
+
+        trend = TrendAlarm(max_drop_per_hour=5)
+        if trend.update(time.time(), 64.0):
+            print(trend.reason())
+
+    """
+    def __init__(self, max_drop_per_hour=None, min_average=None, half_life_in_seconds=3600):
+        """Constructor.
+
+        :param float max_drop_per_hour: Alarm if falling faster than this.
+            If None, the rate of change is not checked.
+        :param float min_average: Alarm if the moving average is below this.
+            If None, the moving average is not checked.
+        :param float half_life_in_seconds: How quickly older readings stop counting.
+        """
+        self.max_drop_per_hour = max_drop_per_hour
+        self.min_average = min_average
+        self.rate = RateOfChange(half_life_in_seconds)
+        self.average = Ewma(half_life_in_seconds)
+
+    def _dropping(self):
+        """Returns True if falling faster than :attr:`max_drop_per_hour`."""
+        return (self.max_drop_per_hour is not None and
+                self.rate.per_hour is not None and
+                self.rate.per_hour < -self.max_drop_per_hour)
+
+    def _below_average(self):
+        """Returns True if the moving average is below :attr:`min_average`."""
+        return (self.min_average is not None and
+                self.average.value is not None and
+                self.average.value < self.min_average)
+
+    def update(self, timestamp, value):
+        """Adds a reading.  O(1) time and memory.
+
+        :param float timestamp: When the value was read, in seconds since the epoch.
+        :param float value: The value.
+        :return: True if the alarm is on.
+        :rtype: bool
+        """
+        self.rate.update(timestamp, value)
+        self.average.update(timestamp, value)
+        return self._dropping() or self._below_average()
+
+    def reason(self):
+        """Returns why the alarm is on.
+
+        :return: Ex: 'falling 6.2 per hour'.  Empty if the alarm is off.
+        :rtype: str
+        """
+        reasons = []
+        if self._dropping():
+            reasons.append('falling {:.1f} per hour'.format(-self.rate.per_hour))
+        if self._below_average():
+            reasons.append('averaging {:.1f}'.format(self.average.value))
+        return ' and '.join(reasons)
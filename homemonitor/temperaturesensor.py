@@ -6,8 +6,24 @@ Supports the following sensors from Adafruit_DHT:
     * AM2302
 
 """
+import collections
+import time
 
-from homemonitor.sensor import Sensor, SensorError
+from homemonitor.sensor import Sensor, SensorError, SensorRetry
+from homemonitor.readingcache import ReadingCache
+from homemonitor.rule import Rule
+
+TemperatureReading = collections.namedtuple('TemperatureReading',
+                                            ['temperature_celsius',
+                                             'temperature_fahrenheit',
+                                             'humidity',
+                                             'latency_in_seconds',
+                                             'attempts'])
+TemperatureReading.__doc__ = """Everything measured by one read of a DHT sensor.
+
+Humidity is a percentage.  Latency is how long the read took.
+Attempts is how many reads it took to get this one.
+"""
 
 
 class TemperatureSensor(Sensor):
@@ -17,26 +33,69 @@ class TemperatureSensor(Sensor):
     TEMPERATURE = 'temperature'
     GPIO = 'gpio'
     MODEL = 'model'
+    CACHE_TTL = 'cache_ttl_in_seconds'
+    HYSTERESIS = 'hysteresis_in_degrees'
+    RULE = 'rule'
+
+    # Names an alarm rule can use.
+    RULE_VARIABLES = ('temp_f', 'temp_c', 'humidity')
+
+    DEFAULT_POLL_TIMEOUT = 60
+
+    # DHT sensors can only be read about once every 2 seconds.
+    DEFAULT_CACHE_TTL = 2
+
+    DEFAULT_HYSTERESIS = 0
+
+    # Readings are shared by every sensor object on the same model and GPIO.
+    READING_CACHE = ReadingCache()
+
+    # Retry a failed read 2, 4, 8 and 16 seconds later.  About the same time
+    # Adafruit_DHT.read_retry() would block for, but without blocking.
+    DEFAULT_READ_ATTEMPTS = 5
 
     MODELS = ('DHT11', 'DHT22', 'AM2302')
 
-    def __init__(self, name, temperature, gpio, model):
+    def __init__(self,
+                 name,
+                 temperature,
+                 gpio,
+                 model,
+                 cache_ttl_in_seconds=DEFAULT_CACHE_TTL,
+                 hysteresis_in_degrees=DEFAULT_HYSTERESIS,
+                 rule=None,
+                 **kwargs):
         """Constructor.
 
         :param str name: Name of the sensor.
         :param int temperature: When temperator goes below, set off the alarm.
+            Not used if there is a rule.
         :param int gpio: GPIO pin the sensor is connected.
         :param str model: DHT11, DHT22, or AM2302.
+        :param float cache_ttl_in_seconds: A reading of the sensor is reused for this
+            many seconds, instead of reading the hardware again.
+        :param float hysteresis_in_degrees: Once the alarm is on, it stays on until the
+            temperature is this many degrees above the threshold.
+        :param homemonitor.rule.Rule rule: If not None, sets off the alarm instead of
+            temperature.  Can use :attr:`RULE_VARIABLES`.
+        :param kwargs: Options passed to :class:`homemonitor.sensor.Sensor`.
         :raises ValueError: If model is invalid.
         """
-        super().__init__(name)
+        super().__init__(name, **kwargs)
         self.temperature = temperature
         self.gpio = gpio
+        self.cache_ttl_in_seconds = cache_ttl_in_seconds
+        self.hysteresis_in_degrees = hysteresis_in_degrees
+        self.rule = rule
 
         model = model.upper()
         self._validate_model(name, model)
         self.model = model
 
+        # Loaded the first time the sensor is polled.
+        self._driver = None
+        self._driver_model = None
+
         self.logger.info('Created %s', str(self))
 
     @classmethod
@@ -52,9 +111,12 @@ class TemperatureSensor(Sensor):
         :return: String representation of the class.
         :rtype: str
         """
-        format_string = 'TemperatureSensor {} with temperature threshold of {} degrees, ' \
-                        'connected to GPIO {}, and model {}.'
-        return format_string.format(self.name, self.temperature, self.gpio, self.model)
+        if self.rule is not None:
+            alarm = 'alarm rule "{}"'.format(self.rule)
+        else:
+            alarm = 'temperature threshold of {} degrees'.format(self.temperature)
+        format_string = 'TemperatureSensor {} with {}, connected to GPIO {}, and model {}.'
+        return format_string.format(self.name, alarm, self.gpio, self.model)
 
     @classmethod
     def from_config(cls, cfg):
@@ -64,6 +126,7 @@ class TemperatureSensor(Sensor):
         :return: List of TemperatureSensor objects.
         :rtype: list[homemonitor.temperaturesensor.TemperatureSensor]
         :raises configparser.Error: If any options are missing or other options files issues.
+        :raises ValueError: If a model or rule is invalid.
 
         Note: Currently only one sensor is supported.  In the future, maybe have multiple
         sensors and this function will return a list of sensors?
@@ -75,52 +138,168 @@ class TemperatureSensor(Sensor):
             gpio=4
             model=AM2302
 
+            [TemperatureSensor_Garage]
+            rule=temp_f < 35 or humidity > 85
+            gpio=17
+            model=DHT22
+
             [TemperatureSensor_Attic]
             temperature=60
             gpio=25
             model=dht11
+            poll_interval_in_seconds=3600
+            poll_timeout_in_seconds=60
+            read_attempts=5
+            retry_delay_in_seconds=2
+            cache_ttl_in_seconds=2
+            history_size=2880
+            hysteresis_in_degrees=1
+            debounce_readings=2
 
         """
         return_sensors = []
 
         section_and_names = cls._find_sections_and_names(cls.SENSOR_BASE, cfg)
         for section, name in section_and_names:
-            temperature = cfg.getint(section, cls.TEMPERATURE)
+            rule = cls._rule_from_config(cfg, section, name)
+            if rule is None:
+                temperature = cfg.getint(section, cls.TEMPERATURE)
+            else:
+                temperature = cfg.getint(section, cls.TEMPERATURE, fallback=None)
             gpio = cfg.getint(section, cls.GPIO)
             model = cfg.get(section, cls.MODEL)
+            cache_ttl = cfg.getfloat(section, cls.CACHE_TTL, fallback=cls.DEFAULT_CACHE_TTL)
+            hysteresis = cfg.getfloat(section, cls.HYSTERESIS, fallback=cls.DEFAULT_HYSTERESIS)
             new_sensor = cls('{}/{}'.format(cls.SENSOR_BASE, name),
                              temperature,
                              gpio,
-                             model)
+                             model,
+                             cache_ttl,
+                             hysteresis,
+                             rule,
+                             **cls._sensor_options(cfg, section))
             return_sensors.append(new_sensor)
 
         return return_sensors
 
-    def _poll(self):
-        """Polls the sensor.
+    @classmethod
+    def _rule_from_config(cls, cfg, section, name):
+        """Reads and compiles the alarm rule, if there is one.
+
+        :return: The rule, or None.
+        :rtype: homemonitor.rule.Rule
+        :raises ValueError: If the rule is invalid.
+        """
+        expression = cfg.get(section, cls.RULE, fallback=None)
+        if expression is None:
+            return None
+        try:
+            return Rule(expression, cls.RULE_VARIABLES)
+        except ValueError as error:
+            raise ValueError('For {}/{}, {}'.format(cls.SENSOR_BASE, name, error))
+
+    def _load_driver(self):
+        """Loads the Adafruit_DHT driver, the first time it is needed.
+
+        :return: Driver module and the driver's value for :attr:`model`.
+        :rtype: tuple
+        """
+        if self._driver is None:
+            # noinspection PyUnresolvedReferences
+            # pylint: disable=import-error
+            import Adafruit_DHT
+
+            model_to_enum = {'DHT11': Adafruit_DHT.DHT11,
+                             'DHT22': Adafruit_DHT.DHT22,
+                             'AM2302': Adafruit_DHT.AM2302}
+            self._driver_model = model_to_enum[self.model]
+            self._driver = Adafruit_DHT
+        return self._driver, self._driver_model
 
+    def _read(self):
+        """Reads the hardware once.
+
+        :return: The reading.
+        :rtype: TemperatureReading
+        :raises SensorRetry: If the sensor could not be read.
+        """
+        driver, driver_model = self._load_driver()
+        start = time.monotonic()
+        humidity, temperature_celsius = driver.read(driver_model, self.gpio)
+        latency = time.monotonic() - start
+
+        if temperature_celsius is None:
+            raise SensorRetry('Failed to read {}!'.format(self.name))
+
+        return TemperatureReading(temperature_celsius=temperature_celsius,
+                                  temperature_fahrenheit=temperature_celsius * 9/5.0 + 32,
+                                  humidity=humidity,
+                                  latency_in_seconds=latency,
+                                  attempts=self._attempt)
+
+    def _evaluate(self, reading):
+        """Checks a reading against the alarm threshold.
+
+        The alarm goes on below :attr:`temperature`, but only goes off again at
+        :attr:`hysteresis_in_degrees` above it, so a temperature sitting at the
+        threshold does not turn the alarm on and off.  The band follows the alarm after
+        debouncing, not the last reading, so a reading below the threshold that did not
+        turn the alarm on does not raise the threshold.
+
+        :param TemperatureReading reading: The reading.
         :return: True if the alarm is on.  False if the alarm is off.
         :rtype: bool
-        :raises SensorError: If something goes wrong with the sensor.
         """
-        # noinspection PyUnresolvedReferences
-        # pylint: disable=import-error
-        import Adafruit_DHT
+        if self.rule is not None:
+            return self._evaluate_rule(reading)
+        threshold = self.temperature
+        if self.alarm_on:
+            threshold += self.hysteresis_in_degrees
+        return reading.temperature_fahrenheit < threshold
 
-        model_to_enum = {'DHT11': Adafruit_DHT.DHT11,
-                         'DHT22': Adafruit_DHT.DHT22,
-                         'AM2302': Adafruit_DHT.AM2302}
+    def _evaluate_rule(self, reading):
+        """Checks a reading against the alarm rule.
 
-        sensor = model_to_enum[self.model]
-        pin = self.gpio
-        _, temperature_celcius = Adafruit_DHT.read_retry(sensor, pin)
+        :param TemperatureReading reading: The reading.
+        :return: True if the alarm is on.  False if the alarm is off.
+        :rtype: bool
+        :raises SensorError: If the rule could not be evaluated.
+            Ex: It uses humidity, and the sensor did not read the humidity.
+        """
+        try:
+            return self.rule.evaluate({'temp_f': reading.temperature_fahrenheit,
+                                       'temp_c': reading.temperature_celsius,
+                                       'humidity': reading.humidity})
+        except (ArithmeticError, TypeError) as error:
+            raise SensorError('Failed to evaluate rule "{}": {}'.format(self.rule, error))
 
-        if temperature_celcius is None:
-            raise SensorError('Failed to read {}!'.format(self.name))
+    def _value(self, reading):
+        """Returns the temperature in Fahrenheit, to keep in the history.
 
-        temperature_fahrenheit = int(temperature_celcius * 9/5.0 + 32)
-        self.logger.debug('TemperatureSensor %s is detecting %s degrees Fahrenheit',
+        :param TemperatureReading reading: The reading.
+        :return: Degrees Fahrenheit.
+        :rtype: float
+        """
+        return reading.temperature_fahrenheit
+
+    def _poll(self):
+        """Polls the sensor.
+
+        Reads the sensor once.  DHT sensors often fail to read, so a failed read
+        is retried later by the caller.  See :attr:`read_attempts`.
+        If the sensor was read in the last :attr:`cache_ttl_in_seconds`, that reading is used.
+
+        :return: True if the alarm is on.  False if the alarm is off.
+        :rtype: bool
+        :raises SensorRetry: If the sensor could not be read.
+        """
+        cached = self.READING_CACHE.get((self.model, self.gpio),
+                                        self.cache_ttl_in_seconds,
+                                        self._read)
+        self.reading = cached.value
+        self.reading_timestamp = cached.timestamp
+        self.logger.debug('TemperatureSensor %s is detecting %.1f degrees Fahrenheit',
                           self.name,
-                          temperature_fahrenheit)
+                          self.reading.temperature_fahrenheit)
 
-        return temperature_fahrenheit < self.temperature
+        return self._evaluate(self.reading)
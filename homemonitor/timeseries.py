@@ -0,0 +1,479 @@
+"""Stores every reading of each sensor on disk."""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from homemonitor.rollup import Rollup, RollupRow
+
+
+class TimeSeriesLog(object):
+    """Append-only file of timestamp, value pairs for one sensor.
+
+    Each pair is packed into 16 bytes, two little-endian doubles, after an 8 byte header.
+    New pairs are kept in memory and written in batches, so the Raspberry Pi's SD card
+    is not written to on every reading.  A batch is written and fsynced once it has
+    :attr:`batch_size` pairs, or :attr:`fsync_interval_in_seconds` after the last write,
+    whichever is first.
+
+    Reads go through mmap, so a query only touches the part of the file it needs.
+    Timestamps are in order in the file, so a query finds where it starts with a binary
+    search, and opening a log reads nothing but the newest pair.
+
+    Timestamps are expected to only go up.  A pair older than the newest one is dropped.
+
+    Example::
+
+        log = TimeSeriesLog('/home/pi/homemonitor/history/TemperatureSensor_Basement.tslog')
+        log.append(time.time(), 68.5)
+        for timestamp, value in log.query(since=time.time() - 3600):
+            print(timestamp, value)
+        log.close()
+
+    """
+    MAGIC = b'HMTSLOG1'
+    RECORD = struct.Struct('<dd')
+
+    DEFAULT_BATCH_SIZE = 32
+    DEFAULT_FSYNC_INTERVAL = 3600  # 1 hour, 4 readings at the default poll interval.
+
+    def __init__(self,
+                 path,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 fsync_interval_in_seconds=DEFAULT_FSYNC_INTERVAL,
+                 clock=time.monotonic,
+                 read_only=False):
+        """Constructor.  Creates the file if it does not exist.
+
+        If the last pair in the file was only partly written, for example the power
+        went out, it is removed.  Unless read_only is True, in which case it is skipped,
+        so the file can be read while the monitor is writing to it.
+
+        :param str path: File name.
+        :param int batch_size: Most pairs kept in memory before they are written.
+        :param float fsync_interval_in_seconds: Most seconds pairs are kept in memory.
+        :param clock: Function returning the current time in seconds.
+        :param bool read_only: If True, the file is only read.
+        :raises ValueError: If the file is not a time series log.
+        :raises OSError: If the file could not be opened.  Ex: read_only and it does not exist.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.fsync_interval_in_seconds = fsync_interval_in_seconds
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+        self.logger.addHandler(logging.NullHandler())
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._latest = None
+        self._last_sync = clock()
+
+        self._file = open(path, 'rb' if read_only else 'a+b')
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size == 0:
+            if not read_only:
+                self._file.write(self.MAGIC)
+                self._sync()
+            # A read only log may have just been created, before its header was written.
+            # Either way, it is empty.
+            size = len(self.MAGIC)
+        else:
+            self._file.seek(0)
+            if self._file.read(len(self.MAGIC)) != self.MAGIC:
+                self._file.close()
+                raise ValueError('{} is not a time series log.'.format(path))
+
+        self._count_on_disk = (size - len(self.MAGIC)) // self.RECORD.size
+        whole_size = self._offset(self._count_on_disk)
+        if whole_size != size and not read_only:
+            self.logger.warning('Removing a partly written reading from the end of %s.', path)
+            self._file.truncate(whole_size)
+            self._sync()
+        if self._count_on_disk:
+            self._latest = self._read_on_disk(self._count_on_disk - 1)
+
+    def __len__(self):
+        return self._count_on_disk + len(self._buffer)
+
+    def _offset(self, record_number):
+        """Returns where a record starts in the file."""
+        return len(self.MAGIC) + record_number * self.RECORD.size
+
+    def latest(self):
+        """Returns the newest pair.
+
+        :return: Timestamp and value, or None if empty.
+        :rtype: tuple[float, float]
+        """
+        return self._latest
+
+    def append(self, timestamp, *values):
+        """Adds a record.  Writes the batch if it is full or old enough.
+
+        :param float timestamp: When the value was read, in seconds since the epoch.
+        :param values: The value.  Logs with more fields per record take one per field.
+        :raises OSError: If the batch could not be written.  The records stay in memory
+            and are written with the next batch.
+        """
+        record = (timestamp,) + values
+        with self._lock:
+            if self._latest is not None and timestamp < self._latest[0]:
+                self.logger.warning('Dropping reading at %s for %s.  It is older than the '
+                                    'newest reading at %s.', timestamp, self.path, self._latest[0])
+                return
+            self._buffer.append(record)
+            self._latest = record
+
+            if (len(self._buffer) >= self.batch_size or
+                    self.clock() - self._last_sync >= self.fsync_interval_in_seconds):
+                self._write()
+
+    def pop(self):
+        """Removes and returns the newest record.
+
+        :return: The record, or None if empty.
+        :rtype: tuple
+        """
+        with self._lock:
+            if self._buffer:
+                record = self._buffer.pop()
+            elif self._count_on_disk:
+                self._count_on_disk -= 1
+                record = self._read_on_disk(self._count_on_disk)
+                self._file.truncate(self._offset(self._count_on_disk))
+                self._sync()
+            else:
+                return None
+
+            if self._buffer:
+                self._latest = self._buffer[-1]
+            elif self._count_on_disk:
+                self._latest = self._read_on_disk(self._count_on_disk - 1)
+            else:
+                self._latest = None
+            return record
+
+    def _read_on_disk(self, record_number):
+        """Reads one record from the file.  The lock must be held."""
+        self._file.seek(self._offset(record_number))
+        return self.RECORD.unpack(self._file.read(self.RECORD.size))
+
+    def flush(self):
+        """Writes and fsyncs every record still in memory.
+
+        :raises OSError: If the records could not be written.
+        """
+        with self._lock:
+            self._write()
+
+    def close(self):
+        """Writes every record still in memory and closes the file."""
+        with self._lock:
+            if self._file.closed:
+                return
+            try:
+                self._write()
+            finally:
+                self._file.close()
+
+    def _write(self):
+        """Writes and fsyncs the batch.  The lock must be held."""
+        if self._buffer:
+            data = b''.join(self.RECORD.pack(*record) for record in self._buffer)
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+            self._sync()
+            self._count_on_disk += len(self._buffer)
+            self._buffer = []
+        self._last_sync = self.clock()
+
+    def _sync(self):
+        """Makes sure what was written is on the disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _find(self, data, count, timestamp):
+        """Returns the number of the first record on disk at or after a timestamp.
+
+        :param mmap.mmap data: The file.
+        :param int count: Number of records in data.
+        :param float timestamp: Seconds since the epoch.
+        :return: Record number, or count if every record is older.
+        :rtype: int
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self.RECORD.unpack_from(data, self._offset(middle))[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, since=None, until=None):
+        """Returns the records in a time range, oldest first.
+
+        Records on disk are read through mmap, starting from the first record in the range,
+        found with a binary search, so only the pages in the range are read.  Records still
+        in memory are included.
+
+        :param float since: Start of the range, in seconds since the epoch.
+            If None, starts at the oldest record.
+        :param float until: End of the range, not included.  If None, ends at the newest record.
+        :return: Generator of timestamp, value pairs.
+        :rtype: collections.Iterable[tuple[float, float]]
+        """
+        with self._lock:
+            count_on_disk = self._count_on_disk
+            buffer = list(self._buffer)
+
+        if count_on_disk:
+            with open(self.path, 'rb') as file, \
+                    mmap.mmap(file.fileno(),
+                              self._offset(count_on_disk),
+                              access=mmap.ACCESS_READ) as data:
+                first = 0 if since is None else self._find(data, count_on_disk, since)
+                for record_number in range(first, count_on_disk):
+                    record = self.RECORD.unpack_from(data, self._offset(record_number))
+                    if until is not None and record[0] >= until:
+                        return
+                    if since is None or record[0] >= since:
+                        yield record
+
+        for record in buffer:
+            if until is not None and record[0] >= until:
+                return
+            if since is None or record[0] >= since:
+                yield record
+
+
+class RollupLog(TimeSeriesLog):
+    """Append-only file of :class:`homemonitor.rollup.RollupRow` rows for one sensor.
+
+    Works the same as :class:`TimeSeriesLog`, except each record is a row, packed into
+    48 bytes, and the timestamp is when the row's period starts.
+
+    Example::
+
+        log = RollupLog('/home/pi/homemonitor/history/TemperatureSensor_Basement.hour.tsroll')
+        rollup = Rollup(Rollup.RESOLUTIONS['hour'])
+        rollup.open_log(log)
+
+    """
+    MAGIC = b'HMROLUP1'
+    RECORD = struct.Struct('<dQdddd')
+
+    def latest(self):
+        """Returns the newest row.
+
+        :return: The row, or None if empty.
+        :rtype: homemonitor.rollup.RollupRow
+        """
+        latest = super().latest()
+        return None if latest is None else RollupRow._make(latest)
+
+    def pop(self):
+        """Removes and returns the newest row.
+
+        :return: The row, or None if empty.
+        :rtype: homemonitor.rollup.RollupRow
+        """
+        record = super().pop()
+        return None if record is None else RollupRow._make(record)
+
+    def query(self, since=None, until=None):
+        """Returns the rows of the periods starting in a time range, oldest first.
+
+        :param float since: Start of the range, in seconds since the epoch.
+            If None, starts at the oldest row.
+        :param float until: End of the range, not included.  If None, ends at the newest row.
+        :return: Generator of rows.
+        :rtype: collections.Iterable[homemonitor.rollup.RollupRow]
+        """
+        for record in super().query(since, until):
+            yield RollupRow._make(record)
+
+
+class TimeSeriesStore(object):
+    """Directory with a :class:`TimeSeriesLog` for each sensor.
+
+    Example::
+
+        store = TimeSeriesStore('/home/pi/homemonitor/history')
+        store.attach(sensors)
+        ...
+        store.close()
+
+    """
+    # Config file defines.
+    SECTION = 'history'
+    DIRECTORY = 'directory'
+    BATCH_SIZE = 'batch_size'
+    FSYNC_INTERVAL = 'fsync_interval_in_seconds'
+
+    EXTENSION = '.tslog'
+    ROLLUP_EXTENSION = '.tsroll'
+
+    # Resolution of the readings themselves, instead of a rollup.
+    RAW = 'raw'
+
+    def __init__(self,
+                 directory,
+                 batch_size=TimeSeriesLog.DEFAULT_BATCH_SIZE,
+                 fsync_interval_in_seconds=TimeSeriesLog.DEFAULT_FSYNC_INTERVAL):
+        """Constructor.  Creates the directory if it does not exist.
+
+        :param str directory: Where the logs are kept.
+        :param int batch_size: See :class:`TimeSeriesLog`.
+        :param float fsync_interval_in_seconds: See :class:`TimeSeriesLog`.
+        """
+        self.directory = directory
+        self.batch_size = batch_size
+        self.fsync_interval_in_seconds = fsync_interval_in_seconds
+        self._logs = {}
+        self._rollups = []
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Constructor.  Creates a TimeSeriesStore object from a config file.
+
+        :param configparser.ConfigParser cfg: The configuration file, in memory.
+        :return: TimeSeriesStore object, or None if there is no history section.
+        :rtype: homemonitor.timeseries.TimeSeriesStore
+        :raises configparser.Error: If any options are missing or other options files issues.
+
+        Example::
+
+            [history]
+            directory=/home/pi/homemonitor/history
+            batch_size=32
+            fsync_interval_in_seconds=3600
+
+        """
+        if not cfg.has_section(cls.SECTION):
+            return None
+        directory = os.path.expandvars(cfg.get(cls.SECTION, cls.DIRECTORY))
+        batch_size = cfg.getint(cls.SECTION,
+                                cls.BATCH_SIZE,
+                                fallback=TimeSeriesLog.DEFAULT_BATCH_SIZE)
+        fsync_interval = cfg.getfloat(cls.SECTION,
+                                      cls.FSYNC_INTERVAL,
+                                      fallback=TimeSeriesLog.DEFAULT_FSYNC_INTERVAL)
+        return cls(directory, batch_size, fsync_interval)
+
+    def path(self, sensor_name):
+        """Returns the file name of a sensor's log.
+
+        :param str sensor_name: Name of the sensor.  Ex: TemperatureSensor/Basement
+        :return: Ex: /home/pi/homemonitor/history/TemperatureSensor_Basement.tslog
+        :rtype: str
+        """
+        return os.path.join(self.directory, sensor_name.replace('/', '_') + self.EXTENSION)
+
+    def rollup_path(self, sensor_name, resolution):
+        """Returns the file name of a sensor's rollups.
+
+        :param str sensor_name: Name of the sensor.  Ex: TemperatureSensor/Basement
+        :param str resolution: Key of :attr:`homemonitor.rollup.Rollup.RESOLUTIONS`.  Ex: hour
+        :return: Ex: /home/pi/homemonitor/history/TemperatureSensor_Basement.hour.tsroll
+        :rtype: str
+        """
+        return os.path.join(self.directory, '{}.{}{}'.format(sensor_name.replace('/', '_'),
+                                                             resolution,
+                                                             self.ROLLUP_EXTENSION))
+
+    def log(self, sensor_name):
+        """Returns a sensor's log, opening it the first time.
+
+        :param str sensor_name: Name of the sensor.
+        :return: The log.
+        :rtype: TimeSeriesLog
+        """
+        if sensor_name not in self._logs:
+            self._logs[sensor_name] = TimeSeriesLog(self.path(sensor_name),
+                                                    self.batch_size,
+                                                    self.fsync_interval_in_seconds)
+        return self._logs[sensor_name]
+
+    def open_for_reading(self, sensor_name, resolution=RAW):
+        """Opens a sensor's readings or rollups, read only.
+
+        The files are only read, so they can be read while the monitor is running.
+
+        :param str sensor_name: Name of the sensor.  Ex: TemperatureSensor/Basement
+        :param str resolution: :attr:`RAW` for the readings, or a key of
+            :attr:`homemonitor.rollup.Rollup.RESOLUTIONS` for the rollups.
+        :return: The log.  The caller closes it.
+        :rtype: TimeSeriesLog
+        :raises ValueError: If the resolution is invalid or there is no history for the sensor.
+        """
+        if resolution == self.RAW:
+            log_class, path = TimeSeriesLog, self.path(sensor_name)
+        elif resolution in Rollup.RESOLUTIONS:
+            log_class, path = RollupLog, self.rollup_path(sensor_name, resolution)
+        else:
+            raise ValueError('Resolution {} is not valid!  Valid resolutions are: {}'.format(
+                resolution, (self.RAW,) + tuple(Rollup.RESOLUTIONS)))
+        if not os.path.isfile(path):
+            raise ValueError('There is no history for {} in {}.'.format(sensor_name,
+                                                                        self.directory))
+        return log_class(path, read_only=True)
+
+    def query(self, sensor_name, resolution=RAW, since=None, until=None):
+        """Returns a sensor's stored readings or rollups in a time range, oldest first.
+
+        The rollup in progress is only included once the monitor has stopped.
+
+        :param str sensor_name: Name of the sensor.  Ex: TemperatureSensor/Basement
+        :param str resolution: :attr:`RAW` for the readings, or a key of
+            :attr:`homemonitor.rollup.Rollup.RESOLUTIONS` for the rollups.
+        :param float since: Start of the range, in seconds since the epoch.
+            If None, starts at the oldest.
+        :param float until: End of the range, not included.  If None, ends at the newest.
+        :return: Generator of timestamp, value pairs for :attr:`RAW`.
+            Otherwise, generator of :class:`homemonitor.rollup.RollupRow`.
+        :rtype: collections.Iterable
+        :raises ValueError: If the resolution is invalid or there is no history for the sensor.
+        """
+        return self._read(self.open_for_reading(sensor_name, resolution), since, until)
+
+    @staticmethod
+    def _read(log, since, until):
+        """Returns a generator of the log's records in a time range, which closes the log."""
+        try:
+            yield from log.query(since, until)
+        finally:
+            log.close()
+
+    def attach(self, sensors):
+        """Records every reading and rollup of the sensors in their logs.
+
+        :param list[homemonitor.sensor.Sensor] sensors: Sensors to record.
+        """
+        for sensor in sensors:
+            sensor.recorders.append(self.log(sensor.name))
+            for resolution, rollup in sensor.rollups.items():
+                rollup.open_log(RollupLog(self.rollup_path(sensor.name, resolution),
+                                          self.batch_size,
+                                          self.fsync_interval_in_seconds))
+                self._rollups.append(rollup)
+
+    def flush(self):
+        """Writes every reading and finished rollup still in memory."""
+        for log in self._logs.values():
+            log.flush()
+        for rollup in self._rollups:
+            rollup.log.flush()
+
+    def close(self):
+        """Writes every reading and rollup still in memory and closes the logs."""
+        for log in self._logs.values():
+            log.close()
+        for rollup in self._rollups:
+            rollup.close()
+        self._rollups = []
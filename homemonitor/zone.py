@@ -0,0 +1,192 @@
+"""Zones are groups of sensors with one alarm."""
+import logging
+
+
+class Zone(object):
+    """A group of sensors, with one alarm for the whole group.
+
+    Modes:
+        * any: The alarm is on if any sensor's alarm is on.
+        * all: The alarm is on if every sensor's alarm is on.
+        * quorum: The alarm is on if at least :attr:`quorum` sensors' alarms are on.
+        * mean_below: The alarm is on if the mean of the sensors' latest values is below
+          :attr:`temperature`.  Sensors with a hardware error are left out.
+
+    The zone keeps a count of the sensors in alarm and a sum of their values.
+    Each sensor status updates them in O(1), instead of looking at every sensor again.
+
+    Example::
+
+        zone = Zone('Zone/Downstairs', ['TemperatureSensor/Basement',
+                                        'TemperatureSensor/Kitchen'])
+        zone.update(basement.status())
+        if zone.alarm_on:
+            print('{} is on.'.format(zone.name))
+
+    """
+    # Config file defines.
+    ZONE_BASE = 'Zone'
+    SENSORS = 'sensors'
+    MODE = 'mode'
+    QUORUM = 'quorum'
+    TEMPERATURE = 'temperature'
+
+    MODES = ('any', 'all', 'quorum', 'mean_below')
+
+    def __init__(self, name, members, mode='any', quorum=None, temperature=None):
+        """Constructor.
+
+        :param str name: Name of the zone.  This will be emailed out.
+        :param list[str] members: Names of the sensors in the zone.
+        :param str mode: any, all, quorum, or mean_below.
+        :param int quorum: For quorum, number of sensors in alarm that set off the zone's alarm.
+        :param float temperature: For mean_below, the zone's alarm is on below this.
+        :raises ValueError: If a sensor is listed twice, or the mode is invalid or is missing
+            quorum or temperature.
+        """
+        seen = set()
+        for member in members:
+            if member in seen:
+                raise ValueError('For {}, sensor {} is listed twice!'.format(name, member))
+            seen.add(member)
+        if mode not in self.MODES:
+            raise ValueError('For {}, mode {} is not a valid mode!  Valid modes are: {}'.format(
+                name, mode, self.MODES))
+        if mode == 'quorum' and quorum is None:
+            raise ValueError('For {}, mode quorum needs a quorum!'.format(name))
+        if mode == 'mean_below' and temperature is None:
+            raise ValueError('For {}, mode mean_below needs a temperature!'.format(name))
+
+        self.name = name
+        self.members = list(members)
+        self.mode = mode
+        self.quorum = quorum
+        self.temperature = temperature
+
+        self._alarms = dict.fromkeys(self.members, False)
+        self._alarm_count = 0
+        self._values = dict.fromkeys(self.members)
+        self._value_total = 0.0
+        self._value_count = 0
+        self.alarm_on = False
+
+        self.logger = logging.getLogger(__name__)
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.info('Created %s', str(self))
+
+    def __str__(self):
+        """Returns string representation of the class.
+
+        :return: String representation of the class.
+        :rtype: str
+        """
+        return 'Zone {} with mode {} and sensors {}.'.format(self.name,
+                                                             self.mode,
+                                                             ', '.join(self.members))
+
+    @property
+    def members_in_alarm(self):
+        """Returns the names of the sensors whose alarm is on."""
+        return [member for member in self.members if self._alarms[member]]
+
+    @property
+    def mean(self):
+        """Returns the mean of the sensors' latest values, or None if there are none."""
+        if self._value_count == 0:
+            return None
+        return self._value_total / self._value_count
+
+    def update(self, status):
+        """Updates the zone with a sensor's new status.
+
+        :param homemonitor.sensor.SensorStatus status: New status of a sensor in the zone.
+        :return: True if the zone's alarm changed.
+        :rtype: bool
+        """
+        name = status.name
+        if self._alarms[name] != status.alarm_on:
+            self._alarms[name] = status.alarm_on
+            self._alarm_count += 1 if status.alarm_on else -1
+
+        value = None if status.hw_error_on else status.value
+        old_value = self._values[name]
+        if old_value is not None:
+            self._value_total -= old_value
+            self._value_count -= 1
+        if value is not None:
+            self._value_total += value
+            self._value_count += 1
+        self._values[name] = value
+
+        alarm_on = self._evaluate()
+        if alarm_on == self.alarm_on:
+            return False
+        self.alarm_on = alarm_on
+        self.logger.info('%s is %s.', self.name, 'on' if alarm_on else 'off')
+        return True
+
+    def _evaluate(self):
+        """Returns True if the zone's alarm is on."""
+        if self.mode == 'any':
+            return self._alarm_count > 0
+        if self.mode == 'all':
+            return self._alarm_count == len(self.members)
+        if self.mode == 'quorum':
+            return self._alarm_count >= self.quorum
+        mean = self.mean
+        return mean is not None and mean < self.temperature
+
+    @classmethod
+    def from_config(cls, cfg, sensors):
+        """Constructor.  Reads the zones from a configuration file.
+
+        Sensors are given by the name after the underscore in their section, or by their
+        full name.
+
+        :param configparser.ConfigParser cfg: The configuration file, in memory.
+        :param list[homemonitor.sensor.Sensor] sensors: Every sensor.
+        :return: List of Zone objects.
+        :rtype: list[homemonitor.zone.Zone]
+        :raises configparser.Error: If any options are missing or other options files issues.
+        :raises ValueError: If a sensor does not exist or is listed twice, or the mode is
+            invalid.
+
+        Example::
+
+            [Zone_Downstairs]
+            sensors=Basement,Kitchen
+            mode=any
+
+            [Zone_House]
+            sensors=Basement,Kitchen,Attic
+            mode=quorum
+            quorum=2
+
+            [Zone_Upstairs]
+            sensors=Attic,Bedroom
+            mode=mean_below
+            temperature=55
+
+        """
+        sensor_names = {}
+        for sensor in sensors:
+            sensor_names[sensor.name] = sensor.name
+            sensor_names[sensor.name.split('/')[-1]] = sensor.name
+
+        zones = []
+        for section in cfg.sections():
+            if not section.startswith(cls.ZONE_BASE + '_'):
+                continue
+            name = '{}/{}'.format(cls.ZONE_BASE, section.split('_', 1)[1])
+            members = []
+            for member in cfg.get(section, cls.SENSORS).split(','):
+                member = member.strip()
+                if member not in sensor_names:
+                    raise ValueError('For {}, sensor {} does not exist!'.format(name, member))
+                members.append(sensor_names[member])
+            zones.append(cls(name,
+                             members,
+                             cfg.get(section, cls.MODE, fallback='any').lower(),
+                             cfg.getint(section, cls.QUORUM, fallback=None),
+                             cfg.getfloat(section, cls.TEMPERATURE, fallback=None)))
+        return zones
@@ -0,0 +1,143 @@
+"""Tests the asyncio event loop."""
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+from configparser import ConfigParser
+
+from homemonitor.asynceventloop import AsyncEventLoop
+from homemonitor.mailqueue import MailQueue, Message
+
+from tests.sensor_test import MockSensor
+from tests.eventloop_test import SlowMockSensor
+
+
+class AsyncEventLoopTestCase(unittest.TestCase):
+    """Tests the asyncio event loop."""
+    def test_alarm_mail(self):
+        """Tests alarm email is sent."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        sensor1 = MockSensor(poll_results=[True, False])
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop(mailqueue,
+                                   [sensor1],
+                                   poll_interval_in_seconds=.001,
+                                   loop_forever=False)
+
+        eventloop.run()
+        self.assertEqual(Message('MockSensor is on.', 'MockSensor is on.'),
+                         mailqueue.add.call_args_list[0][0][0])
+        self.assertEqual(1, mailqueue.send.call_count)
+
+        eventloop.run()
+        self.assertEqual(Message('MockSensor is off.', 'MockSensor is off.'),
+                         mailqueue.add.call_args_list[1][0][0])
+        self.assertEqual(2, mailqueue.send.call_count)
+
+    def test_no_sensors(self):
+        """Without sensors, the loop sleeps the poll interval instead of spinning."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop(mailqueue, [], poll_interval_in_seconds=.05,
+                                   loop_forever=False)
+        start = time.monotonic()
+        eventloop.run()
+        self.assertGreaterEqual(time.monotonic() - start, .05)
+        self.assertEqual(1, mailqueue.send.call_count)
+
+    def test_email_order(self):
+        """Emails go out in the order of the sensors, not the order the polls finish."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        slow_sensor = SlowMockSensor(delay=.2, poll_results=[True], name='Slow')
+        fast_sensor = MockSensor(poll_results=[True], name='Fast')
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop(mailqueue,
+                                   [slow_sensor, fast_sensor],
+                                   poll_interval_in_seconds=.001,
+                                   loop_forever=False)
+        eventloop.run()
+        self.assertEqual([Message('Slow is on.', 'Slow is on.'),
+                          Message('Fast is on.', 'Fast is on.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+    def test_slow_mail_does_not_block_sensors(self):
+        """The sensors keep being polled while email is being sent."""
+        polled_twice = threading.Event()
+        mail_waits = []
+
+        def slow_send():
+            """Does not finish sending until the sensor is polled again."""
+            mail_waits.append(polled_twice.wait(timeout=2))
+
+        mailqueue = Mock(MailQueue, autospec=True)
+        mailqueue.send.side_effect = slow_send
+        sensor1 = MockSensor(poll_results=[True, True, True])
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop(mailqueue,
+                                   [sensor1],
+                                   poll_interval_in_seconds=.01,
+                                   loop_forever=True)
+
+        original_status = sensor1.status
+
+        def status():
+            """Stops the loop after the third poll."""
+            original_status()
+            if sensor1.poll_results_index == 2:
+                polled_twice.set()
+            if sensor1.poll_results_index == 3:
+                eventloop.loop_forever = False
+
+        sensor1.status = status
+        eventloop.run()
+        self.assertTrue(mail_waits[0], 'Sending email blocked polling the sensors.')
+
+    def test_mail_queued_while_sending(self):
+        """Email queued while a delivery is running is sent as soon as it finishes."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_send():
+            """Does not finish the first send until released."""
+            started.set()
+            release.wait(timeout=2)
+
+        mailqueue = Mock(MailQueue, autospec=True)
+        mailqueue.send.side_effect = slow_send
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop(mailqueue, [MockSensor(poll_results=[])],
+                                   poll_interval_in_seconds=3600)
+
+        async def deliver_twice():
+            """Asks for a delivery while the first one is still sending."""
+            eventloop._start_delivery()
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 2)
+            eventloop._start_delivery()
+            self.assertEqual(1, mailqueue.send.call_count)
+            release.set()
+            await eventloop._delivery
+
+        asyncio.run(deliver_twice())
+        self.assertEqual(2, mailqueue.send.call_count)
+
+
+class AsyncEventLoopFromConfigTest(unittest.TestCase):
+    """Tests creating an AsyncEventLoop from a config file."""
+    SUCCESS_CONFIG = '''
+    [eventloop]
+    poll_interval_in_seconds=10
+    '''
+
+    def test_success(self):
+        """Create AsyncEventLoop object from configuration file."""
+        cfg = ConfigParser()
+        cfg.read_string(self.SUCCESS_CONFIG)
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop.from_config(cfg, Mock(), [Mock()])
+        self.assertIsInstance(eventloop, AsyncEventLoop)
+        self.assertEqual(10, eventloop.poll_interval_in_seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+"""Tests the command line interface."""
+import contextlib
+import datetime
+import io
+import os
+import signal
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+try:
+    # noinspection PyUnresolvedReferences
+    import numpy
+except ImportError:
+    numpy = None
+
+from loggingtestcase import capturelogs
+
+from homemonitor import cli
+from homemonitor.mailqueue import MailQueue, Message
+from homemonitor.rollup import RollupRow
+from homemonitor.timeseries import RollupLog, TimeSeriesStore
+
+
+class ParseTimeTestCase(unittest.TestCase):
+    """Tests parsing the --since and --until times."""
+    def test_parse_time(self):
+        """Seconds since the epoch, or ISO 8601 local time."""
+        self.assertIsNone(cli._parse_time(None))
+        self.assertEqual(1526000000.5, cli._parse_time('1526000000.5'))
+        self.assertEqual(datetime.datetime(2018, 5, 15, 21, 0).timestamp(),
+                         cli._parse_time('2018-05-15T21:00'))
+
+    def test_invalid(self):
+        """Text that is not a time is rejected."""
+        with self.assertRaises(ValueError):
+            cli._parse_time('yesterday')
+
+
+class PrintHistoryTestCase(unittest.TestCase):
+    """Tests printing --history."""
+    SENSOR = 'TemperatureSensor/Basement'
+
+    def setUp(self):
+        """Stores readings and hourly rollups for a sensor."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = TimeSeriesStore(self.directory.name)
+        log = self.store.log(self.SENSOR)
+        for timestamp, value in [(0, 50.0), (900, 49.5), (3600, 48.0)]:
+            log.append(timestamp, value)
+        self.store.close()
+        self.first_hour = RollupRow.first(0, 50.0).add(49.5)
+        rollups = RollupLog(self.store.rollup_path(self.SENSOR, 'hour'))
+        rollups.append(*self.first_hour)
+        rollups.append(*RollupRow.first(3600, 48.0))
+        rollups.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _print_history(self, resolution='raw', since=None, until=None, output_format='csv'):
+        file = io.StringIO()
+        cli._print_history(self.store, self.SENSOR, resolution, since, until, output_format,
+                           file)
+        return file.getvalue().splitlines()
+
+    def test_raw_csv(self):
+        """Readings in the time range, as CSV."""
+        self.assertEqual(['time,value',
+                          '{},50.0'.format(cli._format_time(0)),
+                          '{},49.5'.format(cli._format_time(900))],
+                         self._print_history(until=3600))
+
+    def test_raw_json(self):
+        """Readings in the time range, one JSON object per line."""
+        self.assertEqual(['{{"time": "{}", "value": 48.0}}'.format(cli._format_time(3600))],
+                         self._print_history(since=1000, output_format='json'))
+
+    def test_rollup_csv(self):
+        """Rollups, as CSV."""
+        self.assertEqual(['time,count,minimum,maximum,mean,standard_deviation',
+                          '{},2,49.5,50.0,{},{}'.format(cli._format_time(0),
+                                                        self.first_hour.mean,
+                                                        self.first_hour.standard_deviation),
+                          '{},1,48.0,48.0,48.0,0.0'.format(cli._format_time(3600))],
+                         self._print_history('hour'))
+
+    def test_rollup_json(self):
+        """Rollups, one JSON object per line."""
+        self.assertEqual(['{{"time": "{}", "count": 1, "minimum": 48.0, "maximum": 48.0, '
+                          '"mean": 48.0, "standard_deviation": 0.0}}'.format(
+                              cli._format_time(3600))],
+                         self._print_history('hour', since=3600, output_format='json'))
+
+    def test_invalid(self):
+        """Bad resolutions, formats and sensors are errors, and nothing is printed."""
+        with self.assertRaisesRegex(ValueError, 'Resolution week is not valid!'):
+            self._print_history('week')
+        with self.assertRaisesRegex(ValueError, 'Format xml is not valid!'):
+            self._print_history(output_format='xml')
+        with self.assertRaisesRegex(ValueError, 'There is no history for TemperatureSensor/Attic'):
+            cli._print_history(self.store, 'TemperatureSensor/Attic', 'raw', None, None, 'csv',
+                               io.StringIO())
+        file = io.StringIO()
+        with self.assertRaises(ValueError):
+            cli._print_history(self.store, self.SENSOR, 'raw', None, None, 'xml', file)
+        self.assertEqual('', file.getvalue())
+
+    def _main(self, *args, history=True):
+        """Runs the command line with a config file for the store."""
+        config_file = os.path.join(self.directory.name, 'homemonitor.ini')
+        with open(config_file, 'w') as file:
+            if history:
+                file.write('[history]\ndirectory={}\n'.format(self.directory.name))
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            result = cli.main(['--config={}'.format(config_file)] + list(args))
+        return result, stdout.getvalue(), stderr.getvalue()
+
+    def test_main(self):
+        """The options are passed on, and the history is printed."""
+        result, stdout, stderr = self._main('--history={}'.format(self.SENSOR),
+                                            '--since=1000', '--resolution=hour',
+                                            '--format=json')
+        self.assertEqual(0, result)
+        self.assertEqual('', stderr)
+        self.assertEqual(1, len(stdout.splitlines()))
+        self.assertRegex(stdout, '"count": 1')
+
+    def test_main_errors(self):
+        """Errors are printed and return 1."""
+        for args, error in [(['--resolution=week'], 'Resolution week is not valid!'),
+                            (['--format=xml'], 'Format xml is not valid!'),
+                            (['--since=yesterday'], 'Invalid isoformat string'),
+                            ([], None)]:
+            history = error is not None
+            result, stdout, stderr = self._main('--history={}'.format(self.SENSOR), *args,
+                                                history=history)
+            self.assertEqual(1, result)
+            self.assertEqual('', stdout)
+            self.assertRegex(stderr, error or 'There is no \\[history\\] section')
+
+
+class ParseThresholdsTestCase(unittest.TestCase):
+    """Tests parsing the --replay thresholds."""
+    def test_numbers(self):
+        """Comma separated numbers."""
+        self.assertEqual([40.0, 45.5, 50.0], cli._parse_thresholds('40,45.5,50'))
+
+    def test_range(self):
+        """Ranges include stop, and default to a step of 1."""
+        self.assertEqual([40.0, 41.0, 42.0], cli._parse_thresholds('40:42'))
+        self.assertEqual([40.0, 40.5, 41.0, 45.0], cli._parse_thresholds('40:41:0.5,45'))
+        self.assertEqual([50.0], cli._parse_thresholds('50:50'))
+
+    def test_range_rounding(self):
+        """A range never goes past stop, and includes it despite rounding."""
+        thresholds = cli._parse_thresholds('40:60:0.3')
+        self.assertEqual(67, len(thresholds))
+        self.assertAlmostEqual(59.8, thresholds[-1])
+        thresholds = cli._parse_thresholds('40:60:0.1')
+        self.assertEqual(201, len(thresholds))
+        self.assertEqual(60.0, thresholds[-1])
+        self.assertEqual(40.3, thresholds[3])
+
+    def test_invalid(self):
+        """Reversed ranges, bad steps, and text that is not a number are rejected."""
+        for text in ['60:40', '40:60:0', '40:60:-1', '40:50:60:1', '40,', 'forty']:
+            with self.assertRaises(ValueError, msg=text):
+                cli._parse_thresholds(text)
+        with self.assertRaisesRegex(ValueError, 'Threshold range 60:40 is not valid!'):
+            cli._parse_thresholds('60:40')
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed.')
+class PrintReplayTestCase(unittest.TestCase):
+    """Tests printing --replay results."""
+    def setUp(self):
+        """Stores readings for a sensor."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = TimeSeriesStore(self.directory.name)
+        log = self.store.log('TemperatureSensor/Basement')
+        for second, value in enumerate([52.0, 50.0, 49.5, 50.5, 49.0, 48.0, 51.0, 50.0]):
+            log.append(second * 900, value)
+        self.store.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _print_replay(self, output_format):
+        file = io.StringIO()
+        cli._print_replay(self.store, ['TemperatureSensor/Basement'], [50.0, 60.0], None, None,
+                          output_format, file)
+        return file.getvalue().splitlines()
+
+    def test_csv(self):
+        """One header, then one row per sensor and threshold."""
+        self.assertEqual(['sensor_name,threshold,readings,alarms,emails,percent_in_alarm',
+                          'TemperatureSensor/Basement,50.0,8,2,4,37.5',
+                          'TemperatureSensor/Basement,60.0,8,1,1,100.0'],
+                         self._print_replay('csv'))
+
+    def test_json(self):
+        """One JSON object per sensor and threshold."""
+        self.assertEqual(['{"sensor_name": "TemperatureSensor/Basement", "threshold": 50.0, '
+                          '"readings": 8, "alarms": 2, "emails": 4, "percent_in_alarm": 37.5}',
+                          '{"sensor_name": "TemperatureSensor/Basement", "threshold": 60.0, '
+                          '"readings": 8, "alarms": 1, "emails": 1, "percent_in_alarm": 100.0}'],
+                         self._print_replay('json'))
+
+    def test_invalid(self):
+        """Bad formats and sensors without history are errors."""
+        with self.assertRaisesRegex(ValueError, 'Format xml is not valid!'):
+            self._print_replay('xml')
+        with self.assertRaisesRegex(ValueError, 'There is no history'):
+            cli._print_replay(self.store, ['TemperatureSensor/Attic'], [50.0], None, None, 'csv',
+                              io.StringIO())
+
+
+class StopMailQueueTestCase(unittest.TestCase):
+    """Tests stopping the mail queue on exit."""
+    @capturelogs('homemonitor.cli')
+    def test_stop(self, logs):
+        """The wait is bounded, and unsent emails are logged."""
+        mailqueue = Mock(MailQueue)
+        mailqueue.stop.return_value = False
+        mailqueue.queue = [Message('One', 'BodyOne'), Message('Two', 'BodyTwo')]
+        cli._stop_mailqueue(mailqueue)
+        mailqueue.stop.assert_called_once_with(cli.MAIL_STOP_TIMEOUT_IN_SECONDS)
+        self.assertEqual(['WARNING:homemonitor.cli:Exiting with 2 unsent email(s).'],
+                         logs.output)
+
+    @capturelogs('homemonitor.cli')
+    def test_stop_empty(self, logs):
+        """Nothing is logged when every email was sent."""
+        mailqueue = Mock(MailQueue)
+        mailqueue.stop.return_value = True
+        cli._stop_mailqueue(mailqueue)
+        self.assertEqual([], logs.output)
+
+
+class ExitOnSigtermTestCase(unittest.TestCase):
+    """Tests exiting cleanly on SIGTERM."""
+    def test_sigterm(self):
+        """SIGTERM raises SystemExit, so the finally blocks run."""
+        previous = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+        cli._exit_on_sigterm()
+        with self.assertRaises(SystemExit) as context:
+            os.kill(os.getpid(), signal.SIGTERM)
+        self.assertEqual(128 + signal.SIGTERM, context.exception.code)
+        self.assertEqual(signal.SIG_IGN, signal.getsignal(signal.SIGTERM))
+
+
+class MainConfigErrorTestCase(unittest.TestCase):
+    """Tests errors in the config file when starting the event loop."""
+    CONFIG = """
+[mail]
+user=sender@gmail.com
+password=secret
+receivers=receiver@gmail.com
+
+[mailqueue]
+
+[internet]
+
+[eventloop]
+
+[Zone_Garage]
+sensors=Garage
+"""
+
+    def test_invalid_value(self):
+        """An invalid value is printed and returns 1, instead of a traceback."""
+        with tempfile.TemporaryDirectory() as directory:
+            config_file = os.path.join(directory, 'homemonitor.ini')
+            with open(config_file, 'w') as file:
+                file.write(self.CONFIG)
+            stderr = io.StringIO()
+            with patch('logging.config.fileConfig'), contextlib.redirect_stderr(stderr):
+                self.assertEqual(1, cli.main(['--config={}'.format(config_file)]))
+        self.assertRegex(stderr.getvalue(), 'For Zone/Garage, sensor Garage does not exist!')
+
+
+if __name__ == '__main__':
+    unittest.main()
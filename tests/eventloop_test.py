@@ -1,14 +1,17 @@
 """Tests the main event loop."""
+import threading
+import time
 import unittest
 from unittest.mock import Mock
 from configparser import ConfigParser
 
 from loggingtestcase import capturelogs
 
-from homemonitor.eventloop import EventLoop
+from homemonitor.eventloop import EventLoop, LoopMetrics
 from homemonitor.mailqueue import MailQueue, Message
 
-from tests.sensor_test import MockSensor
+from homemonitor.zone import Zone
+from tests.sensor_test import MockSensor, RetryMockSensor
 
 
 class EventLoopTestCase(unittest.TestCase):
@@ -61,6 +64,126 @@ class EventLoopTestCase(unittest.TestCase):
                          mailqueue.add.call_args_list[1][0][0])
         self.assertEqual(2, mailqueue.send.call_count)
 
+    def test_sensor_poll_interval(self):
+        """Each sensor is polled at its own interval."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        fast_sensor = MockSensor(poll_results=[False] * 3, name='Fast')
+        fast_sensor.poll_interval_in_seconds = .001
+        slow_sensor = MockSensor(poll_results=[False], name='Slow')
+        slow_sensor.poll_interval_in_seconds = 3600
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [slow_sensor, fast_sensor],
+                              poll_interval_in_seconds=900,
+                              loop_forever=False)
+        for _ in range(3):
+            eventloop.run()
+        self.assertEqual(3, fast_sensor.poll_results_index)
+        self.assertEqual(0, slow_sensor.poll_results_index)
+
+    @capturelogs('homemonitor.eventloop', 'WARNING')
+    def test_overrun(self, logs):
+        """A poll that takes longer than the poll interval is recorded as an overrun."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        sensor1 = SlowMockSensor(delay=.05, poll_results=[False])
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=.01,
+                              loop_forever=False)
+        eventloop.run()
+        self.assertEqual(1, eventloop.metrics.ticks)
+        self.assertEqual(1, eventloop.metrics.overruns)
+        self.assertGreaterEqual(eventloop.metrics.skipped_ticks, 1)
+        self.assertRegex(logs.output[0], 'Loop overran the poll interval of MockSensor.')
+
+    @capturelogs('homemonitor.eventloop', 'INFO')
+    def test_overrun_logs_metrics(self, logs):
+        """The loop metrics are logged after an overrun."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        sensor1 = SlowMockSensor(delay=.05, poll_results=[False])
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=.01,
+                              loop_forever=False)
+        eventloop.run()
+        self.assertRegex(logs.output[-1],
+                         '^INFO:homemonitor.eventloop:Loop metrics: ticks=1 overruns=1 ')
+
+    @capturelogs('homemonitor.eventloop', 'INFO')
+    def test_metrics_log(self, logs):
+        """The loop metrics are logged every metrics_log_ticks ticks."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        sensor1 = MockSensor(poll_results=[False] * 5)
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=.05,
+                              loop_forever=False,
+                              metrics_log_ticks=2)
+        for _ in range(5):
+            eventloop.run()
+        metrics_logs = [line for line in logs.output if 'Loop metrics' in line]
+        self.assertEqual(2, len(metrics_logs))
+        self.assertRegex(metrics_logs[0], 'Loop metrics: ticks=2 ')
+        self.assertRegex(metrics_logs[1], 'Loop metrics: ticks=4 ')
+
+    def test_no_sensors(self):
+        """Without sensors, the loop sleeps the poll interval instead of spinning."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue, [], poll_interval_in_seconds=.05, loop_forever=False)
+        start = time.monotonic()
+        eventloop.run()
+        self.assertGreaterEqual(time.monotonic() - start, .05)
+        self.assertEqual(1, mailqueue.send.call_count)
+
+    @capturelogs('homemonitor.eventloop', 'INFO')
+    def test_backoff(self, logs):
+        """A sensor in hardware error is polled less often, and the time saved is logged."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        sensor1 = MockSensor(poll_results=[False] * 3, error_results=[True] * 3)
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=.01,
+                              loop_forever=False,
+                              metrics_log_ticks=3)
+        for _ in range(3):
+            eventloop.run()
+        self.assertEqual(2, eventloop.metrics.backoffs)
+        self.assertGreater(eventloop.metrics.reclaimed_seconds, 0)
+        self.assertRegex(logs.output[-1], r'Loop metrics: .* backoffs=2 reclaimed=\d+\.\ds$')
+        self.assertEqual(.04, sensor1.next_poll_interval(.01))
+
+    def test_retry(self):
+        """A failed read is retried soon, without moving the sensor's schedule."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        sensor1 = RetryMockSensor(retries=1, poll_results=[True])
+        sensor1.read_attempts = 2
+        sensor1.retry_delay_in_seconds = .002
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=3600,
+                              loop_forever=False)
+        eventloop._scheduler = eventloop._create_scheduler()
+        first_due = eventloop._scheduler.next_due()
+        eventloop._scheduler.pop_due()
+        eventloop._scheduler.add(0, eventloop._scheduler.clock())
+
+        # The read fails and is retried in a few milliseconds, not an hour.
+        eventloop.run()
+        self.assertEqual(0, mailqueue.add.call_count)
+        self.assertLess(eventloop._scheduler.next_due() - eventloop._scheduler.clock(), 1)
+
+        # The retry works.  The next poll is an hour after the first one was due.
+        eventloop.run()
+        self.assertEqual(Message('MockSensor is on.', 'MockSensor is on.'),
+                         mailqueue.add.call_args_list[0][0][0])
+        self.assertLess(abs(eventloop._scheduler.next_due() - first_due), 1)
+
     @capturelogs('homemonitor.eventloop', 'INFO')
     def test_main_loop_info_message(self, logs):
         """Tests entering the main event loop logs an INFO message."""
@@ -77,12 +200,184 @@ class EventLoopTestCase(unittest.TestCase):
         self.assertEqual('INFO:homemonitor.eventloop:Entering the main event loop...',
                          logs.output[0])
 
+    def test_zone_mail(self):
+        """Sensors in a zone send one email for the zone, but their own hardware emails."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        mailqueue.add = Mock(return_value=None, autospec=True)
+        sensor1 = MockSensor(poll_results=[True, True, False], name='MockSensor/1')
+        sensor2 = MockSensor(poll_results=[True, False, False],
+                             error_results=[False, True, False],
+                             name='MockSensor/2')
+        sensor3 = MockSensor(poll_results=[True, True, True], name='MockSensor/3')
+        zone = Zone('Zone/Test', ['MockSensor/1', 'MockSensor/2'])
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1, sensor2, sensor3],
+                              poll_interval_in_seconds=.001,
+                              loop_forever=False,
+                              zones=[zone])
+
+        # One email for the sensor that is not in a zone, then one for the zone.
+        eventloop.run()
+        self.assertEqual([Message('MockSensor/3 is on.', 'MockSensor/3 is on.'),
+                          Message('Zone/Test is on.',
+                                  'Zone/Test is on.\n\n'
+                                  'Sensors in alarm: MockSensor/1, MockSensor/2')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+        # Sensor 2 fails, but sensor 1 keeps the zone on.
+        mailqueue.add.reset_mock()
+        eventloop.run()
+        self.assertEqual([Message('MockSensor/2 has detected a hardware failure.',
+                                  'MockSensor/2 has detected a hardware failure.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+        mailqueue.add.reset_mock()
+        eventloop.run()
+        self.assertEqual([Message('MockSensor/2 hardware is OK.', 'MockSensor/2 hardware is OK.'),
+                          Message('Zone/Test is off.', 'Zone/Test is off.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+    def test_zone_mail_unchanged(self):
+        """A sensor sends its own alarm email if its zone's alarm did not change."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        mailqueue.add = Mock(return_value=None, autospec=True)
+        sensor1 = MockSensor(poll_results=[True, True, False], name='MockSensor/1')
+        sensor2 = MockSensor(poll_results=[False, True, True], name='MockSensor/2')
+        zone = Zone('Zone/Test', ['MockSensor/1', 'MockSensor/2'], mode='all')
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1, sensor2],
+                              poll_interval_in_seconds=.001,
+                              loop_forever=False,
+                              zones=[zone])
+
+        # Only sensor 1 is in alarm, so the zone stays off.
+        eventloop.run()
+        self.assertEqual([Message('MockSensor/1 is on.', 'MockSensor/1 is on.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+        # Both are in alarm, so the zone sends the email for sensor 2.
+        mailqueue.add.reset_mock()
+        eventloop.run()
+        self.assertEqual([Message('Zone/Test is on.',
+                                  'Zone/Test is on.\n\n'
+                                  'Sensors in alarm: MockSensor/1, MockSensor/2')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+        mailqueue.add.reset_mock()
+        eventloop.run()
+        self.assertEqual([Message('Zone/Test is off.',
+                                  'Zone/Test is off.\n\nSensors in alarm: MockSensor/2')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+
+class EventLoopConcurrentTestCase(unittest.TestCase):
+    """Tests polling the sensors with a pool of threads."""
+    def test_email_order(self):
+        """Emails go out in the order of the sensors, not the order the polls finish."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        slow_sensor = SlowMockSensor(delay=.2, poll_results=[True], name='Slow')
+        fast_sensor = MockSensor(poll_results=[True], name='Fast')
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [slow_sensor, fast_sensor],
+                              poll_interval_in_seconds=.001,
+                              loop_forever=False,
+                              max_workers=2)
+        eventloop.run()
+        self.assertEqual([Message('Slow is on.', 'Slow is on.'),
+                          Message('Fast is on.', 'Fast is on.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+    def test_hung_sensor(self):
+        """A hung sensor does not hold up the other sensors."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        release = threading.Event()
+        hung_sensor = SlowMockSensor(release=release, poll_results=[True, False], name='Hung')
+        ok_sensor = MockSensor(poll_results=[True, True], name='OK')
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [hung_sensor, ok_sensor],
+                              poll_interval_in_seconds=.001,
+                              loop_forever=False,
+                              max_workers=2,
+                              poll_deadline_in_seconds=.05)
+
+        # Only the OK sensor reports.
+        eventloop.run()
+        self.assertEqual([Message('OK is on.', 'OK is on.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+        # The hung sensor finishes.  Its result is reported on the next loop,
+        # without polling it a second time.
+        release.set()
+        time.sleep(.1)
+        eventloop.run()
+        self.assertEqual(Message('Hung is on.', 'Hung is on.'),
+                         mailqueue.add.call_args_list[1][0][0])
+        self.assertEqual(1, hung_sensor.poll_results_index)
+        self.assertEqual(2, ok_sensor.poll_results_index)
+
+
+class SlowMockSensor(MockSensor):
+    """Mock sensor that takes a while to poll."""
+    def __init__(self, delay=0, release=None, **kwargs):
+        """Constructor
+
+        :param float delay: Seconds to sleep before returning a result.
+        :param threading.Event release: If given, waits for the event before returning a result.
+        """
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.release = release
+
+    def _poll(self):
+        """Sleeps and then returns the next result."""
+        time.sleep(self.delay)
+        if self.release is not None:
+            self.release.wait()
+        return super()._poll()
+
+
+class LoopMetricsTestCase(unittest.TestCase):
+    """Tests LoopMetrics."""
+    def test_lateness(self):
+        """Lateness of every tick is recorded."""
+        metrics = LoopMetrics()
+        self.assertEqual(0.0, metrics.mean_lateness)
+        metrics.record_tick(.5)
+        metrics.record_tick(1.5)
+        self.assertEqual(2, metrics.ticks)
+        self.assertEqual(1.5, metrics.last_lateness)
+        self.assertEqual(1.5, metrics.max_lateness)
+        self.assertEqual(1.0, metrics.mean_lateness)
+
+    def test_overrun(self):
+        """Overruns and the ticks dropped by coalescing are recorded."""
+        metrics = LoopMetrics()
+        metrics.record_overrun(1)
+        metrics.record_overrun(3)
+        self.assertEqual(2, metrics.overruns)
+        self.assertEqual(2, metrics.skipped_ticks)
+
+    def test_backoff(self):
+        """Time reclaimed by backing off is recorded."""
+        metrics = LoopMetrics()
+        metrics.record_backoff(3, 30)
+        self.assertEqual(1, metrics.backoffs)
+        self.assertEqual(90, metrics.reclaimed_seconds)
+        self.assertRegex(str(metrics), 'backoffs=1 reclaimed=90.0s$')
+
 
 class EventLoopFromConfigTest(unittest.TestCase):
     """Tests creating an EventLoop from a config file."""
     SUCCESS_CONFIG = '''
     [eventloop]
     poll_interval_in_seconds=10
+    max_workers=4
+    poll_deadline_in_seconds=30
+    metrics_log_ticks=10
     '''
 
     def test_success(self):
@@ -94,6 +389,9 @@ class EventLoopFromConfigTest(unittest.TestCase):
         # noinspection PyTypeChecker
         eventloop = EventLoop.from_config(cfg, mailqueue, [sensor])
         self.assertEqual(10, eventloop.poll_interval_in_seconds)
+        self.assertEqual(4, eventloop.max_workers)
+        self.assertEqual(30, eventloop.poll_deadline_in_seconds)
+        self.assertEqual(10, eventloop.metrics_log_ticks)
 
     SUCCESS_DEFAULTS_CONFIG = '''
     [eventloop]
@@ -108,6 +406,8 @@ class EventLoopFromConfigTest(unittest.TestCase):
         # noinspection PyTypeChecker
         eventloop = EventLoop.from_config(cfg, mailqueue, [sensor])
         self.assertEqual(EventLoop.DEFAULT_POLL_INTERVAL, eventloop.poll_interval_in_seconds)
+        self.assertEqual(EventLoop.DEFAULT_MAX_WORKERS, eventloop.max_workers)
+        self.assertEqual(EventLoop.DEFAULT_METRICS_LOG_TICKS, eventloop.metrics_log_ticks)
 
 
 if __name__ == '__main__':
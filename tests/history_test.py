@@ -0,0 +1,62 @@
+"""Tests RingBuffer."""
+import unittest
+
+from homemonitor.history import RingBuffer, WindowStats
+
+
+class RingBufferTestCase(unittest.TestCase):
+    """Tests RingBuffer."""
+    def test_empty(self):
+        """An empty history has no values."""
+        history = RingBuffer(3)
+        self.assertEqual(0, len(history))
+        self.assertIsNone(history.latest())
+        self.assertEqual([], history.window())
+        self.assertEqual(WindowStats(0, None, None, None), history.stats())
+
+    def test_invalid_capacity(self):
+        """Capacity must be at least 1."""
+        with self.assertRaisesRegex(ValueError, 'History capacity must be at least 1, not 0.'):
+            RingBuffer(0)
+
+    def test_append(self):
+        """Pairs come out oldest first."""
+        history = RingBuffer(3)
+        history.append(10, 50.0)
+        history.append(20, 51.5)
+        self.assertEqual(2, len(history))
+        self.assertEqual([(10, 50.0), (20, 51.5)], list(history))
+        self.assertEqual((20, 51.5), history.latest())
+
+    def test_wrap_around(self):
+        """Once full, the oldest pair is replaced."""
+        history = RingBuffer(3)
+        for second in range(1, 8):
+            history.append(second, second * 10)
+        self.assertEqual(3, len(history))
+        self.assertEqual([(5, 50), (6, 60), (7, 70)], list(history))
+        self.assertEqual((7, 70), history.latest())
+
+    def test_window(self):
+        """The window starts at the first pair at or after the time."""
+        history = RingBuffer(4)
+        for second in range(1, 7):
+            history.append(second, second * 10)
+        self.assertEqual([30, 40, 50, 60], history.window())
+        self.assertEqual([50, 60], history.window(since=5))
+        self.assertEqual([50, 60], history.window(since=4.5))
+        self.assertEqual([30, 40, 50, 60], history.window(since=0))
+        self.assertEqual([], history.window(since=7))
+
+    def test_stats(self):
+        """Count, min, max, and mean of a window."""
+        history = RingBuffer(10)
+        for second, value in enumerate([55.0, 52.0, 49.0, 51.0]):
+            history.append(second, value)
+        self.assertEqual(WindowStats(4, 49.0, 55.0, 51.75), history.stats())
+        self.assertEqual(WindowStats(2, 49.0, 51.0, 50.0), history.stats(since=2))
+        self.assertEqual(WindowStats(0, None, None, None), history.stats(since=100))
+
+
+if __name__ == '__main__':
+    unittest.main()
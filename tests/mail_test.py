@@ -1,6 +1,6 @@
 """Tests Mail class."""
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, call
 import smtplib
 from configparser import ConfigParser
 
@@ -101,6 +101,78 @@ class MailTest(unittest.TestCase):
                              logs.output)
 
 
+class MailSessionTest(unittest.TestCase):
+    """Tests sending several emails over one connection."""
+    def setUp(self):
+        patcher = patch.object(smtplib, 'SMTP', autospec=True)
+        self.smtp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.smtp = self.smtp_class.return_value
+
+    def test_one_connection(self):
+        """Connects and logs in once per session."""
+        the_mail = Mail('test@mail.com', 'password', ['receiver@mail.com'])
+        for _ in range(2):
+            the_mail.open_session()
+            the_mail.send('one', 'Hello!')
+            the_mail.send('two', 'Hello!')
+            the_mail.send('three', 'Hello!')
+            the_mail.close_session()
+        self.assertEqual(2, self.smtp.connect.call_count)
+        self.assertEqual(2, self.smtp.starttls.call_count)
+        self.assertEqual(2, self.smtp.login.call_count)
+        self.assertEqual(6, self.smtp.sendmail.call_count)
+        self.assertEqual(2, self.smtp.quit.call_count)
+
+    def test_idle_timeout(self):
+        """The connection is kept between sessions until it has been idle too long."""
+        the_mail = Mail('test@mail.com', 'password', ['receiver@mail.com'],
+                        session_idle_timeout_in_seconds=300)
+        with patch('time.monotonic', side_effect=[0, 0, 100, 200, 200, 600]):
+            the_mail.open_session()  # No time needed, not connected.
+            the_mail.send('one', 'Hello!')  # Connected and sent at 0.
+            the_mail.close_session()  # 100: Kept.
+            the_mail.open_session()  # 200: Kept.
+            the_mail.send('two', 'Hello!')  # Sent at 200.
+            the_mail.close_session()  # 600: Idle, closed.
+        self.assertEqual(1, self.smtp.connect.call_count)
+        self.assertEqual(2, self.smtp.sendmail.call_count)
+        self.assertEqual(1, self.smtp.quit.call_count)
+
+    @capturelogs('homemonitor', 'INFO')
+    def test_reconnect(self, logs):
+        """If the server closed the connection, connects again and sends the email."""
+        self.smtp.sendmail.side_effect = [None, smtplib.SMTPServerDisconnected('closed'), None]
+        self.smtp.quit.side_effect = [smtplib.SMTPServerDisconnected('closed'), None]
+        the_mail = Mail('test@mail.com', 'password', ['receiver@mail.com'])
+        the_mail.open_session()
+        the_mail.send('one', 'Hello!')
+        the_mail.send('two', 'Hello!')
+        the_mail.close_session()
+        self.assertEqual(2, self.smtp.connect.call_count)
+        self.assertEqual(2, self.smtp.login.call_count)
+        self.assertEqual(3, self.smtp.sendmail.call_count)
+        self.assertEqual([call()], self.smtp.close.call_args_list)
+        self.assertEqual('INFO:homemonitor.mail:Mail server smtp.gmail.com closed the connection.  '
+                         'Connecting again.',
+                         logs.output[1])
+
+    @capturelogs('homemonitor', 'INFO')
+    def test_send_fails(self, logs):
+        """If sending fails in a session, the connection is closed and the next email
+        connects again."""
+        self.smtp.sendmail.side_effect = [smtplib.SMTPDataError(554, 'rejected'), None]
+        the_mail = Mail('test@mail.com', 'password', ['receiver@mail.com'])
+        the_mail.open_session()
+        with self.assertRaisesRegex(MailException, 'Failed to send email.'):
+            the_mail.send('one', 'Hello!')
+        the_mail.send('two', 'Hello!')
+        the_mail.close_session()
+        self.assertEqual(2, self.smtp.connect.call_count)
+        self.assertEqual(2, self.smtp.quit.call_count)
+        self.assertRegex(logs.output[0], 'Failed to send email.')
+
+
 class MailFromConfigTest(unittest.TestCase):
     """Tests creating Mail object from a config file."""
     SUCCESS_CONFIG = '''
@@ -110,6 +182,7 @@ class MailFromConfigTest(unittest.TestCase):
     receivers=receiver1@mail.com, receiver2@mail.com
     server=mailserver.com
     port=123
+    session_idle_timeout_in_seconds=300
     '''
 
     def test_success(self):
@@ -122,6 +195,7 @@ class MailFromConfigTest(unittest.TestCase):
         self.assertEqual(mail.receivers, ['receiver1@mail.com', 'receiver2@mail.com'])
         self.assertEqual(mail.server, 'mailserver.com')
         self.assertEqual(mail.port, 123)
+        self.assertEqual(mail.session_idle_timeout_in_seconds, 300)
 
     SUCCESS_DEFAULTS_CONFIG = '''
     [mail]
@@ -137,6 +211,7 @@ class MailFromConfigTest(unittest.TestCase):
         mail = Mail.from_config(cfg)
         self.assertEqual(mail.server, Mail.DEFAULT_SERVER)
         self.assertEqual(mail.port, Mail.DEFAULT_PORT)
+        self.assertEqual(mail.session_idle_timeout_in_seconds, Mail.DEFAULT_IDLE_TIMEOUT)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
 """Tests MailQueue."""
+import datetime
+import threading
+import time
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+from configparser import ConfigParser
 
 from loggingtestcase import capturelogs
 
@@ -11,6 +15,13 @@ from homemonitor.internetconnection import CheckInternetConnection
 
 class MailQueueTest(unittest.TestCase):
     """Tests MailQueue."""
+    def setUp(self):
+        """Fake clock for the retry delays."""
+        self.now = 1000.0
+
+    def _clock(self):
+        return self.now
+
     def test_second_two_messags(self):
         """Tests sending two messages, with a mock.
 
@@ -34,6 +45,19 @@ class MailQueueTest(unittest.TestCase):
         mailqueue.send()
         self.assertEqual(mail.send.call_count, 2)
 
+    def test_session(self):
+        """Tests the messages are sent in one mail session."""
+        mail = Mock(Mail)
+        mail.send.side_effect = [None, MailException]
+        check_internet_connection = CheckInternetConnectionMock()
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, check_internet_connection)
+        mailqueue.add(Message('One', 'BodyOne'))
+        mailqueue.add(Message('Two', 'BodyTwo'))
+        mailqueue.send()
+        self.assertEqual(['open_session', 'send', 'send', 'close_session'],
+                         [name for name, _, _ in mail.method_calls])
+
     @capturelogs('homemonitor')
     def test_fail_three_times(self, logs):
         """Tests failing to send the message three times."""
@@ -41,10 +65,11 @@ class MailQueueTest(unittest.TestCase):
         mail.send.side_effect = MailException
         check_internet_connection = CheckInternetConnectionMock()
         # noinspection PyTypeChecker
-        mailqueue = MailQueue(mail, check_internet_connection, retries=3)
+        mailqueue = MailQueue(mail, check_internet_connection, retries=3, clock=self._clock)
         mailqueue.add(Message('One', 'BodyOne'))
         for _ in range(0, 5):
             mailqueue.send()
+            self.now += MailQueue.DEFAULT_MAX_RETRY_DELAY
         self.assertEqual(mail.send.call_count, 3,
                          'Mail.send() should be call exactly 3 times.')
         self.assertRegex(logs.output[0],
@@ -54,12 +79,18 @@ class MailQueueTest(unittest.TestCase):
         """The first send fails, then the subsequent ones pass."""
         mail = MailMockFailPass()
         check_internet_connection = CheckInternetConnectionMock()
-        mailqueue = MailQueue(mail, check_internet_connection)
+        mailqueue = MailQueue(mail, check_internet_connection, clock=self._clock)
         mailqueue.add(Message('One', 'BodyOne'))
         # The first time, send will raise an exception.
         mailqueue.send()
 
+        # Until the retry delay is over, the message is not sent again.
+        self.now += MailQueue.DEFAULT_RETRY_DELAY / 2 - 1
+        mailqueue.send()
+        self.assertEqual(mail.send_call_count, 1)
+
         # The second time, send will pass.
+        self.now += MailQueue.DEFAULT_RETRY_DELAY / 2 + 1
         mailqueue.send()
 
         # The third time, there is nothing in the queue.  So send should be called exactly twice.
@@ -85,6 +116,284 @@ class MailQueueTest(unittest.TestCase):
         mailqueue.send()
         self.assertEqual(mail.send.call_count, 1)
 
+    def test_add_while_sending(self):
+        """A message added while the queue is sending is not lost."""
+        mail = Mock(Mail)
+        check_internet_connection = CheckInternetConnectionMock()
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, check_internet_connection)
+
+        def send(subject, body):
+            """Adds a message while sending, as another thread would."""
+            if subject == 'One':
+                mailqueue.add(Message('Two', 'BodyTwo'))
+
+        mail.send.side_effect = send
+        mailqueue.add(Message('One', 'BodyOne'))
+        mailqueue.send()
+        self.assertEqual([Message('Two', 'BodyTwo')], mailqueue.queue)
+        mailqueue.send()
+        self.assertEqual(mail.send.call_args_list[1][0], ('Two', 'BodyTwo'))
+
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    def test_backoff(self, _):
+        """The delay doubles after each failure, up to the longest delay."""
+        mail = Mock(Mail)
+        mail.send.side_effect = MailException
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock(), retries=10,
+                              retry_delay_in_seconds=60, max_retry_delay_in_seconds=300,
+                              clock=self._clock)
+        message = Message('One', 'BodyOne')
+        mailqueue.add(message)
+        delays = []
+        for _ in range(5):
+            start = self.now
+            mailqueue.send()
+            delays.append(message.next_attempt - start)
+            self.now = message.next_attempt
+        self.assertEqual([60, 120, 240, 300, 300], delays)
+
+    def test_jitter(self):
+        """The delay is randomized between half and all of it."""
+        mail = Mock(Mail)
+        mail.send.side_effect = MailException
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock(), retry_delay_in_seconds=60,
+                              clock=self._clock)
+        messages = [Message(str(number), 'Body') for number in range(20)]
+        for message in messages:
+            mailqueue.add(message)
+        mailqueue.send()
+        delays = [message.next_attempt - self.now for message in messages]
+        self.assertTrue(all(30 <= delay <= 60 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+        # The queue is in order of the next attempt.
+        self.assertEqual(sorted(delays),
+                         [message.next_attempt - self.now for message in mailqueue.queue])
+
+    def test_only_due(self):
+        """Only messages that are due are sent, and the Internet is not checked otherwise."""
+        mail = Mock(Mail)
+        mail.send.side_effect = [MailException, None, None]
+        check_internet_connection = CheckInternetConnectionMock()
+        check_internet_connection.connected = Mock(return_value=True)
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, check_internet_connection, clock=self._clock)
+        mailqueue.add(Message('One', 'BodyOne'))
+        mailqueue.send()
+        mailqueue.send()
+        self.assertEqual(1, check_internet_connection.connected.call_count)
+
+        self.now += 1
+        mailqueue.add(Message('Two', 'BodyTwo'))
+        mailqueue.send()
+        self.assertEqual(('Two', 'BodyTwo'), mail.send.call_args[0])
+        self.assertEqual([Message('One', 'BodyOne')], mailqueue.queue)
+
+        self.now += MailQueue.DEFAULT_RETRY_DELAY
+        mailqueue.send()
+        self.assertEqual(('One', 'BodyOne'), mail.send.call_args[0])
+        self.assertEqual([], mailqueue.queue)
+
+
+    @capturelogs('homemonitor')
+    def test_unexpected_send_error(self, logs):
+        """A message that fails with an unexpected error is retried like any failure."""
+        mail = Mock(Mail)
+        mail.send.side_effect = [UnicodeEncodeError('ascii', 'Kéller', 1, 2, 'bad'), None]
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock(), clock=self._clock)
+        mailqueue.add(Message('Kéller is on.', 'Kéller is on.'))
+        mailqueue.add(Message('Two', 'BodyTwo'))
+        mailqueue.send()
+        self.assertEqual(('Two', 'BodyTwo'), mail.send.call_args[0])
+        self.assertEqual([Message('Kéller is on.', 'Kéller is on.')], mailqueue.queue)
+        self.assertEqual(1, mailqueue.queue[0].retry_count)
+        self.assertRegex(logs.output[0], 'Unexpected error while sending "Kéller is on.".')
+
+    def test_interrupted(self):
+        """Messages not sent yet stay in the queue if sending is interrupted."""
+        mail = Mock(Mail)
+        mail.send.side_effect = [None, KeyboardInterrupt]
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock(), clock=self._clock)
+        for subject in ['One', 'Two', 'Three']:
+            mailqueue.add(Message(subject, 'Body' + subject))
+        with self.assertRaises(KeyboardInterrupt):
+            mailqueue.send()
+        self.assertEqual([Message('Two', 'BodyTwo'), Message('Three', 'BodyThree')],
+                         mailqueue.queue)
+        self.assertEqual(1, mail.close_session.call_count)
+
+        mail.send.side_effect = None
+        mailqueue.send()
+        self.assertEqual([], mailqueue.queue)
+        self.assertEqual(('Three', 'BodyThree'), mail.send.call_args[0])
+
+
+class MailQueueDigestTest(unittest.TestCase):
+    """Tests sending the messages as one digest email."""
+    @staticmethod
+    def _time(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    def test_digest(self):
+        """At the minimum number of messages, they are sent as one email, oldest first."""
+        mail = Mock(Mail)
+        check_internet_connection = CheckInternetConnectionMock()
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, check_internet_connection, digest_min_messages=3)
+        mailqueue.add(Message('One', 'One', timestamp=1000000))
+        mailqueue.add(Message('Two', 'BodyTwo', timestamp=1000060))
+        mailqueue.send()
+        self.assertEqual(2, mail.send.call_count)
+
+        mailqueue.add(Message('Four', 'Four', timestamp=1000180))
+        mailqueue.add(Message('Three', 'Three\n\nMore', timestamp=1000120))
+        mailqueue.add(Message('Five', 'Five', timestamp=1000240))
+        mailqueue.send()
+        self.assertEqual(3, mail.send.call_count)
+        self.assertEqual(('Home Monitor: 3 messages',
+                          '{}  Three\n'
+                          '    More\n'
+                          '{}  Four\n'
+                          '{}  Five'.format(self._time(1000120),
+                                            self._time(1000180),
+                                            self._time(1000240))),
+                         mail.send.call_args[0])
+
+    @capturelogs('homemonitor')
+    def test_digest_fails(self, logs):
+        """If the digest fails, each message counts one failure."""
+        mail = Mock(Mail)
+        mail.send.side_effect = MailException
+        check_internet_connection = CheckInternetConnectionMock()
+        now = [0.0]
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, check_internet_connection, retries=2, digest_min_messages=1,
+                              clock=lambda: now[0])
+        mailqueue.add(Message('One', 'One'))
+        mailqueue.add(Message('Two', 'Two'))
+        mailqueue.send()
+        self.assertEqual([1, 1], [message.retry_count for message in mailqueue.queue])
+        now[0] = MailQueue.DEFAULT_RETRY_DELAY
+        mailqueue.send()
+        self.assertEqual([], mailqueue.queue)
+        self.assertEqual(2, mail.send.call_count)
+        self.assertEqual(2, len(logs.output))
+
+
+class MailQueueBackgroundTest(unittest.TestCase):
+    """Tests sending email on the background thread."""
+    def _mailqueue(self, mail, **kwargs):
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock(), **kwargs)
+        mailqueue.start()
+        self.addCleanup(mailqueue.stop)
+        return mailqueue
+
+    def test_send_does_not_block(self):
+        """send() only wakes the thread, even while the email is slow to send."""
+        release = threading.Event()
+        mail = Mock(Mail)
+        mail.send.side_effect = lambda subject, body: release.wait(5)
+        mailqueue = self._mailqueue(mail)
+        mailqueue.add(Message('One', 'BodyOne'))
+        start = time.monotonic()
+        mailqueue.send()
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        self.assertTrue(mailqueue.flush(timeout=5))
+        self.assertEqual(('One', 'BodyOne'), mail.send.call_args[0])
+
+    def test_retry_delay(self):
+        """Failed messages are tried again after the retry delay, without being woken."""
+        sent = threading.Event()
+        mail = Mock(Mail)
+
+        def send(subject, body):
+            """Fails the first time."""
+            if mail.send.call_count == 1:
+                raise MailException(subject + body)
+            sent.set()
+
+        mail.send.side_effect = send
+        mailqueue = self._mailqueue(mail, retry_delay_in_seconds=.01)
+        mailqueue.add(Message('One', 'BodyOne'))
+        self.assertFalse(mailqueue.flush(timeout=5))
+        self.assertTrue(sent.wait(5))
+        self.assertTrue(mailqueue.flush(timeout=5))
+        self.assertEqual(2, mail.send.call_count)
+
+    def test_stop(self):
+        """Stopping sends what is left in the queue, then the thread exits."""
+        mail = Mock(Mail)
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock())
+        mailqueue.start()
+        mailqueue.add(Message('One', 'BodyOne'))
+        self.assertTrue(mailqueue.stop(timeout=5))
+        self.assertEqual(1, mail.send.call_count)
+        self.assertFalse(any(thread.name == 'MailQueue' for thread in threading.enumerate()))
+
+    def test_flush_without_thread(self):
+        """Without the background thread, flush sends the queue."""
+        mail = Mock(Mail)
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue(mail, CheckInternetConnectionMock())
+        mailqueue.add(Message('One', 'BodyOne'))
+        self.assertTrue(mailqueue.flush())
+        self.assertEqual(1, mail.send.call_count)
+
+    @capturelogs('homemonitor')
+    def test_unexpected_error(self, logs):
+        """An unexpected error is logged and the thread keeps running."""
+        mail = Mock(Mail)
+        mail.open_session.side_effect = [RuntimeError('bug'), None]
+        mailqueue = self._mailqueue(mail)
+        mailqueue.add(Message('One', 'BodyOne'))
+        mailqueue.flush(timeout=5)
+        self.assertEqual([Message('One', 'BodyOne')], mailqueue.queue)
+        mailqueue.add(Message('Two', 'BodyTwo'))
+        self.assertTrue(mailqueue.flush(timeout=5))
+        self.assertEqual([('One', 'BodyOne'), ('Two', 'BodyTwo')],
+                         [call[0] for call in mail.send.call_args_list])
+        self.assertRegex(logs.output[0], 'Unexpected error while sending email.')
+
+
+class MailQueueFromConfigTest(unittest.TestCase):
+    """Tests creating a MailQueue from a config file."""
+    def test_success(self):
+        """Create MailQueue object from configuration file."""
+        cfg = ConfigParser()
+        cfg.read_string('''
+        [mailqueue]
+        retries=5
+        digest_min_messages=4
+        background=yes
+        retry_delay_in_seconds=30
+        max_retry_delay_in_seconds=600
+        ''')
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue.from_config(cfg, Mock(Mail), CheckInternetConnectionMock())
+        self.assertEqual(5, mailqueue.retries)
+        self.assertEqual(4, mailqueue.digest_min_messages)
+        self.assertTrue(mailqueue.background)
+        self.assertEqual(30, mailqueue.retry_delay_in_seconds)
+        self.assertEqual(600, mailqueue.max_retry_delay_in_seconds)
+
+    def test_success_defaults(self):
+        """Create MailQueue object with defaults."""
+        cfg = ConfigParser()
+        # noinspection PyTypeChecker
+        mailqueue = MailQueue.from_config(cfg, Mock(Mail), CheckInternetConnectionMock())
+        self.assertEqual(MailQueue.DEFAULT_RETRIES, mailqueue.retries)
+        self.assertEqual(MailQueue.DEFAULT_DIGEST_MIN_MESSAGES, mailqueue.digest_min_messages)
+        self.assertEqual(MailQueue.DEFAULT_BACKGROUND, mailqueue.background)
+        self.assertEqual(MailQueue.DEFAULT_RETRY_DELAY, mailqueue.retry_delay_in_seconds)
+        self.assertEqual(MailQueue.DEFAULT_MAX_RETRY_DELAY, mailqueue.max_retry_delay_in_seconds)
+
 
 class MailMockFailPass(Mail):
     """Fails on the first send, and then passes on the second send."""
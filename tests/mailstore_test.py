@@ -0,0 +1,172 @@
+"""Tests MailStore."""
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import Mock
+from configparser import ConfigParser
+
+from loggingtestcase import capturelogs
+
+from homemonitor.mail import Mail, MailException
+from homemonitor.mailqueue import MailQueue, Message
+from homemonitor.mailstore import MailStore
+from tests.mailqueue_test import CheckInternetConnectionMock
+
+
+class MailStoreTestCase(unittest.TestCase):
+    """Tests MailStore."""
+    def setUp(self):
+        """Creates a store in a temporary directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'mail', 'mailqueue.db')
+        self.store = MailStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def _reopen(self):
+        """Closes and opens the store again, like a restart."""
+        self.store.close()
+        self.store = MailStore(self.path)
+        return self.store.load()
+
+    def test_empty(self):
+        """A new store has no messages, and is in WAL mode."""
+        self.assertEqual([], self.store.load())
+        connection = sqlite3.connect(self.path)
+        self.assertEqual('wal', connection.execute('PRAGMA journal_mode').fetchone()[0])
+        connection.close()
+
+    def test_sync(self):
+        """The store matches the queue after each sync, and survives a restart."""
+        one = Message('One', 'BodyOne', timestamp=100)
+        two = Message('Two', 'BodyTwo', timestamp=200)
+        three = Message('Three', 'BodyThree', timestamp=300)
+        self.store.sync([one, two, three])
+
+        two.retry_count = 2
+        two.next_attempt = 500
+        self.store.sync([two, three])
+
+        messages = self._reopen()
+        self.assertEqual([two, three], messages)
+        self.assertEqual([200, 300], [message.timestamp for message in messages])
+        self.assertEqual([2, 0], [message.retry_count for message in messages])
+        self.assertEqual([500, 0], [message.next_attempt for message in messages])
+
+        four = Message('Four', 'BodyFour', timestamp=400)
+        self.store.sync([messages[1], four])
+        self.assertEqual([three, four], self._reopen())
+
+    def test_sync_fails(self):
+        """If a sync fails, nothing is saved, and the next sync saves everything."""
+        one = Message('One', 'BodyOne')
+        self.store.sync([one])
+        two = Message('Two', None)
+        with self.assertRaises(sqlite3.Error):
+            self.store.sync([two])
+        self.assertIsNone(two.store_id)
+        two.body = 'BodyTwo'
+        self.store.sync([two])
+        self.assertEqual([two], self._reopen())
+
+    def test_upgrade(self):
+        """A database saved before messages had a next attempt is upgraded."""
+        self.store.close()
+        os.remove(self.path)
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, subject TEXT NOT NULL, '
+                           'body TEXT NOT NULL, timestamp REAL NOT NULL, '
+                           'retry_count INTEGER NOT NULL)')
+        connection.execute("INSERT INTO messages (subject, body, timestamp, retry_count) "
+                           "VALUES ('One', 'BodyOne', 100, 1)")
+        connection.commit()
+        connection.close()
+        messages = self._reopen()
+        self.assertEqual([Message('One', 'BodyOne')], messages)
+        self.assertEqual(0, messages[0].next_attempt)
+
+
+class MailQueueStoreTestCase(unittest.TestCase):
+    """Tests a MailQueue saved in a MailStore."""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'mailqueue.db')
+        self.now = 1000.0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _mailqueue(self, mail, connect_results=None):
+        store = MailStore(self.path)
+        self.addCleanup(store.close)
+        # noinspection PyTypeChecker
+        return MailQueue(mail, CheckInternetConnectionMock(connect_results), store=store,
+                         clock=lambda: self.now)
+
+    def test_restart(self):
+        """Messages waiting for the Internet, or to be retried, are sent after a restart."""
+        mail = Mock(Mail)
+        mail.send.side_effect = [MailException, None, None]
+        mailqueue = self._mailqueue(mail, [False, True])
+        mailqueue.add(Message('One', 'BodyOne'))
+        mailqueue.send()
+        # One fails, Two is sent.
+        mailqueue.add(Message('Two', 'BodyTwo'))
+        mailqueue.send()
+        self.assertEqual(2, mail.send.call_count)
+        mailqueue.store.close()
+
+        mailqueue = self._mailqueue(mail)
+        self.assertEqual([Message('One', 'BodyOne')], mailqueue.queue)
+        self.assertEqual(1, mailqueue.queue[0].retry_count)
+        # It waits out its retry delay, even after the restart.
+        mailqueue.send()
+        self.assertEqual(2, mail.send.call_count)
+        self.now += MailQueue.DEFAULT_RETRY_DELAY
+        mailqueue.send()
+        self.assertEqual(('One', 'BodyOne'), mail.send.call_args[0])
+        mailqueue.store.close()
+
+        self.assertEqual([], self._mailqueue(mail).queue)
+
+    @capturelogs('homemonitor')
+    def test_save_fails(self, logs):
+        """If the queue cannot be saved, it is logged and the queue is still sent."""
+        mail = Mock(Mail)
+        mailqueue = self._mailqueue(mail, [False, True])
+        mailqueue.store.sync = Mock(side_effect=sqlite3.OperationalError('disk I/O error'))
+        mailqueue.add(Message('One', 'BodyOne'))
+        mailqueue.send()
+        mailqueue.send()
+        self.assertEqual(1, mail.send.call_count)
+        self.assertEqual('ERROR:homemonitor.mailqueue:Failed to save the mail queue to {} - '
+                         'disk I/O error'.format(self.path),
+                         logs.output[0])
+
+
+class MailStoreFromConfigTest(unittest.TestCase):
+    """Tests creating a MailStore from a config file."""
+    def test_success(self):
+        """Create MailStore object from configuration file."""
+        with tempfile.TemporaryDirectory() as directory:
+            cfg = ConfigParser()
+            cfg.read_dict({'mailqueue': {'database': os.path.join(directory, 'mailqueue.db')}})
+            store = MailStore.from_config(cfg)
+            self.assertEqual(os.path.join(directory, 'mailqueue.db'), store.path)
+            store.close()
+
+    def test_no_database(self):
+        """Without the database option, the queue is not saved."""
+        cfg = ConfigParser()
+        cfg.read_string('''
+        [mailqueue]
+        retries=3
+        ''')
+        self.assertIsNone(MailStore.from_config(cfg))
+
+
+if __name__ == '__main__':
+    unittest.main()
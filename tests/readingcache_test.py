@@ -0,0 +1,96 @@
+"""Tests ReadingCache."""
+import threading
+import unittest
+
+from homemonitor.readingcache import ReadingCache, CachedReading
+
+
+class ReadingCacheTestCase(unittest.TestCase):
+    """Tests ReadingCache."""
+    def setUp(self):
+        """Creates a cache with a fake clock."""
+        self.now = 1000.0
+        self.cache = ReadingCache(clock=lambda: self.now)
+        self.read_count = 0
+
+    def _read(self):
+        """Fake hardware read."""
+        self.read_count += 1
+        return self.read_count
+
+    def test_reuse_fresh_reading(self):
+        """A fresh reading is reused, with the time it was read."""
+        self.assertEqual(CachedReading(1, 1000.0), self.cache.get('pin', 2, self._read))
+        self.now += 2
+        self.assertEqual(CachedReading(1, 1000.0), self.cache.get('pin', 2, self._read))
+        self.assertEqual(1, self.read_count)
+
+    def test_stale_reading(self):
+        """A reading older than the max age is read again."""
+        self.cache.get('pin', 2, self._read)
+        self.now += 2.5
+        self.assertEqual(CachedReading(2, 1002.5), self.cache.get('pin', 2, self._read))
+
+    def test_each_caller_decides_max_age(self):
+        """The same reading may be fresh enough for one caller and not another."""
+        self.cache.get('pin', 10, self._read)
+        self.now += 5
+        self.assertEqual(1, self.cache.get('pin', 10, self._read).value)
+        self.assertEqual(2, self.cache.get('pin', 1, self._read).value)
+
+    def test_keys(self):
+        """Each key has its own reading."""
+        self.cache.get(('DHT22', 4), 2, self._read)
+        self.cache.get(('DHT22', 5), 2, self._read)
+        self.assertEqual(2, self.read_count)
+
+    def test_clock_went_backwards(self):
+        """If the clock goes backwards, the reading is not trusted."""
+        self.cache.get('pin', 2, self._read)
+        self.now -= 3600
+        self.assertEqual(2, self.cache.get('pin', 2, self._read).value)
+
+    def test_error_not_cached(self):
+        """A failed read is not cached."""
+        def fail():
+            """Read that fails."""
+            raise IOError('failed')
+
+        with self.assertRaises(IOError):
+            self.cache.get('pin', 2, fail)
+        self.assertEqual(1, self.cache.get('pin', 2, self._read).value)
+
+    def test_clear(self):
+        """Clearing the cache forgets the readings."""
+        self.cache.get('pin', 2, self._read)
+        self.cache.clear()
+        self.assertEqual(2, self.cache.get('pin', 2, self._read).value)
+
+    def test_single_read_in_flight(self):
+        """Callers asking at the same time share one read of the hardware."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_read():
+            """Read that waits until released."""
+            started.set()
+            release.wait()
+            return self._read()
+
+        results = []
+        reader = threading.Thread(target=lambda: results.append(
+            self.cache.get('pin', 0, slow_read)))
+        reader.start()
+        started.wait(1)
+        waiter = threading.Thread(target=lambda: results.append(
+            self.cache.get('pin', 0, slow_read)))
+        waiter.start()
+        release.set()
+        reader.join(1)
+        waiter.join(1)
+        self.assertEqual(1, self.read_count)
+        self.assertEqual([CachedReading(1, 1000.0)] * 2, results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests ThresholdReplay."""
+import tempfile
+import unittest
+
+try:
+    # noinspection PyUnresolvedReferences
+    import numpy
+except ImportError:
+    numpy = None
+
+from homemonitor.replay import ThresholdReplay, ReplayResult
+from homemonitor.timeseries import TimeSeriesStore
+
+
+def _count_emails(values, threshold):
+    """Counts the emails one reading at a time, the same way a sensor would."""
+    alarm_on = False
+    emails = 0
+    for value in values:
+        if (value < threshold) != alarm_on:
+            alarm_on = not alarm_on
+            emails += 1
+    return emails
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed.')
+class ThresholdReplayTestCase(unittest.TestCase):
+    """Tests ThresholdReplay."""
+    def setUp(self):
+        """Stores readings for a sensor."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = TimeSeriesStore(self.directory.name)
+        self.values = [52.0, 50.0, 49.5, 50.5, 49.0, 48.0, 51.0, 50.0, 50.0, 53.0]
+        log = self.store.log('TemperatureSensor/Basement')
+        for second, value in enumerate(self.values):
+            log.append(second * 900, value)
+        self.store.close()
+        self.replay = ThresholdReplay(self.store)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load(self):
+        """Readings are loaded in order, within the time range."""
+        self.assertEqual(self.values, list(self.replay.load('TemperatureSensor/Basement')))
+        self.assertEqual(self.values[2:4],
+                         list(self.replay.load('TemperatureSensor/Basement', 1800, 3600)))
+
+    def test_load_no_history(self):
+        """A sensor without history is an error."""
+        with self.assertRaisesRegex(ValueError, 'There is no history'):
+            self.replay.load('TemperatureSensor/Attic')
+
+    def test_evaluate(self):
+        """Emails match replaying one reading at a time, including at the thresholds."""
+        thresholds = [47, 48, 49.5, 50, 50.25, 51, 52, 53, 60]
+        emails, in_alarm = self.replay.evaluate(numpy.array(self.values), thresholds)
+        self.assertEqual([_count_emails(self.values, threshold) for threshold in thresholds],
+                         list(emails))
+        self.assertEqual([sum(value < threshold for value in self.values)
+                          for threshold in thresholds],
+                         list(in_alarm))
+
+    def test_evaluate_random(self):
+        """Emails match replaying one reading at a time, for noisy readings."""
+        values = 50 + numpy.random.RandomState(1).normal(size=2000).cumsum() * .1
+        thresholds = numpy.linspace(values.min() - 1, values.max() + 1, 25)
+        emails, _ = self.replay.evaluate(values, thresholds)
+        self.assertEqual([_count_emails(values, threshold) for threshold in thresholds],
+                         list(emails))
+
+    def test_run(self):
+        """Each sensor and threshold gets a result."""
+        results = self.replay.run(['TemperatureSensor/Basement'], [50, 60])
+        self.assertEqual([ReplayResult('TemperatureSensor/Basement', 50, 10, 2, 4, 30.0),
+                          ReplayResult('TemperatureSensor/Basement', 60, 10, 1, 1, 100.0)],
+                         results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Tests RollupRow and Rollup."""
+import unittest
+
+from homemonitor.rollup import Rollup, RollupRow
+
+
+class RollupRowTestCase(unittest.TestCase):
+    """Tests RollupRow."""
+    def test_add(self):
+        """Count, min, max, sum, and sum of squares are kept up to date."""
+        row = RollupRow.first(60, 2.0).add(4.0).add(6.0)
+        self.assertEqual(RollupRow(60, 3, 2.0, 6.0, 12.0, 56.0), row)
+        self.assertEqual(4.0, row.mean)
+        self.assertAlmostEqual((8 / 3) ** .5, row.standard_deviation)
+
+    def test_merge(self):
+        """Merging two rows is the same as adding the values to one row."""
+        row = RollupRow.first(0, 1.0).add(5.0).merge(RollupRow.first(0, 3.0))
+        self.assertEqual(RollupRow.first(0, 1.0).add(5.0).add(3.0), row)
+
+    def test_constant(self):
+        """The standard deviation of equal values is 0."""
+        row = RollupRow.first(0, 50.1).add(50.1).add(50.1)
+        self.assertEqual(0.0, row.standard_deviation)
+
+
+class RollupTestCase(unittest.TestCase):
+    """Tests Rollup."""
+    def setUp(self):
+        self.rollup = Rollup(60)
+        self.log = MockLog()
+
+    def test_periods(self):
+        """Readings are added to the row of their period."""
+        self.rollup.append(60, 1.0)
+        self.rollup.append(119.5, 3.0)
+        self.assertEqual(RollupRow(60, 2, 1.0, 3.0, 4.0, 10.0), self.rollup.current)
+        self.rollup.append(120, 5.0)
+        self.assertEqual(RollupRow.first(120, 5.0), self.rollup.current)
+
+    def test_finished_rows_logged(self):
+        """Once the period is over, its row goes to the log."""
+        self.rollup.open_log(self.log)
+        self.rollup.append(60, 1.0)
+        self.rollup.append(125, 2.0)
+        self.rollup.append(250, 3.0)
+        self.assertEqual([RollupRow.first(60, 1.0), RollupRow.first(120, 2.0)], self.log.rows)
+        self.assertEqual([RollupRow.first(120, 2.0), RollupRow.first(240, 3.0)],
+                         list(self.rollup.rows(since=100)))
+        self.assertEqual([RollupRow.first(60, 1.0)], list(self.rollup.rows(until=120)))
+
+    def test_late_reading_dropped(self):
+        """A reading for a finished period is dropped."""
+        self.rollup.append(125, 2.0)
+        self.rollup.append(60, 1.0)
+        self.assertEqual(RollupRow.first(120, 2.0), self.rollup.current)
+
+    def test_close_and_open(self):
+        """The row in progress is stored on close and picked up again on open."""
+        self.rollup.open_log(self.log)
+        self.rollup.append(60, 1.0)
+        self.rollup.close()
+        self.assertEqual([RollupRow.first(60, 1.0)], self.log.rows)
+
+        rollup = Rollup(60)
+        rollup.open_log(self.log)
+        self.assertEqual([], self.log.rows)
+        rollup.append(90, 3.0)
+        self.assertEqual(RollupRow.first(60, 1.0).add(3.0), rollup.current)
+
+
+class MockLog(object):
+    """Keeps rows in a list, like homemonitor.timeseries.RollupLog."""
+    def __init__(self):
+        self.rows = []
+
+    def append(self, *row):
+        """Adds a row."""
+        self.rows.append(RollupRow(*row))
+
+    def pop(self):
+        """Removes the newest row."""
+        return self.rows.pop() if self.rows else None
+
+    def query(self, since=None, until=None):
+        """Returns rows in the range."""
+        return [row for row in self.rows
+                if (since is None or row.start >= since) and (until is None or row.start < until)]
+
+    def close(self):
+        """Nothing to close."""
+
+
+if __name__ == '__main__':
+    unittest.main()
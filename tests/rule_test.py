@@ -0,0 +1,47 @@
+"""Tests Rule."""
+import re
+import unittest
+
+from homemonitor.rule import Rule
+
+
+class RuleTestCase(unittest.TestCase):
+    """Tests Rule."""
+    VARIABLES = ('temp_f', 'humidity')
+
+    def test_evaluate(self):
+        """Rules are evaluated against the values."""
+        rule = Rule('temp_f < 50 or humidity > 85', self.VARIABLES)
+        self.assertTrue(rule.evaluate({'temp_f': 49.9, 'humidity': 50.0}))
+        self.assertTrue(rule.evaluate({'temp_f': 70.0, 'humidity': 90.0}))
+        self.assertFalse(rule.evaluate({'temp_f': 50.0, 'humidity': 85.0}))
+
+    def test_arithmetic(self):
+        """Rules can do arithmetic, and use not and parentheses."""
+        rule = Rule(' not (temp_f - 32) * 5 / 9 >= -1.5 ', self.VARIABLES)
+        self.assertTrue(rule.evaluate({'temp_f': 20.0, 'humidity': 0.0}))
+        self.assertFalse(rule.evaluate({'temp_f': 40.0, 'humidity': 0.0}))
+        self.assertEqual(' not (temp_f - 32) * 5 / 9 >= -1.5 ', str(rule))
+
+    def test_not_allowed(self):
+        """Anything other than numbers, variables and operators is rejected."""
+        for expression, message in [
+                ('__import__("os").system("ls")', 'Call is not allowed.'),
+                ('temp_f.real < 50', 'Attribute is not allowed.'),
+                ('[temp_f][0] < 50', 'Subscript is not allowed.'),
+                ('temp_f ** 99999 < 1', 'Pow is not allowed.'),
+                ('temp_f < "50"', "'50' is not a number."),
+                ('temperature < 50', 'temperature is not a variable.'),
+                ('temp_f <', 'invalid syntax')]:
+            with self.assertRaisesRegex(ValueError, 'is not valid: ' + re.escape(message)):
+                Rule(expression, self.VARIABLES)
+
+    def test_missing_value(self):
+        """A rule using a value that is None raises TypeError."""
+        rule = Rule('humidity > 85', self.VARIABLES)
+        with self.assertRaises(TypeError):
+            rule.evaluate({'temp_f': 50.0, 'humidity': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests the Scheduler class."""
+import unittest
+
+from homemonitor.scheduler import Scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """Tests the Scheduler class."""
+    def setUp(self):
+        """Creates a scheduler with a fake clock."""
+        self.now = 100.0
+        self.sleeps = []
+        self.scheduler = Scheduler(clock=lambda: self.now, sleep=self._sleep)
+
+    def _sleep(self, seconds):
+        """Fake sleep that moves the clock forward."""
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_sleeps_until_next_due(self):
+        """Sleeps exactly until the earliest due time."""
+        self.scheduler.add(0, 130)
+        self.scheduler.add(1, 110)
+        self.scheduler.wait()
+        self.assertEqual([10], self.sleeps)
+        self.assertEqual([(1, 110)], self.scheduler.pop_due())
+        self.assertEqual(1, len(self.scheduler))
+
+    def test_pop_due_order(self):
+        """Everything due is returned, earliest first.  Ties come out smallest key first."""
+        self.scheduler.add(2, 90)
+        self.scheduler.add(1, 90)
+        self.scheduler.add(0, 95)
+        self.scheduler.add(3, 200)
+        self.assertEqual([(1, 90), (2, 90), (0, 95)], self.scheduler.pop_due())
+        self.assertEqual(200, self.scheduler.next_due())
+
+    def test_no_sleep_when_overdue(self):
+        """Does not sleep if something is already due."""
+        self.scheduler.add(0, 50)
+        self.scheduler.wait()
+        self.assertEqual([], self.sleeps)
+
+    def test_empty(self):
+        """Nothing scheduled."""
+        self.assertIsNone(self.scheduler.next_due())
+        self.scheduler.wait()
+        self.assertEqual([], self.sleeps)
+        self.assertEqual([], self.scheduler.pop_due())
+
+    def test_empty_idle(self):
+        """Sleeps the idle time if nothing is scheduled."""
+        self.scheduler.wait(900)
+        self.assertEqual([900], self.sleeps)
+        self.scheduler.add(0, 1010)
+        self.scheduler.wait(900)
+        self.assertEqual([900, 10], self.sleeps)
+
+    def test_reschedule_on_time(self):
+        """The next tick is based on when the last tick was due, so it does not drift."""
+        self.now = 103.0
+        self.assertEqual(0, self.scheduler.reschedule(0, 100, 10))
+        self.assertEqual(110, self.scheduler.next_due())
+
+    def test_reschedule_overrun(self):
+        """Missed ticks are coalesced into one tick that is due right away."""
+        self.now = 135.0
+        self.assertEqual(3, self.scheduler.reschedule(0, 100, 10))
+        self.assertEqual(130, self.scheduler.next_due())
+        self.assertEqual([(0, 130)], self.scheduler.pop_due())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,10 @@
 """Tests the base sensor class."""
+import threading
 import unittest
 
 from loggingtestcase import capturelogs
 
-from homemonitor.sensor import Sensor, SensorError
+from homemonitor.sensor import Sensor, SensorError, SensorRetry, SensorStatus
 
 
 class SensorTestCase(unittest.TestCase):
@@ -115,15 +116,263 @@ class SensorTestCase(unittest.TestCase):
                          logs.output)
 
 
+class SensorStatusTestCase(unittest.TestCase):
+    """Tests the status snapshot returned by Sensor.status()."""
+    def test_snapshot(self):
+        """status() returns an immutable snapshot of the status."""
+        sensor = MockSensor(poll_results=[True, True], error_results=[False, True])
+        status = sensor.status()
+        self.assertIsInstance(status, SensorStatus)
+        self.assertEqual(('MockSensor', True, True, False, False, None),
+                         status[:6])
+        self.assertIsNotNone(status.timestamp)
+        self.assertIs(status, sensor.last_status)
+        with self.assertRaises(AttributeError):
+            # noinspection PyPropertyAccess
+            status.alarm_on = False
+
+        # The first snapshot does not change when the sensor is polled again.
+        second_status = sensor.status()
+        self.assertTrue(second_status.hw_error_on)
+        self.assertFalse(status.hw_error_on)
+        self.assertEqual(second_status.hw_error_on, sensor.hw_error_on)
+
+
+class SensorBackoffTestCase(unittest.TestCase):
+    """Tests backing off while in hardware error."""
+    def test_backoff(self):
+        """The time between polls doubles after each failure, up to the maximum."""
+        sensor = MockSensor(poll_results=[False] * 6,
+                            error_results=[True, True, True, True, True, False])
+        sensor.max_backoff_in_seconds = 300
+        intervals = []
+        for _ in range(6):
+            sensor.status()
+            intervals.append(sensor.next_poll_interval(60))
+        self.assertEqual([60, 120, 240, 300, 300, 60], intervals)
+        self.assertEqual(0, sensor.failures_in_a_row)
+
+    def test_interval_above_maximum(self):
+        """Backing off never polls more often than the normal interval."""
+        sensor = MockSensor(poll_results=[False] * 2, error_results=[True, True])
+        sensor.max_backoff_in_seconds = 30
+        sensor.status()
+        sensor.status()
+        self.assertEqual(60, sensor.next_poll_interval(60))
+
+
+class SensorRetryTestCase(unittest.TestCase):
+    """Tests retrying a failed read."""
+    def test_retry_then_pass(self):
+        """A failed read is retried later, without changing the status."""
+        sensor = RetryMockSensor(retries=2, poll_results=[True])
+        sensor.read_attempts = 3
+        delays = []
+        for _ in range(2):
+            sensor.status()
+            self.assertFalse(sensor.alarm_changed)
+            self.assertFalse(sensor.hw_error_on)
+            delays.append(sensor.retry_in_seconds)
+        sensor.status()
+        self.assertIsNone(sensor.retry_in_seconds)
+        self.assertTrue(sensor.alarm_on)
+        self.assertTrue(sensor.alarm_changed)
+
+        # The delay doubles each attempt, with some randomness.
+        self.assertTrue(1 <= delays[0] <= 2, delays)
+        self.assertTrue(2 <= delays[1] <= 4, delays)
+
+    @capturelogs('homemonitor.sensor', 'INFO')
+    def test_out_of_attempts(self, logs):
+        """Once out of attempts, it is a hardware error."""
+        sensor = RetryMockSensor(retries=5, poll_results=[False])
+        sensor.read_attempts = 2
+        sensor.status()
+        sensor.status()
+        self.assertIsNone(sensor.retry_in_seconds)
+        self.assertTrue(sensor.hw_error_on)
+        self.assertEqual(['ERROR:homemonitor.sensor:MockSensor - Read failed.'], logs.output)
+
+
+class SensorWatchdogTestCase(unittest.TestCase):
+    """Tests the poll timeout."""
+    def tearDown(self):
+        """Lets any hung poll finish."""
+        self.release.set()
+
+    def setUp(self):
+        """Creates a sensor whose polls hang until released."""
+        self.release = threading.Event()
+        self.sensor = HangingMockSensor(self.release, poll_results=[False] * 10)
+        self.sensor.poll_timeout_in_seconds = .05
+
+    @capturelogs('homemonitor.sensor', 'INFO')
+    def test_timeout(self, logs):
+        """A poll that times out is a hardware error."""
+        self.sensor.status()
+        self.assertTrue(self.sensor.hw_error_on)
+        self.assertTrue(self.sensor.hw_error_changed)
+        self.assertEqual(1, self.sensor.timeout_count)
+        self.assertEqual('ERROR:homemonitor.sensor:MockSensor - Poll timed out after 0.05 '
+                         'seconds.',
+                         logs.output[0])
+
+    def test_not_polled_while_hung(self):
+        """While a poll is still hung, the sensor is not polled again."""
+        self.sensor.status()
+        self.sensor.status()
+        self.assertTrue(self.sensor.hw_error_on)
+        self.assertEqual(1, self.sensor.poll_results_index)
+        self.assertEqual(1, self.sensor.timeout_count)
+
+    def test_recovers(self):
+        """Once the hung poll finishes, the sensor is polled again."""
+        self.sensor.status()
+        self.sensor.hang = False
+        self.release.set()
+        self.sensor.hung_poll_finished.wait(1)
+        self.sensor.status()
+        self.assertFalse(self.sensor.hw_error_on)
+        self.assertTrue(self.sensor.hw_error_changed)
+        self.assertEqual(2, self.sensor.poll_results_index)
+
+    @capturelogs('homemonitor.sensor', 'WARNING')
+    def test_quarantine(self, logs):
+        """A sensor that keeps timing out is quarantined."""
+        self.sensor.QUARANTINE_AFTER = 2
+        self.sensor.status()
+        self.assertFalse(self.sensor.quarantined)
+
+        # Let the hung poll finish, so the next poll hangs again.
+        self.release.set()
+        self.sensor.hung_poll_finished.wait(1)
+        self.release.clear()
+        self.sensor.status()
+        self.assertEqual(2, self.sensor.timeout_count)
+        self.assertTrue(self.sensor.quarantined)
+        self.assertRegex(logs.output[1], 'MockSensor - Timed out 2 times in a row.')
+
+        # Quarantined sensors are not polled.
+        self.release.set()
+        polls = self.sensor.poll_results_index
+        self.sensor.status()
+        self.assertTrue(self.sensor.hw_error_on)
+        self.assertEqual(polls, self.sensor.poll_results_index)
+
+    def test_error_in_poll(self):
+        """A SensorError raised by a watched poll is still a hardware error."""
+        sensor = MockSensor(poll_results=[False], error_results=[True])
+        sensor.poll_timeout_in_seconds = 1
+        sensor.status()
+        self.assertTrue(sensor.hw_error_on)
+        self.assertEqual(0, sensor.timeout_count)
+
+
+class SensorDebounceTestCase(unittest.TestCase):
+    """Tests the alarm only changing after several polls in a row."""
+    def test_debounce(self):
+        """The alarm changes on the third poll in a row."""
+        sensor = MockSensor(poll_results=[True, True, True, True, False, False, False])
+        sensor.debounce_readings = 3
+        alarms = [sensor.status().alarm_on for _ in range(7)]
+        self.assertEqual([False, False, True, True, True, True, False], alarms)
+
+    def test_flapping(self):
+        """A sensor flapping on and off never changes the alarm."""
+        sensor = MockSensor(poll_results=[True, False, True, False, True, True])
+        sensor.debounce_readings = 2
+        changes = [sensor.status().alarm_changed for _ in range(6)]
+        self.assertEqual([False, False, False, False, False, True], changes)
+
+    def test_default(self):
+        """By default, the alarm changes right away."""
+        sensor = MockSensor(poll_results=[True])
+        self.assertTrue(sensor.status().alarm_on)
+
+
+class SensorTrendTestCase(unittest.TestCase):
+    """Tests the trend alarm."""
+    @capturelogs('homemonitor.sensor', 'WARNING')
+    def test_trend(self, logs):
+        """A falling trend sets off the alarm, before the sensor's own alarm."""
+        # Falling 8 degrees per hour.
+        sensor = ReadingMockSensor(readings=[(second, 70.0 - second / 450)
+                                             for second in range(0, 8 * 900, 900)],
+                                   max_drop_per_hour=5)
+        alarms = [sensor.status().alarm_on for _ in range(8)]
+        self.assertEqual([False] * 6 + [True] * 2, alarms)
+        self.assertEqual(['WARNING:homemonitor.sensor:ReadingMockSensor is falling 5.2 per hour.'],
+                         logs.output)
+
+    def test_no_trend(self):
+        """Without max_drop_per_hour or min_average, there is no trend alarm."""
+        self.assertIsNone(ReadingMockSensor(readings=[]).trend)
+
+
+class SensorHistoryTestCase(unittest.TestCase):
+    """Tests readings being kept in the history."""
+    def test_no_reading(self):
+        """Sensors without readings keep no history."""
+        sensor = MockSensor(poll_results=[False, True])
+        sensor.status()
+        sensor.status()
+        self.assertEqual(0, len(sensor.history))
+
+    def test_readings(self):
+        """Each new reading is added once, and hardware errors are not added."""
+        sensor = ReadingMockSensor(readings=[(100.0, 50.0), (100.0, 50.0), None, (200.0, 48.5)])
+        for _ in range(4):
+            sensor.status()
+        self.assertEqual([(100.0, 50.0), (200.0, 48.5)], list(sensor.history))
+
+    def test_history_size(self):
+        """Only history_size readings are kept."""
+        sensor = ReadingMockSensor(readings=[(1.0, 1.0), (2.0, 2.0), (3.0, 3.0)],
+                                   history_size=2)
+        for _ in range(3):
+            sensor.status()
+        self.assertEqual([2.0, 3.0], sensor.history.window())
+
+    def test_rollups(self):
+        """Each reading updates the minute, hour and day rollups."""
+        sensor = ReadingMockSensor(readings=[(3600.0, 50.0), (3660.0, 48.0)])
+        sensor.status()
+        sensor.status()
+        self.assertEqual(3660.0, sensor.rollups['minute'].current.start)
+        self.assertEqual(2, sensor.rollups['hour'].current.count)
+        self.assertEqual(48.0, sensor.rollups['day'].current.minimum)
+
+    @capturelogs('homemonitor.sensor', 'ERROR')
+    def test_recorders(self, logs):
+        """Recorders are given each reading, and their errors are logged."""
+        recorded = []
+
+        class FailingRecorder(object):
+            """Recorder whose disk is full."""
+            @staticmethod
+            def append(timestamp, value):
+                raise OSError('No space left on device')
+
+        sensor = ReadingMockSensor(readings=[(100.0, 50.0), (200.0, 48.5)])
+        sensor.recorders.append(FailingRecorder())
+        sensor.recorders.append(MockRecorder(recorded))
+        sensor.status()
+        sensor.status()
+        self.assertEqual([(100.0, 50.0), (200.0, 48.5)], recorded)
+        self.assertEqual('ERROR:homemonitor.sensor:ReadingMockSensor - Failed to record '
+                         'reading: No space left on device', logs.output[0])
+
+
 class MockSensor(Sensor):
     """Mocks a sensor by returning a list of pre-programmed results."""
-    def __init__(self, poll_results=None, error_results=None):
+    def __init__(self, poll_results=None, error_results=None, name='MockSensor'):
         """Constructor
 
         :param list(bool) poll_results: List of results method poll() will return.
         :param list(bool) error_results: List of whether or not to throw an error.
+        :param str name: Name of the sensor.
         """
-        super().__init__('MockSensor')
+        super().__init__(name)
         self.poll_results = poll_results
         self.poll_results_index = 0
         self.error_results = error_results
@@ -139,5 +388,77 @@ class MockSensor(Sensor):
         return result
 
 
+class RetryMockSensor(MockSensor):
+    """Mock sensor whose first reads fail and should be retried."""
+    def __init__(self, retries, **kwargs):
+        """Constructor
+
+        :param int retries: Number of reads that fail before polling as normal.
+        """
+        super().__init__(**kwargs)
+        self.retries = retries
+
+    def _poll(self):
+        """Fails the first :attr:`retries` reads."""
+        if self.retries:
+            self.retries -= 1
+            raise SensorRetry('Read failed.')
+        return super()._poll()
+
+
+class HangingMockSensor(MockSensor):
+    """Mock sensor whose polls hang until released."""
+    def __init__(self, release, **kwargs):
+        """Constructor
+
+        :param threading.Event release: Hung polls return once it is set.
+        """
+        super().__init__(**kwargs)
+        self.release = release
+        self.hang = True
+        self.hung_poll_finished = threading.Event()
+
+    def _poll(self):
+        """Hangs while :attr:`hang` is True."""
+        result = super()._poll()
+        if self.hang:
+            self.release.wait()
+            self.hung_poll_finished.set()
+        return result
+
+
+class ReadingMockSensor(Sensor):
+    """Mock sensor that returns pre-programmed readings."""
+    def __init__(self, readings, **kwargs):
+        """Constructor
+
+        :param list readings: Timestamp, value pairs.  None raises a SensorError.
+        """
+        super().__init__('ReadingMockSensor', **kwargs)
+        self.readings = iter(readings)
+
+    def _value(self, reading):
+        """The reading is the value."""
+        return reading
+
+    def _poll(self):
+        """Reads the next pair."""
+        pair = next(self.readings)
+        if pair is None:
+            raise SensorError('Failed to connect to hardware!')
+        self.reading_timestamp, self.reading = pair
+        return False
+
+
+class MockRecorder(object):
+    """Records readings in a list."""
+    def __init__(self, recorded):
+        self.recorded = recorded
+
+    def append(self, timestamp, value):
+        """Adds the pair to the list."""
+        self.recorded.append((timestamp, value))
+
+
 if __name__ == '__main__':
     unittest.main()
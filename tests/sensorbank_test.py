@@ -0,0 +1,172 @@
+"""Tests SensorBank."""
+import threading
+import unittest
+from unittest.mock import Mock
+
+from loggingtestcase import capturelogs
+
+try:
+    # noinspection PyUnresolvedReferences
+    import numpy
+except ImportError:
+    numpy = None
+
+from homemonitor.asynceventloop import AsyncEventLoop
+from homemonitor.eventloop import EventLoop
+from homemonitor.mailqueue import MailQueue, Message
+from homemonitor.sensorbank import SensorBank
+from tests.sensor_test import MockSensor
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed.')
+class SensorBankTestCase(unittest.TestCase):
+    """Tests SensorBank."""
+    NAMES = ['Simulated/0', 'Simulated/1', 'Simulated/2']
+
+    def test_alarm(self):
+        """Only the sensors whose alarm changed are returned."""
+        bank = SensorBank(self.NAMES, [50, 45, 40])
+        self.assertEqual([0, 2], list(bank.update([49.0, 45.0, 39.9], timestamp=100)))
+        self.assertEqual([True, False, True], list(bank.alarm_on))
+        self.assertEqual([], list(bank.update([48.0, 46.0, 30.0], timestamp=200)))
+        self.assertEqual([0], list(bank.update([50.0, 46.0, 30.0], timestamp=300)))
+        self.assertEqual([False, False, True], list(bank.alarm_on))
+
+    def test_hysteresis(self):
+        """The alarm only goes off at the hysteresis above the threshold."""
+        bank = SensorBank(self.NAMES, [50, 50, 50], hysteresis_in_degrees=[1, 2, 0])
+        bank.update([49.0, 49.0, 49.0])
+        self.assertEqual([0, 2], list(bank.update([51.0, 51.5, 50.0])))
+        self.assertEqual([False, True, False], list(bank.alarm_on))
+
+    def test_hw_error(self):
+        """NaN turns on the hardware error and leaves the alarm as it was."""
+        bank = SensorBank(self.NAMES, [50, 50, 50])
+        bank.update([49.0, 60.0, 60.0])
+        self.assertEqual([0, 1], list(bank.update([numpy.nan, numpy.nan, 60.0])))
+        self.assertEqual([True, False, False], list(bank.alarm_on))
+        self.assertEqual([True, True, False], list(bank.hw_error_on))
+        self.assertEqual([0, 1], list(bank.update([60.0, 60.0, 60.0])))
+        self.assertEqual([False, False, False], list(bank.alarm_on))
+
+    def test_statuses(self):
+        """Statuses are built only for the changed sensors."""
+        bank = SensorBank(self.NAMES, [50, 50, 50])
+        changed = bank.update([49.0, numpy.nan, 60.0], timestamp=100)
+        statuses = bank.statuses(changed)
+        self.assertEqual(2, len(statuses))
+        self.assertEqual(('Simulated/0', True, True, False, False, 49.0, 100, 49.0),
+                         statuses[0])
+        self.assertEqual(('Simulated/1', False, False, True, True, None, 100, None),
+                         statuses[1])
+
+    @capturelogs('homemonitor.sensorbank', level='INFO')
+    def test_logs(self, logs):
+        """Changes are logged the same as a sensor."""
+        bank = SensorBank(self.NAMES[:2], [50, 50])
+        bank.update([49.0, numpy.nan])
+        self.assertEqual(['INFO:homemonitor.sensorbank:Simulated/0 is on.',
+                          'ERROR:homemonitor.sensorbank:Simulated/1 - Failed to read sensor!'],
+                         logs.output)
+
+    def test_poll(self):
+        """Polling reads the values and returns the changed statuses."""
+        bank = SensorBank(self.NAMES, [50, 50, 50], read_values=lambda: [49.0, 60.0, 60.0])
+        self.assertEqual(['Simulated/0'], [status.name for status in bank.poll()])
+        self.assertEqual([], bank.poll())
+
+    @capturelogs('homemonitor.sensorbank', level='INFO')
+    def test_poll_fails(self, logs):
+        """If the values cannot be read, every sensor has a hardware error."""
+        read_values = Mock(side_effect=[[49.0, 60.0, 60.0], OSError('Host is down'), [49.0],
+                                        [49.0, 60.0, 60.0]])
+        bank = SensorBank(self.NAMES, [50, 50, 50], read_values=read_values, name='Bank')
+        bank.poll()
+        self.assertEqual(3, len(bank.poll()))
+        self.assertEqual([True, True, True], list(bank.hw_error_on))
+        self.assertEqual([True, False, False], list(bank.alarm_on))
+        self.assertIn('ERROR:homemonitor.sensorbank:Bank - Failed to read sensors: Host is down',
+                      logs.output)
+        # One value instead of three, so still in error.
+        self.assertEqual([], bank.poll())
+        self.assertIn('ERROR:homemonitor.sensorbank:Bank - Failed to read sensors: '
+                      'SensorBank has 3 sensors, but 1 values!',
+                      logs.output)
+        self.assertEqual(3, len(bank.poll()))
+        self.assertEqual([False, False, False], list(bank.hw_error_on))
+
+    def test_invalid_size(self):
+        """There must be one threshold and one value per sensor."""
+        with self.assertRaisesRegex(ValueError, 'SensorBank has 3 sensors, but 2 thresholds!'):
+            SensorBank(self.NAMES, [50, 50])
+        bank = SensorBank(self.NAMES, [50, 50, 50])
+        with self.assertRaisesRegex(ValueError, 'SensorBank has 3 sensors, but 1 values!'):
+            bank.update([50])
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed.')
+class SensorBankEventLoopTestCase(unittest.TestCase):
+    """Tests the event loop polling a SensorBank."""
+    def test_alarm_mail(self):
+        """The bank's sensors send alarm emails after the sensors."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        readings = iter([[49.0, 60.0], [60.0, 60.0]])
+        bank = SensorBank(['Simulated/0', 'Simulated/1'], [50, 50],
+                          read_values=lambda: next(readings))
+        sensor1 = MockSensor(poll_results=[True, True])
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=.001,
+                              loop_forever=False,
+                              banks=[bank])
+
+        eventloop.run()
+        self.assertEqual([Message('MockSensor is on.', 'MockSensor is on.'),
+                          Message('Simulated/0 is on.', 'Simulated/0 is on.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+        mailqueue.add.reset_mock()
+        eventloop.run()
+        self.assertEqual([Message('Simulated/0 is off.', 'Simulated/0 is off.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+
+    def test_poll_interval(self):
+        """A bank is polled at its own interval."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        bank = SensorBank(['Simulated/0'], [50], read_values=Mock(return_value=[60.0]),
+                          poll_interval_in_seconds=3600)
+        sensor1 = MockSensor(poll_results=[False, False])
+        # noinspection PyTypeChecker
+        eventloop = EventLoop(mailqueue,
+                              [sensor1],
+                              poll_interval_in_seconds=.001,
+                              loop_forever=False,
+                              banks=[bank])
+        eventloop.run()
+        eventloop.run()
+        self.assertEqual(2, sensor1.poll_results_index)
+        self.assertEqual(0, bank.read_values.call_count)
+
+    def test_async(self):
+        """The asyncio event loop reads the bank on a thread."""
+        mailqueue = Mock(MailQueue, autospec=True)
+        threads = []
+
+        def read_values():
+            """Records the thread reading the values."""
+            threads.append(threading.current_thread())
+            return [49.0]
+
+        bank = SensorBank(['Simulated/0'], [50], read_values=read_values,
+                          poll_interval_in_seconds=.001)
+        # noinspection PyTypeChecker
+        eventloop = AsyncEventLoop(mailqueue, [], loop_forever=False, banks=[bank])
+        eventloop.run()
+        self.assertEqual([Message('Simulated/0 is on.', 'Simulated/0 is on.')],
+                         [call[0][0] for call in mailqueue.add.call_args_list])
+        self.assertNotEqual(threading.main_thread(), threads[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
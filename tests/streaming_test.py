@@ -0,0 +1,91 @@
+"""Tests Ewma, RateOfChange and TrendAlarm."""
+import unittest
+
+from homemonitor.streaming import Ewma, RateOfChange, TrendAlarm
+
+
+class EwmaTestCase(unittest.TestCase):
+    """Tests Ewma."""
+    def test_half_life(self):
+        """After one half life, the average is half way to the new value."""
+        average = Ewma(3600)
+        self.assertEqual(60.0, average.update(0, 60.0))
+        self.assertAlmostEqual(55.0, average.update(3600, 50.0))
+        self.assertAlmostEqual(52.5, average.update(7200, 50.0))
+
+    def test_interval(self):
+        """Readings close together move the average less."""
+        average = Ewma(3600)
+        average.update(0, 60.0)
+        self.assertLess(average.update(60, 50.0), 60.0)
+        self.assertGreater(average.value, 59.0)
+
+    def test_old_reading(self):
+        """A reading that is not newer is ignored."""
+        average = Ewma(3600)
+        average.update(100, 60.0)
+        self.assertEqual(60.0, average.update(100, 10.0))
+        self.assertEqual(60.0, average.update(50, 10.0))
+
+
+class RateOfChangeTestCase(unittest.TestCase):
+    """Tests RateOfChange."""
+    def test_rate(self):
+        """The rate is per hour, whatever the interval."""
+        for interval in [60, 900]:
+            rate = RateOfChange(3600)
+            self.assertEqual(0.0, rate.update(0, 70.0))
+            for second in range(interval, 20 * 3600, interval):
+                rate.update(second, 70.0 - second / 900)
+            self.assertAlmostEqual(-4.0, rate.per_hour, places=3)
+
+    def test_first_change(self):
+        """The first change is smoothed, starting from no change."""
+        rate = RateOfChange(3600)
+        rate.update(0, 68.0)
+        self.assertGreater(rate.update(60, 67.82), -0.2)
+
+    def test_smoothed(self):
+        """One odd reading only moves the rate part of the way."""
+        rate = RateOfChange(3600)
+        rate.update(0, 70.0)
+        rate.update(900, 70.0)
+        self.assertGreater(rate.update(1800, 69.0), -4.0)
+
+
+class TrendAlarmTestCase(unittest.TestCase):
+    """Tests TrendAlarm."""
+    def test_dropping(self):
+        """The alarm goes on while falling faster than the maximum drop."""
+        trend = TrendAlarm(max_drop_per_hour=5)
+        self.assertFalse(trend.update(0, 68.0))
+        self.assertFalse(trend.update(900, 67.5))
+        self.assertFalse(trend.update(1800, 65.5), 'One fast drop is smoothed out.')
+        for second in range(2700, 9000, 900):
+            trend.update(second, 65.5 - (second - 1800) / 450)
+        self.assertTrue(trend.update(9000, 49.5))
+        self.assertEqual('falling 6.4 per hour', trend.reason())
+        for second in range(9900, 40000, 900):
+            trend.update(second, 49.5)
+        self.assertFalse(trend.update(40500, 49.5))
+        self.assertEqual('', trend.reason())
+
+    def test_noise(self):
+        """Readings jumping by the sensor's resolution never set off the alarm."""
+        for interval, step in [(60, .18), (900, 1.8)]:
+            trend = TrendAlarm(max_drop_per_hour=5)
+            for reading in range(100):
+                value = 68.0 - step * (reading % 2)
+                self.assertFalse(trend.update(reading * interval, value), reading)
+
+    def test_below_average(self):
+        """The alarm goes on while the moving average is below the minimum."""
+        trend = TrendAlarm(min_average=50)
+        self.assertFalse(trend.update(0, 52.0))
+        self.assertFalse(trend.update(60, 40.0), 'One reading barely moves the average.')
+        self.assertTrue(trend.update(7200, 40.0))
+        self.assertEqual('averaging 43.0', trend.reason())
+
+
+if __name__ == '__main__':
+    unittest.main()
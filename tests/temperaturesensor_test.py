@@ -6,6 +6,7 @@ from configparser import ConfigParser
 
 from loggingtestcase import capturelogs
 
+from homemonitor.rule import Rule
 from homemonitor.temperaturesensor import TemperatureSensor
 
 
@@ -21,6 +22,16 @@ class TemperatureSensorFromConfigTestCase(unittest.TestCase):
     temperature=60
     gpio=25
     model=dht11
+    poll_interval_in_seconds=60
+    poll_timeout_in_seconds=45
+    read_attempts=3
+    cache_ttl_in_seconds=5
+    history_size=96
+    hysteresis_in_degrees=1.5
+    debounce_readings=2
+    max_drop_per_hour=5
+    min_average=58
+    trend_half_life_in_seconds=1800
     
     [Other_FirstFloor]
     temperature=10
@@ -37,11 +48,29 @@ class TemperatureSensorFromConfigTestCase(unittest.TestCase):
         self.assertEqual(50, sensors[0].temperature)
         self.assertEqual(4, sensors[0].gpio)
         self.assertEqual('AM2302', sensors[0].model)
+        self.assertIsNone(sensors[0].poll_interval_in_seconds)
+        self.assertEqual(TemperatureSensor.DEFAULT_POLL_TIMEOUT,
+                         sensors[0].poll_timeout_in_seconds)
+        self.assertEqual(TemperatureSensor.DEFAULT_READ_ATTEMPTS, sensors[0].read_attempts)
 
         self.assertEqual('TemperatureSensor/SecondFloor', sensors[1].name)
         self.assertEqual(60, sensors[1].temperature)
         self.assertEqual(25, sensors[1].gpio)
         self.assertEqual('DHT11', sensors[1].model)
+        self.assertEqual(60, sensors[1].poll_interval_in_seconds)
+        self.assertEqual(45, sensors[1].poll_timeout_in_seconds)
+        self.assertEqual(3, sensors[1].read_attempts)
+        self.assertEqual(5, sensors[1].cache_ttl_in_seconds)
+        self.assertEqual(96, sensors[1].history.capacity)
+        self.assertEqual(1.5, sensors[1].hysteresis_in_degrees)
+        self.assertEqual(2, sensors[1].debounce_readings)
+        self.assertEqual(0, sensors[0].hysteresis_in_degrees)
+        self.assertEqual(1, sensors[0].debounce_readings)
+        self.assertIsNone(sensors[0].trend)
+        self.assertEqual(5, sensors[1].trend.max_drop_per_hour)
+        self.assertEqual(58, sensors[1].trend.min_average)
+        self.assertEqual(1800, sensors[1].trend.average.half_life_in_seconds)
+        self.assertEqual(TemperatureSensor.DEFAULT_HISTORY_SIZE, sensors[0].history.capacity)
 
         self.assertEqual(
             'INFO:homemonitor.sensor:Created TemperatureSensor TemperatureSensor/Basement '
@@ -54,6 +83,36 @@ class TemperatureSensorFromConfigTestCase(unittest.TestCase):
             'DHT11.',
             logs.output[1])
 
+    RULE_CONFIG = '''
+    [TemperatureSensor_Garage]
+    rule=temp_f < 35 or humidity > 85
+    gpio=17
+    model=DHT22
+    '''
+
+    @capturelogs()
+    def test_rule(self, logs):
+        """A rule replaces the temperature threshold."""
+        cfg = ConfigParser()
+        cfg.read_string(self.RULE_CONFIG)
+        sensor = TemperatureSensor.from_config(cfg)[0]
+        self.assertIsNone(sensor.temperature)
+        self.assertEqual('temp_f < 35 or humidity > 85', str(sensor.rule))
+        self.assertEqual(
+            'INFO:homemonitor.sensor:Created TemperatureSensor TemperatureSensor/Garage '
+            'with alarm rule "temp_f < 35 or humidity > 85", connected to GPIO 17, and model '
+            'DHT22.',
+            logs.output[0])
+
+    def test_rule_invalid(self):
+        """An invalid rule is found when the config file is read."""
+        cfg = ConfigParser()
+        cfg.read_string(self.RULE_CONFIG.replace('humidity > 85', 'open("x")'))
+        with self.assertRaisesRegex(ValueError,
+                                    r'For TemperatureSensor/Garage, Rule "temp_f < 35 or '
+                                    r'open\("x"\)" is not valid: Call is not allowed.'):
+            TemperatureSensor.from_config(cfg)
+
     FAILURE_CONFIG = '''
     [TemperatureSensor_Basement]
     temperature=50
@@ -74,12 +133,16 @@ class TemperatureSensorFromConfigTestCase(unittest.TestCase):
 
 class TemperatureSensorWithPatchTestcase(unittest.TestCase):
     """Tests patching calls to Adafruit_DHT module."""
+    def setUp(self):
+        """Readings from other tests are not reused."""
+        TemperatureSensor.READING_CACHE.clear()
+
     @capturelogs('homemonitor.sensor', 'DEBUG')
     def test_alarm_off(self, logs):
         """Alarm is off."""
         # Module Adafruit_DHT is only installed on Raspberry Pi, so mock it!
         adafruit_patch = MagicMock()
-        adafruit_patch.read_retry = MagicMock(return_value=(0, 16))
+        adafruit_patch.read = MagicMock(return_value=(0, 16))
         adafruit_patch.DHT22 = 'MockDTH22'
         with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
             sensor = TemperatureSensor('TEST', 55, 4, 'DHT22')
@@ -91,24 +154,41 @@ class TemperatureSensorWithPatchTestcase(unittest.TestCase):
             self.assertFalse(sensor.hw_error_on,
                              'The hardware error alarm should not be on.')
 
-            # Verify read_retry() was called with correct arguments.
+            # Verify read() was called with correct arguments.
             self.assertEqual('MockDTH22',
-                             adafruit_patch.read_retry.call_args_list[0][0][0],
-                             'adafruit_patch.read_retry() should be called with sensor type '
+                             adafruit_patch.read.call_args_list[0][0][0],
+                             'adafruit_patch.read() should be called with sensor type '
                              'MockDTH22.')
             self.assertEqual(4,
-                             adafruit_patch.read_retry.call_args_list[0][0][1],
-                             'adafruit_patch.read_retry() should be called with gpio pin 4.')
+                             adafruit_patch.read.call_args_list[0][0][1],
+                             'adafruit_patch.read() should be called with gpio pin 4.')
 
             # Verify logging is correct.
-            self.assertEqual('DEBUG:homemonitor.sensor:TemperatureSensor TEST is detecting 60 '
+            self.assertEqual('DEBUG:homemonitor.sensor:TemperatureSensor TEST is detecting 60.8 '
                              'degrees Fahrenheit',
                              logs.output[1])
 
+    def test_reading(self):
+        """Temperature and humidity come from one read, without rounding."""
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(side_effect=[(None, None), (45.5, 12.5)])
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', 55, 4, 'DHT22')
+            sensor.status()
+            sensor.status()
+            self.assertEqual(12.5, sensor.reading.temperature_celsius)
+            self.assertEqual(54.5, sensor.reading.temperature_fahrenheit)
+            self.assertEqual(45.5, sensor.reading.humidity)
+            self.assertEqual(2, sensor.reading.attempts)
+            self.assertGreaterEqual(sensor.reading.latency_in_seconds, 0)
+            self.assertIsNotNone(sensor.reading_timestamp)
+            self.assertTrue(sensor.alarm_on, '54.5 degrees is below 55.')
+            self.assertEqual(2, adafruit_patch.read.call_count)
+
     def test_alarm_on(self):
         """Alarm is on."""
         adafruit_patch = MagicMock()
-        adafruit_patch.read_retry = MagicMock(return_value=(0, 10))
+        adafruit_patch.read = MagicMock(return_value=(0, 10))
         with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
             sensor = TemperatureSensor('TEST', 55, 4, 'DHT22')
             sensor.status()
@@ -116,14 +196,106 @@ class TemperatureSensorWithPatchTestcase(unittest.TestCase):
                             'The alarm should be on.')
 
     def test_hw_error_on(self):
-        """Hardware error is on."""
+        """Hardware error is on, after every read attempt fails."""
         adafruit_patch = MagicMock()
-        adafruit_patch.read_retry = MagicMock(return_value=(None, None))
+        adafruit_patch.read = MagicMock(return_value=(None, None))
         with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
             sensor = TemperatureSensor('TEST', 55, 4, 'DHT22')
             sensor.status()
+            self.assertFalse(sensor.hw_error_on,
+                             'The read should be retried before it is a hardware error.')
+            self.assertIsNotNone(sensor.retry_in_seconds)
+            while sensor.retry_in_seconds is not None:
+                sensor.status()
             self.assertTrue(sensor.hw_error_on,
                             'The hardware error should be on.')
+            self.assertEqual(TemperatureSensor.DEFAULT_READ_ATTEMPTS,
+                             adafruit_patch.read.call_count)
+
+    def test_retry_then_read(self):
+        """The first read fails, and the retry works."""
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(side_effect=[(None, None), (0, 10)])
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', 55, 4, 'DHT22')
+            sensor.status()
+            self.assertFalse(sensor.alarm_on)
+            sensor.status()
+            self.assertIsNone(sensor.retry_in_seconds)
+            self.assertTrue(sensor.alarm_on)
+            self.assertFalse(sensor.hw_error_on)
+
+    def test_driver_loaded_once(self):
+        """The driver is only looked up the first time the sensor is polled."""
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(return_value=(0, 16))
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', 55, 4, 'DHT22', cache_ttl_in_seconds=0)
+            sensor.status()
+        # The driver is no longer importable, but the sensor still has it.
+        sensor.status()
+        self.assertEqual(2, adafruit_patch.read.call_count)
+
+    def test_shared_reading(self):
+        """Sensors on the same pin share a recent reading."""
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(return_value=(0, 10))
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor1 = TemperatureSensor('TEST1', 55, 4, 'DHT22')
+            sensor2 = TemperatureSensor('TEST2', 40, 4, 'DHT22')
+            sensor1.status()
+            sensor2.status()
+            self.assertTrue(sensor1.alarm_on)
+            self.assertFalse(sensor2.alarm_on)
+            self.assertEqual(1, adafruit_patch.read.call_count)
+
+    def test_hysteresis(self):
+        """Once on, the alarm stays on until the temperature is above the hysteresis band."""
+        # 54.5, 55.4, 56.3, 55.4 and 54.5 degrees Fahrenheit.
+        celsius = [12.5, 13, 13.5, 13, 12.5]
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(side_effect=[(0, value) for value in celsius])
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', 55, 4, 'DHT22', cache_ttl_in_seconds=0,
+                                       hysteresis_in_degrees=1)
+            alarms = [sensor.status().alarm_on for _ in celsius]
+            self.assertEqual([True, True, False, False, True], alarms)
+
+    def test_hysteresis_debounce(self):
+        """The hysteresis band is only used once the alarm is on after debouncing."""
+        # 49.1 or 50.9 degrees Fahrenheit.
+        celsius = [9.5, 10.5, 10.5, 9.5, 9.5, 9.5, 10.5]
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(side_effect=[(0, value) for value in celsius])
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', 50, 4, 'DHT22', cache_ttl_in_seconds=0,
+                                       hysteresis_in_degrees=2, debounce_readings=3)
+            alarms = [sensor.status().alarm_on for _ in celsius]
+            self.assertEqual([False, False, False, False, False, True, True], alarms)
+
+    def test_rule(self):
+        """The rule decides if the alarm is on."""
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(side_effect=[(50, 20), (90, 20), (None, 20)])
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', None, 4, 'DHT22', cache_ttl_in_seconds=0,
+                                       rule=Rule('temp_c < 10 or humidity > 85',
+                                                 TemperatureSensor.RULE_VARIABLES))
+            self.assertFalse(sensor.status().alarm_on)
+            self.assertTrue(sensor.status().alarm_on)
+            status = sensor.status()
+            self.assertTrue(status.hw_error_on, 'The humidity was not read.')
+
+    def test_history(self):
+        """Each reading's temperature is kept in the history, once."""
+        adafruit_patch = MagicMock()
+        adafruit_patch.read = MagicMock(return_value=(0, 10))
+        with patch.dict("sys.modules", Adafruit_DHT=adafruit_patch):
+            sensor = TemperatureSensor('TEST', 55, 4, 'DHT22', history_size=10)
+            sensor.status()
+            sensor.status()
+            self.assertEqual([50.0], sensor.history.window())
+            self.assertEqual(sensor.reading_timestamp, sensor.history.latest()[0])
 
 
 class TemperatureSensorManualTestcase(unittest.TestCase):
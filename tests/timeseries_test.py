@@ -0,0 +1,271 @@
+"""Tests TimeSeriesLog and TimeSeriesStore."""
+import os
+import tempfile
+import unittest
+from configparser import ConfigParser
+
+from loggingtestcase import capturelogs
+
+from homemonitor.rollup import Rollup, RollupRow
+from homemonitor.timeseries import TimeSeriesLog, TimeSeriesStore, RollupLog
+
+
+class TimeSeriesLogTestCase(unittest.TestCase):
+    """Tests TimeSeriesLog."""
+    def setUp(self):
+        """Creates a log in a temporary directory, with a fake clock."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.tslog')
+        self.now = 0.0
+        self.log = self._open()
+
+    def tearDown(self):
+        self.log.close()
+        self.directory.cleanup()
+
+    def _open(self, batch_size=4, fsync_interval_in_seconds=60):
+        """Opens the log."""
+        return TimeSeriesLog(self.path, batch_size, fsync_interval_in_seconds,
+                             clock=lambda: self.now)
+
+    def _file_size(self):
+        return os.path.getsize(self.path)
+
+    def test_batched_writes(self):
+        """Pairs are written once the batch is full."""
+        for second in range(3):
+            self.log.append(second, 50.0)
+        self.assertEqual(len(TimeSeriesLog.MAGIC), self._file_size())
+        self.log.append(3, 50.0)
+        self.assertEqual(len(TimeSeriesLog.MAGIC) + 4 * 16, self._file_size())
+
+    def test_scheduled_writes(self):
+        """Pairs are written once the fsync interval has passed."""
+        self.log.append(0, 50.0)
+        self.now += 60
+        self.log.append(1, 51.0)
+        self.assertEqual(len(TimeSeriesLog.MAGIC) + 2 * 16, self._file_size())
+
+    def test_reopen(self):
+        """Pairs are still there after the log is closed and opened again."""
+        for second in range(6):
+            self.log.append(second, second + .5)
+        self.log.close()
+        self.log = self._open()
+        self.assertEqual(6, len(self.log))
+        self.assertEqual((5, 5.5), self.log.latest())
+        self.assertEqual([(second, second + .5) for second in range(6)], list(self.log.query()))
+
+    def test_query(self):
+        """Queries include pairs on disk and in memory, from since up to until."""
+        for second in range(10):
+            self.log.append(second, second * 10)
+        self.assertEqual([(2, 20), (3, 30), (4, 40)], list(self.log.query(since=2, until=5)))
+        self.assertEqual([(8, 80), (9, 90)], list(self.log.query(since=7.5)))
+        self.assertEqual([(0, 0), (1, 10)], list(self.log.query(until=2)))
+        self.assertEqual([], list(self.log.query(since=20)))
+
+    def test_query_binary_search(self):
+        """A query finds where it starts, including between and at repeated timestamps."""
+        self.log.close()
+        self.log = self._open(batch_size=1000)
+        timestamps = [second // 2 for second in range(1000)]
+        for value, timestamp in enumerate(timestamps):
+            self.log.append(timestamp, value)
+        self.log.flush()
+        for since in [-1, 0, 0.5, 1, 250, 250.5, 499, 499.5, 500]:
+            self.assertEqual([value for value, timestamp in enumerate(timestamps)
+                              if timestamp >= since],
+                             [value for _, value in self.log.query(since=since)], msg=since)
+
+    @capturelogs('homemonitor.timeseries', 'WARNING')
+    def test_partial_write(self, logs):
+        """A partly written pair at the end of the file is removed."""
+        for second in range(4):
+            self.log.append(second, 50.0)
+        self.log.close()
+        with open(self.path, 'ab') as file:
+            file.write(b'\x00' * 5)
+        self.log = self._open()
+        self.assertEqual(4, len(self.log))
+        self.assertEqual(len(TimeSeriesLog.MAGIC) + 4 * 16, self._file_size())
+        self.assertEqual(1, len(logs.output))
+
+    @capturelogs('homemonitor.timeseries', 'WARNING')
+    def test_older_reading_dropped(self, logs):
+        """A pair older than the newest one is dropped."""
+        self.log.append(10, 50.0)
+        self.log.append(5, 49.0)
+        self.assertEqual([(10, 50.0)], list(self.log.query()))
+        self.assertEqual(1, len(logs.output))
+
+    def test_pop(self):
+        """The newest pair can be removed, from memory or from disk."""
+        for second in range(5):
+            self.log.append(second, 50.0)
+        self.assertEqual((4, 50.0), self.log.pop())
+        self.assertEqual((3, 50.0), self.log.pop())
+        self.assertEqual((2, 50.0), self.log.latest())
+        self.log.close()
+        self.log = self._open()
+        self.assertEqual(3, len(self.log))
+        self.assertEqual(len(TimeSeriesLog.MAGIC) + 3 * 16, self._file_size())
+
+    def test_read_only(self):
+        """A read only log can be read while another log is writing the file."""
+        for second in range(4):
+            self.log.append(second, 50.0)
+        with open(self.path, 'ab') as file:
+            file.write(b'\x00' * 5)
+        reader = TimeSeriesLog(self.path, read_only=True)
+        self.assertEqual(4, len(reader))
+        self.assertEqual((3, 50.0), reader.latest())
+        self.assertEqual(len(TimeSeriesLog.MAGIC) + 4 * 16 + 5, self._file_size())
+        self.assertEqual([(2, 50.0), (3, 50.0)], list(reader.query(since=2)))
+        reader.close()
+
+    def test_read_only_empty(self):
+        """A read only log of an empty file has no pairs."""
+        path = os.path.join(self.directory.name, 'empty.tslog')
+        open(path, 'wb').close()
+        reader = TimeSeriesLog(path, read_only=True)
+        self.assertEqual(0, len(reader))
+        self.assertIsNone(reader.latest())
+        self.assertEqual([], list(reader.query()))
+        reader.close()
+        self.assertEqual(0, os.path.getsize(path))
+
+    def test_not_a_log(self):
+        """Opening a file that is not a log fails."""
+        path = os.path.join(self.directory.name, 'other')
+        with open(path, 'wb') as file:
+            file.write(b'something else')
+        with self.assertRaisesRegex(ValueError, 'is not a time series log.'):
+            TimeSeriesLog(path)
+
+
+class RollupLogTestCase(unittest.TestCase):
+    """Tests RollupLog."""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.tsroll')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_rows(self):
+        """Rows are stored and read back."""
+        log = RollupLog(self.path, batch_size=1)
+        rows = [RollupRow.first(3600, 50.0).add(52.0), RollupRow.first(7200, 49.5)]
+        for row in rows:
+            log.append(*row)
+        log.close()
+        log = RollupLog(self.path)
+        self.assertEqual(rows, list(log.query()))
+        self.assertEqual(rows[1:], list(log.query(since=3601)))
+        self.assertEqual(rows[1], log.latest())
+        self.assertEqual(rows[1], log.pop())
+        log.close()
+
+    def test_not_a_rollup_log(self):
+        """A log of readings is not a log of rollups."""
+        TimeSeriesLog(self.path).close()
+        with self.assertRaisesRegex(ValueError, 'is not a time series log.'):
+            RollupLog(self.path)
+
+
+class TimeSeriesStoreTestCase(unittest.TestCase):
+    """Tests TimeSeriesStore."""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_from_config(self):
+        """Reads the history section."""
+        cfg = ConfigParser()
+        cfg.read_string('''
+            [history]
+            directory={}
+            batch_size=8
+            fsync_interval_in_seconds=30
+            '''.format(os.path.join(self.directory.name, 'history')))
+        store = TimeSeriesStore.from_config(cfg)
+        self.assertTrue(os.path.isdir(store.directory))
+        self.assertEqual(8, store.batch_size)
+        self.assertEqual(30, store.fsync_interval_in_seconds)
+
+    def test_from_config_no_section(self):
+        """Without a history section, readings are not stored."""
+        self.assertIsNone(TimeSeriesStore.from_config(ConfigParser()))
+
+    def test_attach(self):
+        """Each sensor's readings go to its own file."""
+        store = TimeSeriesStore(self.directory.name)
+        sensor = MockSensor('TemperatureSensor/Basement')
+        store.attach([sensor])
+        sensor.recorders[0].append(100, 50.0)
+        store.close()
+        self.assertEqual(os.path.join(self.directory.name, 'TemperatureSensor_Basement.tslog'),
+                         sensor.recorders[0].path)
+        self.assertEqual([(100, 50.0)], list(TimeSeriesLog(sensor.recorders[0].path).query()))
+
+    def test_rollups(self):
+        """Rollups are stored, and the hour in progress is picked up after a restart."""
+        store = TimeSeriesStore(self.directory.name)
+        sensor = MockSensor('TemperatureSensor/Basement')
+        store.attach([sensor])
+        for timestamp, value in [(3600, 50.0), (3660, 52.0), (7200, 49.0)]:
+            for rollup in sensor.rollups.values():
+                rollup.append(timestamp, value)
+        store.close()
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name,
+                                                    'TemperatureSensor_Basement.hour.tsroll')))
+
+        store = TimeSeriesStore(self.directory.name)
+        sensor = MockSensor('TemperatureSensor/Basement')
+        store.attach([sensor])
+        hour = sensor.rollups['hour']
+        self.assertEqual(RollupRow.first(7200, 49.0), hour.current)
+        self.assertEqual([RollupRow.first(3600, 50.0).add(52.0), RollupRow.first(7200, 49.0)],
+                         list(hour.rows()))
+        self.assertEqual(3, len(list(sensor.rollups['minute'].rows())))
+        store.close()
+
+    def test_query(self):
+        """Readings and rollups are read back by sensor name and resolution."""
+        store = TimeSeriesStore(self.directory.name)
+        sensor = MockSensor('TemperatureSensor/Basement')
+        store.attach([sensor])
+        for timestamp, value in [(3600, 50.0), (3660, 52.0), (7200, 49.0)]:
+            sensor.recorders[0].append(timestamp, value)
+            for rollup in sensor.rollups.values():
+                rollup.append(timestamp, value)
+        store.close()
+
+        self.assertEqual([(3660, 52.0), (7200, 49.0)],
+                         list(store.query('TemperatureSensor/Basement', since=3601)))
+        self.assertEqual([RollupRow.first(3600, 50.0).add(52.0)],
+                         list(store.query('TemperatureSensor/Basement', 'hour', until=7200)))
+
+    def test_query_errors(self):
+        """Unknown resolutions and sensors are errors."""
+        store = TimeSeriesStore(self.directory.name)
+        with self.assertRaisesRegex(ValueError, 'Resolution week is not valid!'):
+            store.query('TemperatureSensor/Basement', 'week')
+        with self.assertRaisesRegex(ValueError, 'There is no history for TemperatureSensor/Attic'):
+            store.query('TemperatureSensor/Attic')
+
+
+class MockSensor(object):
+    """Has what TimeSeriesStore needs from a sensor."""
+    def __init__(self, name):
+        self.name = name
+        self.recorders = []
+        self.rollups = {resolution: Rollup(seconds)
+                        for resolution, seconds in Rollup.RESOLUTIONS.items()}
+
+
+if __name__ == '__main__':
+    unittest.main()
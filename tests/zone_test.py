@@ -0,0 +1,152 @@
+"""Tests Zone."""
+import unittest
+from configparser import ConfigParser
+from unittest.mock import Mock
+
+from homemonitor.sensor import SensorStatus
+from homemonitor.zone import Zone
+
+
+def _status(name, alarm_on=False, value=None, hw_error_on=False):
+    """Returns a status with only the fields a zone uses."""
+    return SensorStatus(name, alarm_on, False, hw_error_on, False, None, None, value)
+
+
+class ZoneTestCase(unittest.TestCase):
+    """Tests Zone."""
+    MEMBERS = ['Sensor/A', 'Sensor/B', 'Sensor/C']
+
+    def test_any(self):
+        """The alarm is on while any sensor is in alarm."""
+        zone = Zone('Zone/Test', self.MEMBERS)
+        self.assertTrue(zone.update(_status('Sensor/A', alarm_on=True)))
+        self.assertTrue(zone.alarm_on)
+        self.assertFalse(zone.update(_status('Sensor/B', alarm_on=True)))
+        self.assertFalse(zone.update(_status('Sensor/A')))
+        self.assertEqual(['Sensor/B'], zone.members_in_alarm)
+        self.assertTrue(zone.update(_status('Sensor/B')))
+        self.assertFalse(zone.alarm_on)
+
+    def test_all(self):
+        """The alarm is on only while every sensor is in alarm."""
+        zone = Zone('Zone/Test', self.MEMBERS, mode='all')
+        self.assertFalse(zone.update(_status('Sensor/A', alarm_on=True)))
+        self.assertFalse(zone.update(_status('Sensor/B', alarm_on=True)))
+        # The same status twice is only counted once.
+        self.assertFalse(zone.update(_status('Sensor/B', alarm_on=True)))
+        self.assertTrue(zone.update(_status('Sensor/C', alarm_on=True)))
+        self.assertTrue(zone.update(_status('Sensor/A')))
+
+    def test_quorum(self):
+        """The alarm is on while at least quorum sensors are in alarm."""
+        zone = Zone('Zone/Test', self.MEMBERS, mode='quorum', quorum=2)
+        self.assertFalse(zone.update(_status('Sensor/A', alarm_on=True)))
+        self.assertTrue(zone.update(_status('Sensor/C', alarm_on=True)))
+        self.assertEqual(['Sensor/A', 'Sensor/C'], zone.members_in_alarm)
+        self.assertTrue(zone.update(_status('Sensor/A')))
+
+    def test_mean_below(self):
+        """The alarm is on while the mean of the latest values is below the temperature."""
+        zone = Zone('Zone/Test', self.MEMBERS, mode='mean_below', temperature=50)
+        self.assertIsNone(zone.mean)
+        self.assertFalse(zone.update(_status('Sensor/A', value=60.0)))
+        self.assertTrue(zone.update(_status('Sensor/B', value=38.0)))
+        self.assertAlmostEqual(49.0, zone.mean)
+        # The new value replaces the old one.
+        self.assertTrue(zone.update(_status('Sensor/B', value=42.0)))
+        self.assertAlmostEqual(51.0, zone.mean)
+        self.assertFalse(zone.update(_status('Sensor/C', value=50.0)))
+        self.assertAlmostEqual(152.0 / 3, zone.mean)
+
+    def test_mean_below_hw_error(self):
+        """A sensor with a hardware error is left out of the mean."""
+        zone = Zone('Zone/Test', self.MEMBERS, mode='mean_below', temperature=50)
+        zone.update(_status('Sensor/A', value=60.0))
+        zone.update(_status('Sensor/B', value=45.0))
+        self.assertTrue(zone.update(_status('Sensor/A', value=60.0, hw_error_on=True)))
+        self.assertAlmostEqual(45.0, zone.mean)
+
+    def test_invalid_mode(self):
+        """Invalid modes, or modes missing a setting, are rejected."""
+        with self.assertRaisesRegex(ValueError, 'mode some is not a valid mode!'):
+            Zone('Zone/Test', self.MEMBERS, mode='some')
+        with self.assertRaisesRegex(ValueError, 'needs a quorum!'):
+            Zone('Zone/Test', self.MEMBERS, mode='quorum')
+        with self.assertRaisesRegex(ValueError, 'needs a temperature!'):
+            Zone('Zone/Test', self.MEMBERS, mode='mean_below')
+
+    def test_repeated_member(self):
+        """A sensor listed twice is rejected, or mode all could never turn on."""
+        with self.assertRaisesRegex(ValueError, 'For Zone/Test, sensor Sensor/A is listed twice!'):
+            Zone('Zone/Test', ['Sensor/A', 'Sensor/B', 'Sensor/A'], mode='all')
+
+
+class ZoneFromConfigTest(unittest.TestCase):
+    """Tests creating zones from a config file."""
+    SUCCESS_CONFIG = '''
+    [Zone_Downstairs]
+    sensors=Basement, TemperatureSensor/Kitchen
+
+    [Zone_House]
+    sensors=Basement,Kitchen,Attic
+    mode=Quorum
+    quorum=2
+
+    [Zone_Upstairs]
+    sensors=Attic
+    mode=mean_below
+    temperature=55.5
+    '''
+
+    @staticmethod
+    def _sensors():
+        sensors = []
+        for name in ['Basement', 'Kitchen', 'Attic']:
+            sensor = Mock()
+            sensor.name = 'TemperatureSensor/' + name
+            sensors.append(sensor)
+        return sensors
+
+    def test_success(self):
+        """Create zones from configuration file."""
+        cfg = ConfigParser()
+        cfg.read_string(self.SUCCESS_CONFIG)
+        zones = Zone.from_config(cfg, self._sensors())
+        self.assertEqual(['Zone/Downstairs', 'Zone/House', 'Zone/Upstairs'],
+                         [zone.name for zone in zones])
+        self.assertEqual(['TemperatureSensor/Basement', 'TemperatureSensor/Kitchen'],
+                         zones[0].members)
+        self.assertEqual('any', zones[0].mode)
+        self.assertEqual('quorum', zones[1].mode)
+        self.assertEqual(2, zones[1].quorum)
+        self.assertEqual(55.5, zones[2].temperature)
+
+    def test_no_zones(self):
+        """No zone sections, no zones."""
+        cfg = ConfigParser()
+        self.assertEqual([], Zone.from_config(cfg, self._sensors()))
+
+    def test_unknown_sensor(self):
+        """Sensors must exist."""
+        cfg = ConfigParser()
+        cfg.read_string('''
+        [Zone_Garage]
+        sensors=Garage
+        ''')
+        with self.assertRaisesRegex(ValueError, 'For Zone/Garage, sensor Garage does not exist!'):
+            Zone.from_config(cfg, self._sensors())
+
+    def test_repeated_sensor(self):
+        """A sensor given twice, even by its short and full names, is rejected."""
+        cfg = ConfigParser()
+        cfg.read_string('''
+        [Zone_Downstairs]
+        sensors=Basement,TemperatureSensor/Basement
+        mode=all
+        ''')
+        with self.assertRaisesRegex(ValueError, 'TemperatureSensor/Basement is listed twice!'):
+            Zone.from_config(cfg, self._sensors())
+
+
+if __name__ == '__main__':
+    unittest.main()